@@ -0,0 +1 @@
+"""Reproducible benchmarks of the queue engine, run with `python -m benchmarks`."""
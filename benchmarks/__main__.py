@@ -0,0 +1,118 @@
+"""
+Run the queue engine benchmarks.
+
+    python -m benchmarks                            # every scenario, sizes 10^3 and 10^4
+    python -m benchmarks --sizes 1000 1000000 --scenarios flat wide_dag
+    python -m benchmarks --output after.json --compare before.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Optional
+
+from .scenarios import SCENARIOS, Scenario
+
+
+def _measure(scenario: Scenario, size: int, repeat: int, memory: bool) -> dict[str, Any]:
+    """Run a scenario `repeat` times and keep the fastest run, then once more under tracemalloc for peak memory."""
+    best_s = float("inf")
+    commands = 0
+    for _ in range(repeat):
+        run = scenario.setup(size)
+        gc.collect()
+        start = time.perf_counter()
+        commands = run()
+        best_s = min(best_s, time.perf_counter() - start)
+    peak_memory_bytes: Optional[int] = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        scenario.setup(size)()
+        peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "scenario": scenario.name,
+        "size": size,
+        "commands_processed": commands,
+        "seconds": best_s,
+        "commands_per_s": commands / best_s if best_s > 0 else None,
+        "us_per_command": best_s / commands * 1e6 if commands else None,
+        "peak_memory_bytes": peak_memory_bytes,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(results: list[dict[str, Any]], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["size"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared to {baseline_path} (>1 is faster):")
+    for result in results:
+        before = baseline.get((result["scenario"], result["size"]))
+        if before is None or not before["seconds"]:
+            continue
+        speedup = before["seconds"] / result["seconds"]
+        print(f"  {result['scenario']:<22} {result['size']:>9}  {speedup:6.2f}x")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--all-sizes", action="store_true", help="also run sizes above a scenario's max_size")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON file from a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    results: list[dict[str, Any]] = []
+    print(f"{'scenario':<22} {'size':>9} {'commands/s':>12} {'us/command':>11} {'peak MiB':>9}")
+    for name in args.scenarios:
+        scenario = SCENARIOS[name]
+        for size in args.sizes:
+            if size > scenario.max_size and not args.all_sizes:
+                continue
+            result = _measure(scenario, size, args.repeat, memory=not args.no_memory)
+            results.append(result)
+            peak = result["peak_memory_bytes"]
+            print(
+                f"{name:<22} {size:>9} {result['commands_per_s']:>12,.0f} {result['us_per_command']:>11.2f}"
+                f" {'-' if peak is None else f'{peak / 2**20:.1f}':>9}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "meta": {
+                        "commit": _git_commit(),
+                        "python": sys.version,
+                        "platform": platform.platform(),
+                        "timestamp": time.time(),
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.compare:
+        _compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""Benchmark scenarios for the queue engine, each builds a queue of `size` commands and processes it to completion."""
+
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandChain,
+    CommandChainBuilder,
+    CommandQueue,
+    CommandResponse,
+    DeferResponse,
+    DependencyEntry,
+    ExecutionResponse,
+    ThreadSafeCommandQueue,
+)
+
+# effectively unlimited, benchmarks always run the queue until it is empty
+_MAX_ITERATIONS = 1 << 62
+
+
+@dataclass
+class NoopArgs(CommandArgs):
+    pass
+
+
+@dataclass
+class ValueResponse(CommandResponse):
+    value: int = 0
+
+
+class NoopCommand(Command[NoopArgs, ValueResponse]):
+    ARGS = NoopArgs
+    _response_type = ValueResponse
+
+    def execute(self) -> ExecutionResponse:
+        return ExecutionResponse.success()
+
+
+@dataclass
+class DeferArgs(CommandArgs):
+    remaining_deferrals: list[int] = field(default_factory=lambda: [0])
+
+
+class DeferCommand(Command[DeferArgs, ValueResponse]):
+    ARGS = DeferArgs
+    _response_type = ValueResponse
+
+    def should_defer(self) -> DeferResponse:
+        if self.args.remaining_deferrals[0] > 0:
+            self.args.remaining_deferrals[0] -= 1
+            return DeferResponse.defer("benchmark deferral")
+        return DeferResponse.proceed()
+
+    def execute(self) -> ExecutionResponse:
+        return ExecutionResponse.success()
+
+
+@dataclass
+class WaitForChainArgs(CommandArgs):
+    chain: CommandChain[Any, Any]
+
+
+class WaitForChainCommand(Command[WaitForChainArgs, ValueResponse]):
+    """Defers until a chain produced its output, without a dependency edge."""
+
+    ARGS = WaitForChainArgs
+    _response_type = ValueResponse
+
+    def should_defer(self) -> DeferResponse:
+        if self.args.chain.response.output_data is None:
+            return DeferResponse.defer("waiting for the chain")
+        return DeferResponse.proceed()
+
+    def execute(self) -> ExecutionResponse:
+        return ExecutionResponse.success()
+
+
+@dataclass
+class IncrementArgs(CommandArgs):
+    value: int
+
+
+class IncrementCommand(Command[IncrementArgs, ValueResponse]):
+    ARGS = IncrementArgs
+    _response_type = ValueResponse
+
+    def execute(self) -> ExecutionResponse:
+        self.response.value = self.args.value + 1
+        return ExecutionResponse.success()
+
+
+@dataclass
+class Scenario:
+    """
+    A benchmark scenario.
+
+    Attributes:
+        name (str): Name of the scenario, used in reports.
+        description (str): What the scenario measures.
+        setup (Callable[[int], Callable[[], int]]): Builds the workload for a size, and returns a function that
+            processes it and returns the number of commands processed. Only that function is timed.
+        max_size (int): Largest size the scenario is run with by default, since some workloads grow superlinearly.
+    """
+
+    name: str
+    description: str
+    setup: Callable[[int], Callable[[], int]]
+    max_size: int = 1_000_000
+
+
+def _run(queue: CommandQueue) -> Callable[[], int]:
+    return lambda: queue.process_all(max_total_iterations=_MAX_ITERATIONS).num_commands_processed
+
+
+def flat(size: int, timing_queue_length: int = 0) -> Callable[[], int]:
+    queue = CommandQueue(timing_queue_length=timing_queue_length)
+    queue.submit_many(*(NoopCommand(NoopArgs()) for _ in range(size)))
+    return _run(queue)
+
+
+def flat_timed(size: int) -> Callable[[], int]:
+    return flat(size, timing_queue_length=1000)
+
+
+def deep_dag(size: int, depth: int = 20) -> Callable[[], int]:
+    """
+    Dependency paths of `depth` commands each, submitted in reverse so every pass can only complete one command per path.
+
+    Paths are kept short because a deferral reason embeds the repr of the dependency, which recurses through its own dependencies.
+    """
+    queue = CommandQueue()
+    for start in range(0, size, depth):
+        path: list[Command[Any, Any]] = [NoopCommand(NoopArgs())]
+        for _ in range(min(depth, size - start) - 1):
+            path.append(NoopCommand(NoopArgs(), dependencies=[DependencyEntry(path[-1])]))
+        queue.submit_many(*reversed(path))
+    return _run(queue)
+
+
+def wide_dag(size: int) -> Callable[[], int]:
+    """One root, `size - 2` commands depending on it, and one command depending on all of those."""
+    queue = CommandQueue()
+    root = NoopCommand(NoopArgs())
+    middle = [NoopCommand(NoopArgs(), dependencies=[root]) for _ in range(max(0, size - 2))]
+    sink = NoopCommand(NoopArgs(), dependencies=list(middle))
+    queue.submit_many(sink, *middle, root)
+    return _run(queue)
+
+
+def defer_heavy(size: int, deferrals: int = 5) -> Callable[[], int]:
+    queue = CommandQueue()
+    queue.submit_many(*(DeferCommand(DeferArgs([deferrals])) for _ in range(size)))
+    return _run(queue)
+
+
+def _increment_chain(length: int) -> CommandChainBuilder[int, int]:
+    builder = CommandChainBuilder[int, int].start(
+        0, lambda x: IncrementArgs(value=x), IncrementCommand, lambda response: response.value
+    )
+    for _ in range(length - 1):
+        builder = builder.then(
+            lambda x: IncrementArgs(value=x), IncrementCommand, lambda response: response.value
+        )
+    return builder
+
+
+def long_chain(size: int, same_pass: bool = False) -> Callable[[], int]:
+    """
+    A single chain of `size` links.
+
+    Each link is submitted to the back of the queue while the pass is running, so the whole chain completes in one
+    pass with or without `same_pass`, this measures the per-link overhead.
+    """
+    queue = CommandQueue()
+    queue.submit(_increment_chain(size).build(queue, same_pass=same_pass))
+    return _run(queue)
+
+
+def long_chain_same_pass(size: int) -> Callable[[], int]:
+    return long_chain(size, same_pass=True)
+
+
+def chain_with_pending(size: int, same_pass: bool = False, links: int = 100) -> Callable[[], int]:
+    """
+    A chain of `links` links next to `size` unrelated commands that wait for it to finish, on a `ThreadSafeCommandQueue`.
+
+    Links submitted during a pass wait in the inbox until the next one, so without `same_pass` every link costs a pass
+    over all the waiting commands. The fast lane runs the whole chain in the first pass.
+    """
+    queue = ThreadSafeCommandQueue()
+    chain = _increment_chain(links).build(queue, same_pass=same_pass)
+    queue.submit(chain)
+    queue.submit_many(*(WaitForChainCommand(WaitForChainArgs(chain)) for _ in range(size)))
+    # count completed commands rather than visits, so both variants report the same work
+    return lambda: queue.process_all(max_total_iterations=_MAX_ITERATIONS).num_successes
+
+
+def chain_with_pending_same_pass(size: int) -> Callable[[], int]:
+    return chain_with_pending(size, same_pass=True)
+
+
+def callback_heavy(size: int, callbacks: int = 10) -> Callable[[], int]:
+    queue = CommandQueue()
+    sink: list[int] = []
+    for _ in range(size):
+        command = NoopCommand(NoopArgs())
+        for _ in range(callbacks):
+            command.add_on_execute_callback(lambda _: sink.append(1))
+        queue.submit(command)
+    return _run(queue)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("flat", "Independent no-op commands", flat),
+        Scenario("flat_timed", "Independent no-op commands, timing enabled", flat_timed),
+        Scenario("deep_dag", "Dependency paths of 20 commands, one command per path completes per pass", deep_dag, max_size=100_000),
+        Scenario("wide_dag", "Fan-out from one root and fan-in to one sink", wide_dag),
+        Scenario("defer_heavy", "Commands that defer 5 times each", defer_heavy),
+        Scenario("long_chain", "One CommandChain, links are appended to the queue and complete in the same pass", long_chain, max_size=10_000),
+        Scenario("long_chain_same_pass", "One CommandChain with same_pass=True", long_chain_same_pass),
+        Scenario("chain_with_pending", "A 100-link CommandChain next to waiting commands, one link per pass", chain_with_pending, max_size=10_000),
+        Scenario("chain_with_pending_same_pass", "A 100-link CommandChain with same_pass=True next to waiting commands", chain_with_pending_same_pass),
+        Scenario("callback_heavy", "No-op commands with 10 execute callbacks each", callback_heavy),
+    ]
+}
@@ -0,0 +1,193 @@
+"""Adaptive per-type pass budgets, see `CommandQueue(admission_controller=...)`."""
+
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Optional, Type
+
+if TYPE_CHECKING:
+    from .Command import Command
+
+
+@dataclass
+class AdmissionBudget:
+    """
+    The state of one command type in an `AdmissionController`.
+
+    Attributes:
+        budget (float): Number of commands of the type each pass may process, rounded down (and at least 1).
+        avg_elapsed_ms (float): Moving average of the duration of `execute()`.
+        failure_rate (float): Moving average of the fraction of executions that failed.
+        executions (int): Number of executions observed.
+    """
+
+    budget: float
+    avg_elapsed_ms: float = 0.0
+    failure_rate: float = 0.0
+    executions: int = 0
+
+
+@dataclass
+class _AdmissionWindow:
+    """What one queue admitted and executed during a pass, handed to `AdmissionController._end_pass()`."""
+
+    admitted: dict[Type["Command[Any, Any]"], int] = field(default_factory=dict)
+    limited: set[Type["Command[Any, Any]"]] = field(default_factory=set)
+    execute_s: dict[Type["Command[Any, Any]"], float] = field(default_factory=dict)
+
+
+class AdmissionController:
+    """
+    Adjusts how many commands of each type a pass may process from the measured execution times and failures (AIMD).
+
+    Every command type starts with `max_budget`. After each pass, a type is considered overloaded if the moving average
+    of its `execute()` duration exceeds its latency target, if its moving failure rate exceeds `max_failure_rate`, or if
+    the pass spent more than `target_pass_ms` executing commands and the type took more than an even share of it.
+    The budget of an overloaded type is multiplied by `decrease`, the budget of a type that used up its budget without
+    being overloaded grows by `increase`. Expensive and failing types are therefore throttled first, and recover once
+    they are healthy again.
+
+    Commands over their type's budget are skipped for the rest of the pass, without running any lifecycle check, and
+    are processed on a later pass. With `shed=True` they are CANCELED with a `ReasonByAdmissionControl` instead.
+
+    One controller can be shared between queues (e.g. the shards of a `ShardedCommandQueue`), the budgets then apply to
+    each queue's passes.
+    """
+
+    def __init__(
+        self,
+        target_latency_ms: Optional[float] = None,
+        latency_targets: Optional[dict[Type["Command[Any, Any]"], float]] = None,
+        max_failure_rate: Optional[float] = None,
+        target_pass_ms: Optional[float] = None,
+        min_budget: int = 1,
+        max_budget: int = 1000,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        smoothing: float = 0.2,
+        shed: bool = False,
+    ):
+        """
+        Construct a new AdmissionController.
+
+        Args:
+            target_latency_ms (Optional[float], optional): Latency target of command types without a specific one, None for no target. Defaults to None.
+            latency_targets (Optional[dict[Type[Command], float]], optional): Latency targets by command type, subclasses inherit the target of their closest listed base class. Defaults to None.
+            max_failure_rate (Optional[float], optional): Failure rate above which a type is throttled, None to ignore failures. Defaults to None.
+            target_pass_ms (Optional[float], optional): Time a pass should spend executing commands, None for no target. Defaults to None.
+            min_budget (int, optional): Smallest budget of a type, so every type keeps making progress. Defaults to 1.
+            max_budget (int, optional): Largest budget of a type, and the budget of types that were never throttled. Defaults to 1000.
+            increase (float, optional): Amount added to the budget of a healthy type that used up its budget. Defaults to 1.0.
+            decrease (float, optional): Factor applied to the budget of an overloaded type. Defaults to 0.5.
+            smoothing (float, optional): Weight of each new execution in the moving averages. Defaults to 0.2.
+            shed (bool, optional): Cancel commands over budget instead of delaying them to a later pass. Defaults to False.
+
+        Raises:
+            ValueError: If a parameter is out of range.
+        """
+        if not 1 <= min_budget <= max_budget:
+            raise ValueError(f"Budgets must satisfy 1 <= min_budget <= max_budget, got {min_budget} and {max_budget}.")
+        if increase <= 0 or not 0 < decrease < 1 or not 0 < smoothing <= 1:
+            raise ValueError("increase must be positive, decrease and smoothing must be in (0, 1).")
+        if max_failure_rate is not None and not 0 <= max_failure_rate < 1:
+            raise ValueError(f"max_failure_rate must be in [0, 1), got {max_failure_rate}.")
+        self._target_latency_ms = target_latency_ms
+        self._latency_targets = dict(latency_targets or {})
+        self._max_failure_rate = max_failure_rate
+        self._target_pass_ms = target_pass_ms
+        self._min_budget = min_budget
+        self._max_budget = max_budget
+        self._increase = increase
+        self._decrease = decrease
+        self._smoothing = smoothing
+        self._shed = shed
+        self._lock = Lock()
+        self._budgets: dict[Type["Command[Any, Any]"], AdmissionBudget] = {}
+
+    @property
+    def shed(self) -> bool:
+        """Whether commands over budget are canceled instead of delayed."""
+        return self._shed
+
+    def latency_target_for(self, command_type: Type["Command[Any, Any]"]) -> Optional[float]:
+        """
+        Get the latency target of a command type.
+
+        Args:
+            command_type (Type[Command]): The command type.
+
+        Returns:
+            Optional[float]: The target in milliseconds, None if the type has none.
+        """
+        for base in command_type.__mro__:
+            if base in self._latency_targets:
+                return self._latency_targets[base]
+        return self._target_latency_ms
+
+    def budgets(self) -> dict[Type["Command[Any, Any]"], AdmissionBudget]:
+        """
+        Get the state of every command type seen so far.
+
+        Returns:
+            dict[Type[Command], AdmissionBudget]: Copies of the states, by command type.
+        """
+        with self._lock:
+            return {
+                command_type: AdmissionBudget(**vars(budget)) for command_type, budget in self._budgets.items()
+            }
+
+    def _state(self, command_type: Type["Command[Any, Any]"]) -> AdmissionBudget:
+        """The state of a command type, created with the maximum budget. Must hold the lock."""
+        budget = self._budgets.get(command_type)
+        if budget is None:
+            budget = self._budgets[command_type] = AdmissionBudget(budget=float(self._max_budget))
+        return budget
+
+    def _admit(self, window: _AdmissionWindow, command_type: Type["Command[Any, Any]"]) -> bool:
+        """Count a command against its type's budget for the current pass, False if the budget is used up."""
+        admitted = window.admitted.get(command_type, 0)
+        with self._lock:
+            budget = int(self._state(command_type).budget)
+        if admitted >= budget:
+            window.limited.add(command_type)
+            return False
+        window.admitted[command_type] = admitted + 1
+        return True
+
+    def _observe(self, command_type: Type["Command[Any, Any]"], elapsed: float, failed: bool) -> None:
+        """Record an execution that took `elapsed` seconds."""
+        with self._lock:
+            state = self._state(command_type)
+            elapsed_ms = elapsed * 1000
+            if state.executions == 0:
+                state.avg_elapsed_ms = elapsed_ms
+                state.failure_rate = float(failed)
+            else:
+                state.avg_elapsed_ms += self._smoothing * (elapsed_ms - state.avg_elapsed_ms)
+                state.failure_rate += self._smoothing * (float(failed) - state.failure_rate)
+            state.executions += 1
+
+    def _end_pass(self, window: _AdmissionWindow) -> None:
+        """Adjust the budgets of the types a pass admitted or limited."""
+        total_ms = sum(window.execute_s.values()) * 1000
+        pass_overloaded = self._target_pass_ms is not None and total_ms > self._target_pass_ms
+        fair_share_ms = total_ms / len(window.execute_s) if window.execute_s else 0.0
+        with self._lock:
+            for command_type in window.admitted.keys() | window.limited:
+                state = self._state(command_type)
+                latency_target = self.latency_target_for(command_type)
+                overloaded = (
+                    (latency_target is not None and state.executions > 0 and state.avg_elapsed_ms > latency_target)
+                    or (self._max_failure_rate is not None and state.failure_rate > self._max_failure_rate)
+                    or (pass_overloaded and window.execute_s.get(command_type, 0.0) * 1000 >= fair_share_ms)
+                )
+                if overloaded:
+                    # decrease from what the pass actually used, a budget far above it would take many passes to bite
+                    used = min(state.budget, float(window.admitted.get(command_type, 0)))
+                    state.budget = max(float(self._min_budget), used * self._decrease)
+                elif command_type in window.limited:
+                    state.budget = min(float(self._max_budget), state.budget + self._increase)
+
+    def reset(self) -> None:
+        """Forget every measurement, so every type is back to the maximum budget."""
+        with self._lock:
+            self._budgets.clear()
@@ -0,0 +1,139 @@
+"""Running command callbacks off the processing thread, see `CommandQueue(callback_dispatcher=...)`."""
+
+import asyncio
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from logging import getLogger
+from threading import Condition
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    from .Command import Command
+
+
+class CallbackDispatcher(ABC):
+    """
+    Runs batches of command callbacks somewhere else than the queue's processing thread.
+
+    Each batch calls the callbacks of one lifecycle event of one command, in registration order, recording a
+    `CallbackRecord` in the response as each callback completes. Implementations must run the batches of a command in
+    the order they were dispatched, batches of different commands may run concurrently.
+    """
+
+    @abstractmethod
+    def dispatch(self, command: "Command[Any, Any]", run: Callable[[], None]) -> None:
+        """
+        Schedule a batch of callbacks. Called by the processing thread, must not block.
+
+        Args:
+            command (Command): The command the callbacks belong to.
+            run (Callable[[], None]): Calls the callbacks, never raises.
+        """
+        raise NotImplementedError
+
+
+class ExecutorCallbackDispatcher(CallbackDispatcher):
+    """
+    Runs callbacks on a `concurrent.futures.Executor`, one drain task per command with pending callbacks.
+
+    A command's batches are queued behind each other and run by a single task at a time, so they keep their order
+    while the callbacks of different commands run in parallel.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, max_workers: int = 4):
+        """
+        Construct a new ExecutorCallbackDispatcher.
+
+        Args:
+            executor (Optional[Executor], optional): Executor to run callbacks on, None to create a thread pool owned by the dispatcher. Defaults to None.
+            max_workers (int, optional): Number of threads of the created thread pool. Defaults to 4.
+        """
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="CommandCallbacks"
+        )
+        self._condition = Condition()
+        # command -> batches not run yet, the first one is running if the command is in here
+        self._pending: dict["Command[Any, Any]", deque[Callable[[], None]]] = {}
+        self._outstanding = 0
+        self._logger = getLogger(__name__)
+
+    def dispatch(self, command: "Command[Any, Any]", run: Callable[[], None]) -> None:
+        with self._condition:
+            self._outstanding += 1
+            batches = self._pending.get(command)
+            if batches is not None:
+                batches.append(run)
+                return
+            self._pending[command] = deque([run])
+        self._executor.submit(self._drain, command)
+
+    def _drain(self, command: "Command[Any, Any]") -> None:
+        """Run the batches of a command until none are left."""
+        with self._condition:
+            batches = self._pending[command]
+        while True:
+            try:
+                batches[0]()
+            except Exception:
+                self._logger.exception("A callback batch of %r raised", command)
+            except BaseException:
+                # e.g. KeyboardInterrupt, let it escape this task but hand the remaining batches to a new one
+                if self._finish_batch(command, batches):
+                    self._executor.submit(self._drain, command)
+                raise
+            if not self._finish_batch(command, batches):
+                return
+
+    def _finish_batch(self, command: "Command[Any, Any]", batches: deque[Callable[[], None]]) -> bool:
+        """Drop the batch that just ran, returns True if the command has more batches to run."""
+        with self._condition:
+            batches.popleft()
+            self._outstanding -= 1
+            if self._outstanding == 0:
+                self._condition.notify_all()
+            if batches:
+                return True
+            del self._pending[command]
+            return False
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every dispatched callback has run.
+
+        Args:
+            timeout (Optional[float], optional): Maximum number of seconds to wait, None to wait forever. Defaults to None.
+
+        Returns:
+            bool: True if every callback has run, False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._outstanding == 0, timeout)
+
+    def shutdown(self) -> None:
+        """Wait for the dispatched callbacks, and shut down the executor if the dispatcher created it."""
+        self.wait_idle()
+        if self._owns_executor:
+            self._executor.shutdown()
+
+
+class AsyncioCallbackDispatcher(CallbackDispatcher):
+    """
+    Runs callbacks on an asyncio event loop, which must be running in another thread.
+
+    The loop runs scheduled calls one at a time in the order they were scheduled, so callbacks keep their order.
+    Callbacks should not block, since they hold up the loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        """
+        Construct a new AsyncioCallbackDispatcher.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The event loop to run callbacks on.
+        """
+        self._loop = loop
+
+    def dispatch(self, command: "Command[Any, Any]", run: Callable[[], None]) -> None:
+        self._loop.call_soon_threadsafe(run)
@@ -0,0 +1,135 @@
+"""Cooperative cancellation of running commands, see `Command.cancellation_token` and `CommandQueue.cancel()`."""
+
+import heapq
+from dataclasses import dataclass, field
+from itertools import count
+from threading import Condition, Event, Lock, Thread
+from time import perf_counter
+from typing import Optional
+
+from .CommandLifecycle import LifecycleResponseReason
+
+
+class CommandCanceledError(Exception):
+    """Raised by `CancellationToken.raise_if_canceled()`, the queue treats it as the end of a canceled execution."""
+
+    def __init__(self, reason: LifecycleResponseReason):
+        super().__init__(reason.reason)
+        self.reason = reason
+
+
+class CancellationToken:
+    """
+    A flag a running `execute()` can poll to stop early, tripped by `CommandQueue.cancel()` or an execution timeout.
+
+    Tripping the token does not interrupt `execute()`, which has to check `is_canceled` (or call `raise_if_canceled()`)
+    between units of work. Safe to use from any thread.
+    """
+
+    def __init__(self) -> None:
+        self._event = Event()
+        self._reason: Optional[LifecycleResponseReason] = None
+        self._lock = Lock()
+
+    @property
+    def is_canceled(self) -> bool:
+        """True once the token has been tripped."""
+        return self._event.is_set()
+
+    @property
+    def reason(self) -> Optional[LifecycleResponseReason]:
+        """Why the token was tripped, None if it has not been."""
+        return self._reason
+
+    def cancel(self, reason: LifecycleResponseReason) -> bool:
+        """
+        Trip the token. Only the first call has an effect.
+
+        Args:
+            reason (LifecycleResponseReason): Why the command is canceled, used as the reason of its final response.
+
+        Returns:
+            bool: True if this call tripped the token, False if it was already tripped.
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._reason = reason
+            self._event.set()
+            return True
+
+    def raise_if_canceled(self) -> None:
+        """
+        Raise if the token has been tripped, a convenient way to bail out of `execute()`.
+
+        Raises:
+            CommandCanceledError: If the token has been tripped.
+        """
+        if self._reason is not None:
+            raise CommandCanceledError(self._reason)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the token is tripped, e.g. as an interruptible `time.sleep()`.
+
+        Args:
+            timeout (Optional[float], optional): Maximum number of seconds to wait, None to wait forever. Defaults to None.
+
+        Returns:
+            bool: True if the token was tripped, False if the timeout expired first.
+        """
+        return self._event.wait(timeout)
+
+
+@dataclass(order=True)
+class _Deadline:
+    at: float
+    order: int
+    token: CancellationToken = field(compare=False)
+    reason: LifecycleResponseReason = field(compare=False)
+    active: bool = field(default=True, compare=False)
+
+
+class _DeadlineScheduler:
+    """A single background thread that trips tokens when their deadline passes, started on first use."""
+
+    def __init__(self) -> None:
+        self._condition = Condition()
+        self._heap: list[_Deadline] = []
+        self._order = count()
+        self._thread: Optional[Thread] = None
+
+    def schedule(
+        self, token: CancellationToken, timeout_s: float, reason: LifecycleResponseReason
+    ) -> _Deadline:
+        deadline = _Deadline(perf_counter() + timeout_s, next(self._order), token, reason)
+        with self._condition:
+            heapq.heappush(self._heap, deadline)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="CommandDeadlines", daemon=True)
+                self._thread.start()
+            elif self._heap[0] is deadline:
+                self._condition.notify()
+        return deadline
+
+    def unschedule(self, deadline: _Deadline) -> None:
+        # removed lazily by the thread
+        deadline.active = False
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._heap and not self._heap[0].active:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                now = perf_counter()
+                if self._heap[0].at > now:
+                    self._condition.wait(self._heap[0].at - now)
+                    continue
+                deadline = heapq.heappop(self._heap)
+            deadline.token.cancel(deadline.reason)
+
+
+_deadlines = _DeadlineScheduler()
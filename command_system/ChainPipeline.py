@@ -0,0 +1,267 @@
+from collections import deque
+from dataclasses import dataclass
+from threading import Condition
+from typing import Any, Generic, Iterable, Iterator, Optional, Union
+
+from .Command import Command
+from .CommandChain import (
+    ChainTemplate,
+    CommandChainBranchLink,
+    CommandChainBuilder,
+    CommandChainLink,
+    CommandChainLocalLink,
+    CommandChainStopLink,
+    inputDataType,
+    outputDataType,
+)
+from .CommandLifecycle import ExecutionResponse
+from .CommandQueue import CommandQueue
+from .CommandResponse import ResponseStatus
+
+
+@dataclass
+class PipelineResult(Generic[outputDataType]):
+    """
+    The result of one input of a `ChainPipeline`.
+
+    Attributes:
+        index (int): Position of the input in the stream of inputs.
+        status (ResponseStatus): `ResponseStatus.COMPLETED` if every link succeeded, `ResponseStatus.FAILED` otherwise.
+        output_data (Optional[outputDataType]): The output of the last link, None if the input failed.
+    """
+
+    index: int
+    status: ResponseStatus
+    output_data: Optional[outputDataType] = None
+
+
+_PipelineLink = Union[
+    CommandChainLink[Any, Any, Any, Any],
+    CommandChainLocalLink[Any, Any],
+    CommandChainStopLink[Any],
+    CommandChainBranchLink[Any, Any],
+]
+
+
+class ChainPipeline(Generic[inputDataType, outputDataType]):
+    """
+    Runs the links of a chain over a stream of inputs, assembly-line style.
+
+    Every link is a stage with at most `max_in_flight` commands in the queue at once. A stage only starts a new command
+    while the next stage has fewer than `max_in_flight` outputs waiting, so a slow stage holds back the ones before it
+    (backpressure) and inputs are only pulled from the stream when the first stage has room for them.
+    Different stages of different inputs are in the queue at the same time, so with a concurrent queue backend
+    (e.g. `RemoteCommandQueue`) throughput approaches that of the slowest stage.
+
+    All links but `map()` are supported. An input that stops early (`stop_if()`) completes without entering later stages.
+    """
+
+    def __init__(
+        self,
+        chain: Union[
+            ChainTemplate[inputDataType, outputDataType],
+            CommandChainBuilder[Any, outputDataType],
+        ],
+        queue: CommandQueue,
+        max_in_flight: int = 16,
+    ):
+        """
+        Construct a new ChainPipeline.
+
+        Args:
+            chain (Union[ChainTemplate, CommandChainBuilder]): The links to run for each input, the builder's input data is ignored.
+            queue (CommandQueue): The queue to submit the commands of every stage to.
+            max_in_flight (int, optional): Maximum number of commands per stage in the queue, and of outputs waiting for the next stage. Defaults to 16.
+
+        Raises:
+            ValueError: If the chain is empty or contains a `map()` link, or `max_in_flight` is less than 1.
+        """
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}.")
+        links: list[_PipelineLink] = []
+        for position, link in enumerate(chain.links):
+            if not isinstance(
+                link,
+                (CommandChainLink, CommandChainLocalLink, CommandChainStopLink, CommandChainBranchLink),
+            ):
+                raise ValueError(f"Link {position} cannot run in a pipeline: {link!r}.")
+            links.append(link)
+        if not links:
+            raise ValueError("Cannot run an empty chain in a pipeline.")
+        self._links = tuple(links)
+        self._queue = queue
+        self._max_in_flight = max_in_flight
+        # waiting[k] holds (index, data) ready to enter stage k, waiting[len(links)] holds finished outputs
+        self._waiting: list[deque[tuple[int, Any]]] = [deque() for _ in range(len(self._links) + 1)]
+        self._in_flight = [0] * len(self._links)
+        self._results: deque[PipelineResult[outputDataType]] = deque()
+        self._condition = Condition()
+
+    def run(
+        self, inputs: Iterable[inputDataType], drive: bool = True
+    ) -> Iterator[PipelineResult[outputDataType]]:
+        """
+        Feed `inputs` through the pipeline, yielding the result of each input as soon as it has passed the last stage.
+
+        Results are yielded in completion order, use `PipelineResult.index` to match them to their input.
+        `inputs` is consumed lazily, as the first stage makes room.
+
+        Args:
+            inputs (Iterable[inputDataType]): The inputs, can be an unbounded iterator.
+            drive (bool, optional): Call `process_once()` on the queue whenever no result is ready. Set to False if another
+                thread processes the queue. Defaults to True.
+
+        Returns:
+            Iterator[PipelineResult[outputDataType]]: The result of each input.
+        """
+        return self._run(enumerate(inputs), drive)
+
+    def _run(
+        self, source: Iterator[tuple[int, inputDataType]], drive: bool
+    ) -> Iterator[PipelineResult[outputDataType]]:
+        exhausted = False
+        while True:
+            if not exhausted:
+                # only pull from the source when the first stage has room, without holding the lock
+                with self._condition:
+                    room = self._max_in_flight - len(self._waiting[0])
+                pulled: list[tuple[int, inputDataType]] = []
+                for _ in range(room):
+                    item = next(source, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    pulled.append(item)
+                if pulled:
+                    with self._condition:
+                        self._waiting[0].extend(pulled)
+            self._queue.submit_many(*self._pump())
+            with self._condition:
+                if not drive and not self._results and not self._idle():
+                    self._condition.wait_for(
+                        lambda: bool(self._results)
+                        or self._idle()
+                        or (len(self._waiting[0]) < self._max_in_flight and not exhausted)
+                    )
+                results = list(self._results)
+                self._results.clear()
+                done = exhausted and self._idle()
+            yield from results
+            if done and not results:
+                return
+            if drive and not results:
+                self._queue.process_once()
+
+    def _idle(self) -> bool:
+        """True if no input is waiting for or running in any stage."""
+        return not any(self._in_flight) and not any(self._waiting[: len(self._links)])
+
+    def _take_startable(self) -> list[tuple[int, int, Any]]:
+        """
+        Take the waiting inputs the stage limits allow to start, last stage first so downstream room is freed first.
+
+        Must be called with the condition held. Each taken input holds a slot of its stage until `_pump()` applies its outcome.
+        """
+        taken: list[tuple[int, int, Any]] = []
+        for stage in reversed(range(len(self._links))):
+            waiting = self._waiting[stage]
+            while (
+                waiting
+                and self._in_flight[stage] < self._max_in_flight
+                and (stage == len(self._links) - 1 or len(self._waiting[stage + 1]) < self._max_in_flight)
+            ):
+                index, data = waiting.popleft()
+                self._in_flight[stage] += 1
+                taken.append((stage, index, data))
+        # outputs of the last stage are results
+        finished = self._waiting[len(self._links)]
+        while finished:
+            index, data = finished.popleft()
+            self._results.append(PipelineResult(index=index, status=ResponseStatus.COMPLETED, output_data=data))
+        return taken
+
+    def _pump(self) -> list[Command[Any, Any]]:
+        """
+        Start as many waiting inputs as the stage limits allow, until no more can start.
+
+        Links' user code (predicates, selectors, functions, args factories) runs without the condition held.
+        Returns the commands to submit.
+        """
+        to_submit: list[Command[Any, Any]] = []
+        while True:
+            with self._condition:
+                taken = self._take_startable()
+                if not taken:
+                    self._condition.notify_all()
+                    return to_submit
+            outcomes: list[tuple[int, int, Union[Command[Any, Any], _StageOutput, PipelineResult[Any], None]]] = []
+            for stage, index, data in taken:
+                try:
+                    outcomes.append((stage, index, self._start(stage, index, data)))
+                except Exception:
+                    outcomes.append((stage, index, None))
+            with self._condition:
+                for stage, index, outcome in outcomes:
+                    if isinstance(outcome, Command):
+                        # keeps its slot until `_on_stage_done()`
+                        to_submit.append(outcome)
+                        continue
+                    self._in_flight[stage] -= 1
+                    if isinstance(outcome, _StageOutput):
+                        self._waiting[stage + 1].append((index, outcome.data))
+                    elif outcome is not None:
+                        self._results.append(outcome)
+                    else:
+                        self._results.append(PipelineResult(index=index, status=ResponseStatus.FAILED))
+
+    def _start(
+        self, stage: int, index: int, data: Any
+    ) -> Union[Command[Any, Any], "_StageOutput", PipelineResult[Any]]:
+        """Start `data` on `stage`: the command to submit, the stage's output if it ran locally, or the input's result if it stopped."""
+        link = self._links[stage]
+        if isinstance(link, CommandChainStopLink):
+            if link.predicate(data):
+                return PipelineResult(index=index, status=ResponseStatus.COMPLETED, output_data=data)
+            return _StageOutput(data)
+        if isinstance(link, CommandChainBranchLink):
+            link = link.selector(data)
+        if isinstance(link, CommandChainLocalLink):
+            return _StageOutput(link.function(data))
+        command = link.command(link.args_factory(data))
+        command.add_on_execute_callback(
+            lambda response: self._on_stage_done(link, stage, index, command, response), inline=True
+        )
+        command.add_on_cancel_callback(
+            lambda _: self._on_stage_done(link, stage, index, command, None), inline=True
+        )
+        return command
+
+    def _on_stage_done(
+        self,
+        link: CommandChainLink[Any, Any, Any, Any],
+        stage: int,
+        index: int,
+        command: Command[Any, Any],
+        response: Optional[ExecutionResponse],
+    ) -> None:
+        """Move the output of a finished command to the next stage, and start whatever that made room for."""
+        output: Optional[_StageOutput] = None
+        if response is not None and response.should_proceed:
+            try:
+                output = _StageOutput(link.result_extractor(command.response))
+            except Exception:
+                output = None
+        with self._condition:
+            self._in_flight[stage] -= 1
+            if output is not None:
+                self._waiting[stage + 1].append((index, output.data))
+            else:
+                self._results.append(PipelineResult(index=index, status=ResponseStatus.FAILED))
+        self._queue.submit_many(*self._pump())
+
+
+@dataclass
+class _StageOutput:
+    """The output of a stage, ready for the next one."""
+
+    data: Any
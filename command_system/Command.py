@@ -1,9 +1,15 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Callable, Generic, Optional, Type, TypeVar, final
+from functools import partial
+from inspect import ismethod
+from threading import Lock
+from weakref import WeakMethod, ref
+from typing import TYPE_CHECKING, Any, Callable, Generic, Optional, Type, TypeVar, final
 
+from .Cancellation import CancellationToken
 from .CommandLifecycle import (
     CallbackRecord,
+    CallbackRecordPolicy,
     CancelResponse,
     DeferResponse,
     ExecutionResponse,
@@ -12,6 +18,9 @@ from .CommandLifecycle import (
 from .CommandResponse import CommandResponse, ResponseStatus
 from .Dependencies import DependencyCheckResponse, DependencyEntry
 
+if TYPE_CHECKING:
+    from .CallbackDispatch import CallbackDispatcher
+
 
 @dataclass
 class CommandArgs:
@@ -29,10 +38,49 @@ ResponseType = TypeVar("ResponseType", bound=CommandResponse)
 
 _LifecycleResponseType = TypeVar("_LifecycleResponseType", bound="LifecycleResponse")
 
+class _WeakCallback:
+    """A callback held through a weak reference, see `Command.add_on_execute_callback(weak=True)`."""
+
+    def __init__(self, callback: Callable[[Any], None]):
+        # bound methods are created on attribute access, so they need a WeakMethod to stay alive with their object
+        self._ref: Callable[[], Optional[Callable[[Any], None]]] = (
+            WeakMethod(callback) if ismethod(callback) else ref(callback)
+        )
+
+    def resolve(self) -> Optional[Callable[[Any], None]]:
+        """The callback, or None if it has been garbage collected."""
+        return self._ref()
+
+    def __call__(self, response: Any) -> None:
+        callback = self._ref()
+        if callback is not None:
+            callback(response)
+
+
+def _strip_traceback(error: Exception) -> Exception:
+    """Drop the traceback (and so the stack frames) of an exception and of the exceptions it was chained to."""
+    seen: set[int] = set()
+    current: Optional[BaseException] = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        current.__traceback__ = None
+        current = current.__cause__ or current.__context__
+    return error
+
+
+# guards the lazy creation of cancellation tokens, so a token tripped from another thread is never replaced
+_cancellation_token_lock = Lock()
+
 
 class Command(ABC, Generic[ArgsType, ResponseType]):
     ARGS: Type[ArgsType]
     _response_type: Type[ResponseType]
+    # maximum number of seconds `execute()` may run, None to use the queue's `execution_timeout_s`,
+    # can be overridden per class or per instance
+    timeout_s: Optional[float] = None
+    # which callback executions are kept in `executed_callbacks`, None to use the queue's policy (ALL by default),
+    # can be overridden per class or per instance
+    callback_record_policy: Optional[CallbackRecordPolicy] = None
 
     def __init__(
         self,
@@ -41,11 +89,23 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
     ):
         self._args = args
         self.response = self._init_response()
+        # the command whose trace span this command's span is parented to, see `CommandQueue(tracer=...)`
+        self.trace_parent: Optional[Command[Any, Any]] = None
+        # `time.perf_counter()` timestamps set by the queue: when the command was submitted, first processed,
+        # and reached a final status, or None if that has not happened yet
+        self.submitted_at: Optional[float] = None
+        self.first_processed_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # number of passes the command was deferred for (by `should_defer()` or its dependencies)
+        self.deferral_count = 0
+        # created on first use, most commands never need one
+        self._cancellation_token: Optional[CancellationToken] = None
 
         # callbacks
-        self._on_defer_callbacks: list[Callable[[DeferResponse], None]] = []
-        self._on_cancel_callbacks: list[Callable[[CancelResponse], None]] = []
-        self._on_execute_callbacks: list[Callable[[ExecutionResponse], None]] = []
+        # (callback, inline) pairs, inline ones always run on the processing thread, see `add_on_execute_callback()`
+        self._on_defer_callbacks: list[tuple[Callable[[DeferResponse], None], bool]] = []
+        self._on_cancel_callbacks: list[tuple[Callable[[CancelResponse], None], bool]] = []
+        self._on_execute_callbacks: list[tuple[Callable[[ExecutionResponse], None], bool]] = []
 
         # dependencies
         self._dependencies: list[DependencyEntry] = []
@@ -61,11 +121,34 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
         """
         pass
 
+    def _defer_trace_end(self, end: Callable[[], None]) -> bool:
+        """
+        Called by a tracing queue when the command reaches a final status.
+
+        Return True to keep the command's span open and call `end` once its work is really done, e.g. a `CommandChain`
+        whose links are still running.
+        """
+        return False
+
     @property
     def args(self) -> ArgsType:
         """Get the command arguments."""
         return self._args
 
+    @property
+    def cancellation_token(self) -> CancellationToken:
+        """
+        The token tripped when the command is canceled with `CommandQueue.cancel()` or exceeds its timeout.
+
+        Long-running `execute()` implementations should check `cancellation_token.is_canceled` (or call
+        `cancellation_token.raise_if_canceled()`) regularly, the queue cannot interrupt them.
+        """
+        if self._cancellation_token is None:
+            with _cancellation_token_lock:
+                if self._cancellation_token is None:
+                    self._cancellation_token = CancellationToken()
+        return self._cancellation_token
+
     def _init_response(self) -> ResponseType:
         """
         Initialize the response object for the command.
@@ -177,20 +260,75 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
 
         Call a single callback with the given response.
 
-        This method ensures that the callback is executed safely, and any exceptions raised are recorded.
+        This method ensures that the callback is executed safely, and any exceptions raised are recorded
+        according to `callback_record_policy`. Weak callbacks whose target was garbage collected are skipped.
 
         Args:
             callback (Callable[[_LifecycleResponseType], None]): The callback function to be called.
             response (_LifecycleResponseType): The response to pass to the callback.
         """
+        if isinstance(callback, _WeakCallback) and callback.resolve() is None:
+            return
+        error: Optional[Exception] = None
         try:
             callback(response)
-            response.executed_callbacks.append(CallbackRecord(callback=callback, error=None))
         except Exception as e:
-            response.executed_callbacks.append(CallbackRecord(callback=callback, error=e))
+            error = e
+        policy = self.callback_record_policy
+        if policy is None or policy is CallbackRecordPolicy.ALL:
+            response.executed_callbacks.append(CallbackRecord(callback=callback, error=error))
+        elif error is None or policy is CallbackRecordPolicy.NONE:
+            return
+        elif policy is CallbackRecordPolicy.ERRORS_ONLY:
+            response.executed_callbacks.append(CallbackRecord(callback=callback, error=error))
+        else:
+            target = callback.resolve() if isinstance(callback, _WeakCallback) else callback
+            response.executed_callbacks.append(
+                CallbackRecord(
+                    callback=None,
+                    error=_strip_traceback(error),
+                    callback_name=getattr(target, "__qualname__", repr(target)),
+                )
+            )
 
     @final
-    def add_on_defer_callback(self, callback: Callable[[DeferResponse], None]) -> None:
+    def _call_callbacks(
+        self,
+        callbacks: list[tuple[Callable[[_LifecycleResponseType], None], bool]],
+        response: _LifecycleResponseType,
+        dispatcher: "Optional[CallbackDispatcher]",
+    ) -> None:
+        """
+        [Private, do not override]
+
+        Call callbacks in order, or hand all but the inline ones to `dispatcher` as one batch after calling the inline ones.
+        """
+        if dispatcher is None:
+            for callback, _ in callbacks:
+                self._call_single_callback(callback, response)
+            return
+        dispatched: list[tuple[Callable[[_LifecycleResponseType], None], bool]] = []
+        for callback, inline in callbacks:
+            if inline:
+                self._call_single_callback(callback, response)
+            else:
+                dispatched.append((callback, inline))
+        if dispatched:
+            dispatcher.dispatch(self, partial(self._call_callbacks, dispatched, response, None))
+
+    @final
+    def _register_callback(
+        self, callbacks: list[Any], callback: Callable[[Any], None], inline: bool, weak: bool
+    ) -> None:
+        """[Private, do not override] Add a callback to one of the callback lists."""
+        if weak:
+            callback = _WeakCallback(callback)
+        callbacks.append((callback, inline))
+
+    @final
+    def add_on_defer_callback(
+        self, callback: Callable[[DeferResponse], None], inline: bool = False, weak: bool = False
+    ) -> None:
         """
         Add a callback to be called when the command is deferred.
 
@@ -198,18 +336,22 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
 
         Args:
             callback (Callable[[DeferResponse], None]): The callback function to be called.
+            inline (bool, optional): Always call it on the processing thread, even if the queue has a `callback_dispatcher`. Use it for callbacks that must run before the next pass, e.g. ones that submit to a queue that is not thread-safe. Defaults to False.
+            weak (bool, optional): Only keep a weak reference to the callback (a `WeakMethod` for bound methods), so the command does not keep it (or the object it is bound to) alive. It is skipped once garbage collected. Defaults to False.
         """
-        self._on_defer_callbacks.append(callback)
+        self._register_callback(self._on_defer_callbacks, callback, inline, weak)
 
-    def call_on_defer_callbacks(self, response: DeferResponse) -> None:
+    def call_on_defer_callbacks(
+        self, response: DeferResponse, dispatcher: "Optional[CallbackDispatcher]" = None
+    ) -> None:
         """
         Call all registered on-defer callbacks with the given response.
 
         Args:
             response (DeferResponse): The response to pass to the callbacks.
+            dispatcher (Optional[CallbackDispatcher], optional): Dispatcher to run the callbacks that are not inline with, None to call all of them now. Defaults to None.
         """
-        for callback in self._on_defer_callbacks:
-            self._call_single_callback(callback, response)
+        self._call_callbacks(self._on_defer_callbacks, response, dispatcher)
 
     def on_defer_callbacks_count(self) -> int:
         """
@@ -221,7 +363,9 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
         return len(self._on_defer_callbacks)
 
     @final
-    def add_on_cancel_callback(self, callback: Callable[[CancelResponse], None]) -> None:
+    def add_on_cancel_callback(
+        self, callback: Callable[[CancelResponse], None], inline: bool = False, weak: bool = False
+    ) -> None:
         """
         Add a callback to be called when the command is canceled.
 
@@ -229,18 +373,22 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
 
         Args:
             callback (Callable[[CancelResponse], None]): The callback function to be called.
+            inline (bool, optional): Always call it on the processing thread, even if the queue has a `callback_dispatcher`. Use it for callbacks that must run before the next pass, e.g. ones that submit to a queue that is not thread-safe. Defaults to False.
+            weak (bool, optional): Only keep a weak reference to the callback (a `WeakMethod` for bound methods), so the command does not keep it (or the object it is bound to) alive. It is skipped once garbage collected. Defaults to False.
         """
-        self._on_cancel_callbacks.append(callback)
+        self._register_callback(self._on_cancel_callbacks, callback, inline, weak)
 
-    def call_on_cancel_callbacks(self, response: CancelResponse) -> None:
+    def call_on_cancel_callbacks(
+        self, response: CancelResponse, dispatcher: "Optional[CallbackDispatcher]" = None
+    ) -> None:
         """
         Call all registered on-cancel callbacks with the given response.
 
         Args:
             response (CancelResponse): The response to pass to the callbacks.
+            dispatcher (Optional[CallbackDispatcher], optional): Dispatcher to run the callbacks that are not inline with, None to call all of them now. Defaults to None.
         """
-        for callback in self._on_cancel_callbacks:
-            self._call_single_callback(callback, response)
+        self._call_callbacks(self._on_cancel_callbacks, response, dispatcher)
 
     def on_cancel_callbacks_count(self) -> int:
         """
@@ -252,7 +400,9 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
         return len(self._on_cancel_callbacks)
 
     @final
-    def add_on_execute_callback(self, callback: Callable[[ExecutionResponse], None]) -> None:
+    def add_on_execute_callback(
+        self, callback: Callable[[ExecutionResponse], None], inline: bool = False, weak: bool = False
+    ) -> None:
         """
         Add a callback to be called when the command is executed.
 
@@ -260,18 +410,22 @@ class Command(ABC, Generic[ArgsType, ResponseType]):
 
         Args:
             callback (Callable[[ExecutionResponse], None]): The callback function to be called.
+            inline (bool, optional): Always call it on the processing thread, even if the queue has a `callback_dispatcher`. Use it for callbacks that must run before the next pass, e.g. ones that submit to a queue that is not thread-safe. Defaults to False.
+            weak (bool, optional): Only keep a weak reference to the callback (a `WeakMethod` for bound methods), so the command does not keep it (or the object it is bound to) alive. It is skipped once garbage collected. Defaults to False.
         """
-        self._on_execute_callbacks.append(callback)
+        self._register_callback(self._on_execute_callbacks, callback, inline, weak)
 
-    def call_on_execute_callbacks(self, response: ExecutionResponse) -> None:
+    def call_on_execute_callbacks(
+        self, response: ExecutionResponse, dispatcher: "Optional[CallbackDispatcher]" = None
+    ) -> None:
         """
         Call all registered on-execute callbacks with the given response.
 
         Args:
             response (ExecutionResponse): The response to pass to the callbacks.
+            dispatcher (Optional[CallbackDispatcher], optional): Dispatcher to run the callbacks that are not inline with, None to call all of them now. Defaults to None.
         """
-        for callback in self._on_execute_callbacks:
-            self._call_single_callback(callback, response)
+        self._call_callbacks(self._on_execute_callbacks, response, dispatcher)
 
     def on_execute_callbacks_count(self) -> int:
         """
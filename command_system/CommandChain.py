@@ -2,7 +2,22 @@ from .Command import Command, CommandArgs, CommandResponse, ArgsType, ResponseTy
 from .CommandQueue import CommandQueue
 from .CommandLifecycle import ExecutionResponse
 from dataclasses import dataclass, field
-from typing import Callable, TypeVar, Generic, Any, cast, Optional
+from functools import partial, reduce as _reduce
+from collections import deque
+from threading import Condition
+from typing import (
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    TypeVar,
+    Generic,
+    Any,
+    Union,
+    cast,
+    Optional,
+)
+import asyncio
 
 inputDataType = TypeVar("inputDataType")
 outputDataType = TypeVar("outputDataType")
@@ -15,6 +30,9 @@ firstArgsType = TypeVar("firstArgsType", bound=CommandArgs)
 firstResponseType = TypeVar("firstResponseType", bound=CommandResponse)
 firstOutputDataType = TypeVar("firstOutputDataType")
 
+elementType = TypeVar("elementType")
+accumulatorType = TypeVar("accumulatorType")
+
 
 @dataclass
 class CommandChainLink(Generic[inputDataType, ArgsType, ResponseType, outputDataType]):
@@ -23,22 +41,79 @@ class CommandChainLink(Generic[inputDataType, ArgsType, ResponseType, outputData
     result_extractor: Callable[[ResponseType], outputDataType]
 
 
+@dataclass
+class CommandChainMapLink(Generic[inputDataType, ArgsType, ResponseType, outputDataType]):
+    """A link that runs one command per element of its (iterable) input, its output is the list of per-element results."""
+
+    args_factory: Callable[[inputDataType], ArgsType]
+    command: type[Command[ArgsType, ResponseType]]
+    result_extractor: Callable[[ResponseType], outputDataType]
+
+
+@dataclass
+class CommandChainLocalLink(Generic[inputDataType, outputDataType]):
+    """A link that transforms its input in the chain itself, without submitting a command."""
+
+    function: Callable[[inputDataType], outputDataType]
+
+
+@dataclass
+class CommandChainStopLink(Generic[inputDataType]):
+    """A link that completes the chain early, with its input as the final output, if `predicate` returns True."""
+
+    predicate: Callable[[inputDataType], bool]
+
+
+@dataclass
+class CommandChainBranchLink(Generic[inputDataType, outputDataType]):
+    """A link that picks the command link to run from its input, by calling `selector`."""
+
+    selector: Callable[[inputDataType], CommandChainLink[inputDataType, Any, Any, outputDataType]]
+
+
+AnyCommandChainLink = Union[
+    CommandChainLink[Any, Any, Any, Any],
+    CommandChainMapLink[Any, Any, Any, Any],
+    CommandChainLocalLink[Any, Any],
+    CommandChainStopLink[Any],
+    CommandChainBranchLink[Any, Any],
+]
+
+
+@dataclass(frozen=True, slots=True)
+class _LinkNode:
+    """A node of a persistent (cons) list of links, builders that share a prefix share its nodes."""
+
+    link: AnyCommandChainLink
+    parent: Optional["_LinkNode"]
+    length: int
+
+
 class CommandChainBuilder(
     Generic[inputDataType, outputDataType],
 ):
 
     def __init__(
-        self, input_data: inputDataType, _links: list[CommandChainLink[Any, Any, Any, Any]]
+        self,
+        input_data: inputDataType,
+        _links: Union[list[AnyCommandChainLink], _LinkNode, None],
     ):
         """
         **Private constructor**. Use `CommandChainBuilder.start()` to create a new command chain.
 
         Args:
             input_data (inputDataType): The initial input data for the command chain.
-            _links (list[CommandChainLink[Any, Any, Any, Any]]): The list of command links in the chain.
+            _links (Union[list[AnyCommandChainLink], _LinkNode, None]): The links in the chain, or the node of the last link.
         """
         self.input_data = input_data
-        self._links: list[CommandChainLink[Any, Any, Any, Any]] = _links
+        self._links_cache: Optional[list[AnyCommandChainLink]] = None
+        if isinstance(_links, list):
+            tail: Optional[_LinkNode] = None
+            for link in _links:
+                tail = _LinkNode(link=link, parent=tail, length=1 if tail is None else tail.length + 1)
+            self._tail = tail
+        else:
+            self._tail = _links
 
     @classmethod
     def start(
@@ -75,36 +150,170 @@ class CommandChainBuilder(
         Returns:
             CommandChainBuilder[inputDataType, subsequentOutputDataType]: A new CommandChainBuilder with the added link.
         """
-        if len(self._links) == 0:
+        return self._with_link(
+            CommandChainLink(
+                args_factory=args_factory, command=command, result_extractor=result_extractor
+            )
+        )
+
+    def map(
+        self: "CommandChainBuilder[inputDataType, Iterable[elementType]]",
+        args_factory: Callable[[elementType], subsequentArgsType],
+        command: type[Command[subsequentArgsType, subsequentResponseType]],
+        result_extractor: Callable[[subsequentResponseType], subsequentOutputDataType],
+    ) -> "CommandChainBuilder[inputDataType, list[subsequentOutputDataType]]":
+        """
+        Returns a new CommandChain that runs one command per element of the previous output (fan-out).
+
+        All commands of the stage are submitted together, so a concurrent queue can run them in parallel.
+        The stage's output is the list of extracted results, in the order of the elements. If any of the commands fails
+        or is cancelled, the chain fails.
+
+        Args:
+            args_factory (Callable[[elementType], subsequentArgsType]): A function that takes one element of the previous output and returns the arguments for its command.
+            command (type[Command[subsequentArgsType, subsequentResponseType]]): The class of the command to run for each element.
+            result_extractor (Callable[[subsequentResponseType], subsequentOutputDataType]): A function that extracts the result from the response of each command.
+
+        Returns:
+            CommandChainBuilder[inputDataType, list[subsequentOutputDataType]]: A new CommandChainBuilder with the added stage.
+        """
+        return self._with_link(
+            CommandChainMapLink(
+                args_factory=args_factory, command=command, result_extractor=result_extractor
+            )
+        )
+
+    def reduce(
+        self: "CommandChainBuilder[inputDataType, Iterable[elementType]]",
+        reducer: Callable[[accumulatorType, elementType], accumulatorType],
+        initial: accumulatorType,
+    ) -> "CommandChainBuilder[inputDataType, accumulatorType]":
+        """
+        Returns a new CommandChain that folds the previous output (e.g. the results of a `map()` stage) into a single value (fan-in).
+
+        The reduction runs in the chain itself, no command is submitted for it.
+
+        Args:
+            reducer (Callable[[accumulatorType, elementType], accumulatorType]): A function combining the accumulated value with the next element.
+            initial (accumulatorType): The initial accumulated value.
+
+        Returns:
+            CommandChainBuilder[inputDataType, accumulatorType]: A new CommandChainBuilder with the added stage.
+        """
+        return self._with_link(
+            CommandChainLocalLink(function=lambda elements: _reduce(reducer, elements, initial))
+        )
+
+    def gather(
+        self,
+        function: Callable[[outputDataType], subsequentOutputDataType],
+    ) -> "CommandChainBuilder[inputDataType, subsequentOutputDataType]":
+        """
+        Returns a new CommandChain that combines the previous output (e.g. the list of results of a `map()` stage) with a single function call (fan-in).
+
+        The function runs in the chain itself, no command is submitted for it.
+
+        Args:
+            function (Callable[[outputDataType], subsequentOutputDataType]): A function taking the previous output and returning the combined value.
+
+        Returns:
+            CommandChainBuilder[inputDataType, subsequentOutputDataType]: A new CommandChainBuilder with the added stage.
+        """
+        return self._with_link(CommandChainLocalLink(function=function))
+
+    def stop_if(
+        self, predicate: Callable[[outputDataType], bool]
+    ) -> "CommandChainBuilder[inputDataType, outputDataType]":
+        """
+        Returns a new CommandChain that completes early if `predicate` returns True for the previous output.
+
+        The previous output becomes the chain's final output, and none of the later links are submitted.
+        E.g. after a cache lookup, `stop_if(lambda cached: cached is not None)` skips the work that would recompute it.
+        Note that the final output then has the type of the output at this point.
+
+        Args:
+            predicate (Callable[[outputDataType], bool]): A function deciding from the previous output whether to stop.
+
+        Returns:
+            CommandChainBuilder[inputDataType, outputDataType]: A new CommandChainBuilder with the added link.
+        """
+        return self._with_link(CommandChainStopLink(predicate=predicate))
+
+    def branch(
+        self,
+        selector: Callable[
+            [outputDataType], CommandChainLink[outputDataType, Any, Any, subsequentOutputDataType]
+        ],
+    ) -> "CommandChainBuilder[inputDataType, subsequentOutputDataType]":
+        """
+        Returns a new CommandChain whose next command is chosen from the previous output.
+
+        `selector` returns the `CommandChainLink` (args factory, command class and result extractor) to run, so
+        different commands can be run depending on the data, as long as they produce the same kind of output.
+
+        Args:
+            selector (Callable[[outputDataType], CommandChainLink]): A function returning the link to run for the previous output.
+
+        Returns:
+            CommandChainBuilder[inputDataType, subsequentOutputDataType]: A new CommandChainBuilder with the added link.
+        """
+        return self._with_link(CommandChainBranchLink(selector=selector))
+
+    def _with_link(self, link: AnyCommandChainLink) -> "CommandChainBuilder[inputDataType, Any]":
+        """Returns a new builder with `link` appended to the links of this one."""
+        if self._tail is None:
             raise ValueError(
                 "Cannot add a subsequent command to an empty chain. Use `CommandChainBuilder.start()` to create a new chain."
             )
-        new_link = CommandChainLink(
-            args_factory=args_factory, command=command, result_extractor=result_extractor
-        )
-        new_chain: CommandChainBuilder[inputDataType, subsequentOutputDataType] = (
-            CommandChainBuilder(input_data=self.input_data, _links=self._links + [new_link])
+        return CommandChainBuilder(
+            input_data=self.input_data,
+            _links=_LinkNode(link=link, parent=self._tail, length=self._tail.length + 1),
         )
-        return new_chain
 
     @property
-    def links(self) -> list[CommandChainLink[Any, Any, Any, Any]]:
+    def links(self) -> list[AnyCommandChainLink]:
         """
         Returns the list of links in the command chain.
 
         **Do not modify the returned list.**
 
         Returns:
-            list[CommandChainLink[Any, Any, Any, Any]]: The links in the command chain.
+            list[AnyCommandChainLink]: The links in the command chain.
         """
-        return self._links
+        if self._links_cache is None:
+            links: list[AnyCommandChainLink] = []
+            node = self._tail
+            while node is not None:
+                links.append(node.link)
+                node = node.parent
+            links.reverse()
+            self._links_cache = links
+        return self._links_cache
+
+    def __len__(self) -> int:
+        """
+        Get the number of links in the chain, without materializing them.
 
-    def build(self, queue: CommandQueue) -> "CommandChain[inputDataType, outputDataType]":
+        Returns:
+            int: The number of links in the chain.
+        """
+        return 0 if self._tail is None else self._tail.length
+
+    def build(
+        self, queue: CommandQueue, same_pass: bool = False, retain_results: bool = True
+    ) -> "CommandChain[inputDataType, outputDataType]":
         """
         Realizes the command chain builder, creating a CommandChain instance with the current input data and links.
 
         This does not execute the chain, it only prepares it for execution.
 
+        Args:
+            queue (CommandQueue): The queue the links of the chain are submitted to.
+            same_pass (bool, optional): Submit each link with `queue.submit_next()`, so the whole chain runs in a single pass
+                unless a link is deferred. Otherwise each link is processed on a later pass. Defaults to False.
+            retain_results (bool, optional): Keep every link's response and result in the chain's response. Set to False
+                when consuming results with `CommandChain.stream()`, so only the final output is kept. Defaults to True.
+
         Returns:
             CommandChain[inputDataType, outputDataType]: A CommandChain instance with the current input data and links.
         """
@@ -113,15 +322,144 @@ class CommandChainBuilder(
                 queue=queue,
                 input_data=self.input_data,
                 chain=self,
+                same_pass=same_pass,
+                retain_results=retain_results,
+            )
+        )
+
+    def compile(self) -> "ChainTemplate[inputDataType, outputDataType]":
+        """
+        Validate the links of this builder once and freeze them into a reusable `ChainTemplate`.
+
+        The builder's input data is not part of the template, it is given to each instance instead.
+
+        Returns:
+            ChainTemplate[inputDataType, outputDataType]: A template that creates chains running these links.
+        """
+        return ChainTemplate(self.links)
+
+
+class ChainTemplate(Generic[inputDataType, outputDataType]):
+    """
+    A compiled, immutable sequence of chain links that can be instantiated for many inputs.
+
+    Create it with `CommandChainBuilder.compile()`. The links are validated and materialized once, so creating a chain
+    from a template only allocates the chain command itself.
+    """
+
+    def __init__(self, links: Iterable[AnyCommandChainLink]):
+        """
+        Construct a new ChainTemplate, prefer `CommandChainBuilder.compile()`.
+
+        Args:
+            links (Iterable[AnyCommandChainLink]): The links of the chain, in order.
+
+        Raises:
+            ValueError: If there are no links, or a link is not a valid chain link.
+        """
+        self._links: tuple[AnyCommandChainLink, ...] = tuple(links)
+        if not self._links:
+            raise ValueError("Cannot compile an empty chain.")
+        for position, link in enumerate(self._links):
+            if isinstance(link, CommandChainLocalLink):
+                if not callable(link.function):
+                    raise ValueError(f"Link {position} has a function that is not callable.")
+                continue
+            if isinstance(link, CommandChainStopLink):
+                if not callable(link.predicate):
+                    raise ValueError(f"Link {position} has a predicate that is not callable.")
+                continue
+            if isinstance(link, CommandChainBranchLink):
+                if not callable(link.selector):
+                    raise ValueError(f"Link {position} has a selector that is not callable.")
+                continue
+            if not isinstance(link, (CommandChainLink, CommandChainMapLink)):
+                raise ValueError(f"Link {position} is not a chain link: {link!r}.")
+            if not (isinstance(link.command, type) and issubclass(link.command, Command)):
+                raise ValueError(f"Link {position} has a command that is not a Command subclass: {link.command!r}.")
+            if not callable(link.args_factory) or not callable(link.result_extractor):
+                raise ValueError(f"Link {position} has an args factory or result extractor that is not callable.")
+
+    @property
+    def links(self) -> tuple[AnyCommandChainLink, ...]:
+        """
+        Returns the links of the template.
+
+        Returns:
+            tuple[AnyCommandChainLink, ...]: The links of the template.
+        """
+        return self._links
+
+    def __len__(self) -> int:
+        """
+        Get the number of links in the template.
+
+        Returns:
+            int: The number of links in the template.
+        """
+        return len(self._links)
+
+    def instantiate(
+        self,
+        input_data: inputDataType,
+        queue: CommandQueue,
+        same_pass: bool = False,
+        retain_results: bool = True,
+    ) -> "CommandChain[inputDataType, outputDataType]":
+        """
+        Create a chain running this template's links on `input_data`. This does not submit the chain.
+
+        Args:
+            input_data (inputDataType): The input data of the chain.
+            queue (CommandQueue): The queue the links of the chain are submitted to.
+            same_pass (bool, optional): Run the whole chain in a single pass, see `CommandChainBuilder.build()`. Defaults to False.
+            retain_results (bool, optional): Keep every link's response and result, see `CommandChainBuilder.build()`. Defaults to True.
+
+        Returns:
+            CommandChain[inputDataType, outputDataType]: The chain.
+        """
+        return CommandChain(
+            args=CommandChainArgs(
+                queue=queue,
+                input_data=input_data,
+                chain=self,
+                same_pass=same_pass,
+                retain_results=retain_results,
             )
         )
 
+    def submit_many(
+        self, inputs: Iterable[inputDataType], queue: CommandQueue, same_pass: bool = False
+    ) -> "list[CommandChainResponse[outputDataType]]":
+        """
+        Create one chain per input and submit all of them to `queue` at once.
+
+        The chains advance in lockstep: all first links are submitted in the same pass, then all second links once those
+        have executed, and so on, so a queue processes (and can batch) the commands of each link together.
+
+        Args:
+            inputs (Iterable[inputDataType]): The input data of each chain.
+            queue (CommandQueue): The queue to submit the chains and their links to.
+            same_pass (bool, optional): Run each chain in a single pass, see `CommandChainBuilder.build()`. Defaults to False.
+
+        Returns:
+            list[CommandChainResponse[outputDataType]]: The responses of the chains, in the order of `inputs`.
+        """
+        chains = [self.instantiate(input_data, queue, same_pass=same_pass) for input_data in inputs]
+        queue.submit_many(*chains)
+        return [chain.response for chain in chains]
+
 
 @dataclass
 class CommandChainArgs(CommandArgs, Generic[inputDataType, outputDataType]):
     queue: CommandQueue
     input_data: inputDataType
-    chain: CommandChainBuilder[inputDataType, outputDataType]
+    chain: Union[
+        CommandChainBuilder[inputDataType, outputDataType],
+        ChainTemplate[inputDataType, outputDataType],
+    ]
+    same_pass: bool = False
+    retain_results: bool = True
 
 
 @dataclass
@@ -133,6 +471,8 @@ class CommandChainResponse(CommandResponse, Generic[outputDataType]):
         output_data (Optional[outputDataType]): The final output data of the command chain, if available.
         responses (list[CommandResponse]): A list of responses from each command in the chain.
         intermediate_results (list[Any]): A list of intermediate results collected during the execution of the chain, including the final output data.
+            The result of a `map()` stage is the list of its per-branch results.
+            `responses` and `intermediate_results` stay empty if the chain was built with `retain_results=False`.
     """
 
     output_data: Optional[outputDataType] = None
@@ -153,6 +493,128 @@ class CommandChain(
     ARGS: type[CommandChainArgs[inputDataType, outputDataType]] = CommandChainArgs
     _response_type: type[CommandChainResponse[outputDataType]] = CommandChainResponse
 
+    def __post_init__(self) -> None:
+        self._finished = False
+        # ends the chain's trace span, set by a tracing queue while links are still running
+        self._end_trace: Optional[Callable[[], None]] = None
+        # results not yet taken by `stream()`/`astream()`, None until one of them is called
+        self._stream_buffer: Optional[deque[Any]] = None
+        self._stream_condition = Condition()
+
+    def _record_result(self, result: Any) -> None:
+        """Record the result of a link, and hand it to the stream consumer if there is one."""
+        if self.args.retain_results:
+            self.response.intermediate_results.append(result)
+        if self._stream_buffer is not None:
+            with self._stream_condition:
+                self._stream_buffer.append(result)
+                self._stream_condition.notify_all()
+
+    def _record_response(self, response: CommandResponse) -> None:
+        if self.args.retain_results:
+            self.response.responses.append(response)
+
+    def _finish(self, output_data: Optional[outputDataType] = None, failed: bool = False) -> None:
+        """Mark the chain as completed or failed, and wake up any stream consumer."""
+        if self._finished:
+            return
+        if failed:
+            self.response.set_failed()
+        else:
+            self.response.set_completed()
+            self.response.output_data = output_data
+        with self._stream_condition:
+            self._finished = True
+            self._stream_condition.notify_all()
+            end_trace, self._end_trace = self._end_trace, None
+        if end_trace is not None:
+            end_trace()
+
+    def _defer_trace_end(self, end: Callable[[], None]) -> bool:
+        """Keep the chain's span open until its last link finished, `execute()` only starts the first one."""
+        with self._stream_condition:
+            if self._finished:
+                return False
+            self._end_trace = end
+            return True
+
+    def _start_stream(self) -> deque[Any]:
+        """Start buffering results for a stream consumer, including the results retained so far."""
+        with self._stream_condition:
+            if self._stream_buffer is None:
+                self._stream_buffer = deque(self.response.intermediate_results)
+            return self._stream_buffer
+
+    def stream(self, drive: bool = True) -> Iterator[Any]:
+        """
+        Yield the result of each link as soon as it is produced, including the final output.
+
+        A `map()` stage yields the list of its per-branch results. Build the chain with `retain_results=False` so that
+        results are only held until they are yielded, and call this before the queue processes the chain: results
+        produced earlier are only available if they were retained. The iterator stops when the chain has finished; if it
+        stopped because the chain failed, `self.response.status` is `ResponseStatus.FAILED`.
+
+        Args:
+            drive (bool, optional): Call `process_once()` on the chain's queue whenever no result is ready. Set to False
+                if another thread processes the queue. Defaults to True.
+
+        Returns:
+            Iterator[Any]: The result of each link, in order.
+        """
+        return self._iterate_stream(self._start_stream(), drive)
+
+    def _iterate_stream(self, buffer: deque[Any], drive: bool) -> Iterator[Any]:
+        while True:
+            with self._stream_condition:
+                if not drive:
+                    self._stream_condition.wait_for(lambda: bool(buffer) or self._finished)
+                has_result = bool(buffer)
+                result = buffer.popleft() if has_result else None
+                finished = self._finished
+            if has_result:
+                yield result
+            elif finished:
+                return
+            elif len(self.args.queue) == 0:
+                # nothing left that could finish the chain
+                return
+            else:
+                self.args.queue.process_once()
+
+    def astream(self, drive: bool = True, poll_interval_s: float = 0.001) -> AsyncIterator[Any]:
+        """
+        Asynchronously yield the result of each link as soon as it is produced, see `stream()`.
+
+        Args:
+            drive (bool, optional): Call `process_once()` on the chain's queue whenever no result is ready, yielding to the
+                event loop between passes. Set to False if another thread processes the queue. Defaults to True.
+            poll_interval_s (float, optional): How long to sleep between checks for new results when not driving the queue. Defaults to 0.001.
+
+        Returns:
+            AsyncIterator[Any]: The result of each link, in order.
+        """
+        return self._aiterate_stream(self._start_stream(), drive, poll_interval_s)
+
+    async def _aiterate_stream(
+        self, buffer: deque[Any], drive: bool, poll_interval_s: float
+    ) -> AsyncIterator[Any]:
+        while True:
+            with self._stream_condition:
+                has_result = bool(buffer)
+                result = buffer.popleft() if has_result else None
+                finished = self._finished
+            if has_result:
+                yield result
+            elif finished:
+                return
+            elif drive:
+                if len(self.args.queue) == 0:
+                    return
+                self.args.queue.process_once()
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(poll_interval_s)
+
     def _on_command_execute(
         self,
         link: CommandChainLink[Any, Any, Any, Any],
@@ -164,12 +626,17 @@ class CommandChain(
         Handles the response from the command, extracting the output data and adding the next command to the queue.
         """
         if not response.should_proceed:
-            self.response.set_failed()
+            self._finish(failed=True)
             return
-        intermediate_result = link.result_extractor(command.response)
-        self.response.intermediate_results.append(intermediate_result)
-        # submit the next command
-        self._submit_chained_command(next_index, intermediate_result)
+        try:
+            intermediate_result = link.result_extractor(command.response)
+            self._record_result(intermediate_result)
+            # submit the next command
+            self._submit_chained_command(next_index, intermediate_result)
+        except Exception:
+            # the callback's error is recorded in its `CallbackRecord`, the chain cannot go on without the result
+            self._finish(failed=True)
+            raise
 
     def _submit_chained_command(self, position: int, previous_data: Any) -> None:
         """Process the next command in the chain using the extracted data from the previous command.
@@ -177,29 +644,97 @@ class CommandChain(
         Adds intermediate results to the response, builds callbacks for the next command, and submits it to the queue.
         """
         if position >= len(self.args.chain.links):
-            self.response.set_completed()
-            # set the final output data to the last intermediate result or None if there are no results somehow
-            self.response.output_data = (
-                self.response.intermediate_results[-1]
-                if self.response.intermediate_results
-                else None
-            )
+            # the final output data is the last intermediate result, or None if there are no links
+            self._finish(output_data=previous_data if position > 0 else None)
             return
 
         link = self.args.chain.links[position]
+        if isinstance(link, CommandChainStopLink):
+            if link.predicate(previous_data):
+                self._finish(output_data=previous_data)
+            else:
+                self._submit_chained_command(position + 1, previous_data)
+            return
+        if isinstance(link, CommandChainBranchLink):
+            link = link.selector(previous_data)
+        if isinstance(link, CommandChainLocalLink):
+            result = link.function(previous_data)
+            self._record_result(result)
+            self._submit_chained_command(position + 1, result)
+            return
+        if isinstance(link, CommandChainMapLink):
+            self._submit_map_stage(link, position, previous_data)
+            return
+
         args = link.args_factory(previous_data)
         command = link.command(args)
-        command.add_on_cancel_callback(lambda _: self.response.set_failed())
+        command.trace_parent = self
+        command.add_on_cancel_callback(lambda _: self._finish(failed=True), inline=True)
         command.add_on_execute_callback(
             lambda response: self._on_command_execute(
                 link=link, response=response, command=command, next_index=position + 1
-            )
+            ),
+            inline=True,
         )
-        self.response.responses.append(self.args.queue.submit(command))
+        self._record_response(self._submit(command))
+
+    def _submit_map_stage(
+        self, link: CommandChainMapLink[Any, Any, Any, Any], position: int, previous_data: Iterable[Any]
+    ) -> None:
+        """Submit one command per element of `previous_data`, and continue the chain once all of them have executed."""
+        commands = [link.command(link.args_factory(element)) for element in previous_data]
+        for command in commands:
+            command.trace_parent = self
+        results: list[Any] = [None] * len(commands)
+        remaining = [len(commands)]
+        failed = [False]
+
+        def on_branch_failed() -> None:
+            if not failed[0]:
+                failed[0] = True
+                self._finish(failed=True)
+
+        def on_branch_execute(index: int, response: ExecutionResponse) -> None:
+            if failed[0]:
+                return
+            if not response.should_proceed:
+                on_branch_failed()
+                return
+            try:
+                results[index] = link.result_extractor(commands[index].response)
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    self._record_result(results)
+                    self._submit_chained_command(position + 1, results)
+            except Exception:
+                on_branch_failed()
+                raise
+
+        if not commands:
+            self._record_result(results)
+            self._submit_chained_command(position + 1, results)
+            return
+        for index, command in enumerate(commands):
+            command.add_on_cancel_callback(lambda _: on_branch_failed(), inline=True)
+            command.add_on_execute_callback(partial(on_branch_execute, index), inline=True)
+        if self.args.same_pass:
+            responses = [self.args.queue.submit_next(command) for command in commands]
+        else:
+            responses = self.args.queue.submit_many(*commands)
+        for response in responses:
+            self._record_response(response)
+
+    def _submit(self, command: Command[Any, Any]) -> CommandResponse:
+        """Submit a single link's command, to the fast lane if the chain runs in a single pass."""
+        if self.args.same_pass:
+            return self.args.queue.submit_next(command)
+        return self.args.queue.submit(command)
 
     def execute(self) -> ExecutionResponse:
         """Execute all commands in the chain using callbacks to create the arguments for each subsequent command."""
-        if not self.args.chain:
-            return ExecutionResponse.success()  # pragma: no cover
-        self._submit_chained_command(0, self.args.input_data)
+        try:
+            self._submit_chained_command(0, self.args.input_data)
+        except Exception:
+            self._finish(failed=True)
+            raise
         return ExecutionResponse.success()
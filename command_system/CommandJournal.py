@@ -0,0 +1,600 @@
+"""Append-only write-ahead journal of command submissions and status transitions, and compact queue snapshots."""
+
+import mmap
+import os
+import pickle
+import struct
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from io import BufferedWriter
+from logging import Logger, getLogger
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Iterable, Iterator, Mapping, Optional, Type, Union
+from weakref import WeakKeyDictionary
+
+from .Command import Command, CommandArgs, CommandResponse
+from .CommandResponse import ResponseStatus
+from .Dependencies import DependencyEntry
+
+CommandRegistry = Union[Mapping[str, Type[Command[Any, Any]]], Iterable[Type[Command[Any, Any]]]]
+"""Either a mapping of `command_type_name()` to command classes, or an iterable of command classes."""
+
+_JOURNAL_MAGIC = b"CSJ1"
+_SNAPSHOT_MAGIC = b"CSS1"
+# crc32, record type, command id, payload length
+_RECORD_HEADER = struct.Struct("<IBQI")
+_NAME_LENGTH = struct.Struct("<H")
+_DEPENDENCY_COUNT = struct.Struct("<H")
+# dependency command id, on_pending, on_canceled, on_failed, on_completed
+_DEPENDENCY = struct.Struct("<QBBBB")
+_DEFERRAL_COUNT = struct.Struct("<I")
+
+_RECORD_SUBMIT = 1
+"""A command was submitted to the queue."""
+_RECORD_DECLARE = 2
+"""A command that was never submitted, but is depended on by a submitted command."""
+_RECORD_STATUS = 3
+"""A command reached a new status."""
+_RECORD_ENQUEUE = 4
+"""A previously declared command was submitted to the queue."""
+_RECORD_DEFERRALS = 5
+"""How many times a command had been deferred when it was written, only written if it was deferred."""
+
+_ACTION_CODES = {"proceed": 0, "defer": 1, "cancel": 2}
+_ACTION_NAMES = {code: name for name, code in _ACTION_CODES.items()}
+_STATUS_CODES = {status: code for code, status in enumerate(ResponseStatus)}
+_STATUS_BY_CODE = {code: status for status, code in _STATUS_CODES.items()}
+_FINAL_STATUSES = (ResponseStatus.CANCELED, ResponseStatus.COMPLETED, ResponseStatus.FAILED)
+
+
+def command_type_name(command_type: Type[Command[Any, Any]]) -> str:
+    """Get the name a command class is recorded under, `module.QualifiedName`."""
+    return f"{command_type.__module__}.{command_type.__qualname__}"
+
+
+@dataclass
+class _Record:
+    record_type: int
+    command_id: int
+    payload: memoryview
+
+
+class _RecordWriter:
+    """
+    Encodes commands and status changes into binary records.
+
+    Every command gets an id the first time it is written, dependencies are written (as declarations) before the
+    commands that depend on them.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        ids: "Optional[WeakKeyDictionary[Command[Any, Any], int]]" = None,
+        next_id: int = 0,
+        track_written: bool = False,
+    ):
+        """
+        Args:
+            logger (Logger): Logger for commands that cannot be encoded.
+            ids (Optional[WeakKeyDictionary], optional): Existing command ids to reuse. Defaults to None.
+            next_id (int, optional): Next id to hand out. Defaults to 0.
+            track_written (bool, optional): If True, commands that already have an id are still written once to this writer. Defaults to False.
+        """
+        self.logger = logger
+        self.buffer = bytearray()
+        self.ids: WeakKeyDictionary[Command[Any, Any], int] = (
+            ids if ids is not None else WeakKeyDictionary()
+        )
+        self.next_id = next_id
+        self._written: Optional[set[int]] = set() if track_written else None
+        # ids of commands that were only declared, and ids of commands that are queued and not finished
+        self.declared: set[int] = set()
+        self.live: dict[int, Command[Any, Any]] = {}
+
+    def append(self, record_type: int, command_id: int, payload: bytes) -> None:
+        header = _RECORD_HEADER.pack(0, record_type, command_id, len(payload))
+        crc = zlib.crc32(payload, zlib.crc32(header[4:]))
+        self.buffer += _RECORD_HEADER.pack(crc, record_type, command_id, len(payload))
+        self.buffer += payload
+
+    def write_command(self, command: Command[Any, Any], queued: bool) -> Optional[int]:
+        """Write a command (and any unwritten dependencies), returns its id or None if it cannot be encoded."""
+        command_id = self.ids.get(command)
+        if command_id is not None and (self._written is None or command_id in self._written):
+            if queued and command_id in self.declared:
+                self.declared.discard(command_id)
+                self.append(_RECORD_ENQUEUE, command_id, b"")
+                if command.response.status not in _FINAL_STATUSES:
+                    self.live[command_id] = command
+            return command_id
+        name = command_type_name(command.__class__).encode()
+        try:
+            args = pickle.dumps(command.args, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self.logger.warning(
+                f"Not journaling {command.__class__.__name__}, its args cannot be pickled: {e}"
+            )
+            return None
+        dependencies = bytearray()
+        dependency_count = 0
+        for dependency in command._dependencies:
+            dependency_id = self.write_command(dependency.command, queued=False)
+            if dependency_id is None:
+                continue
+            dependencies += _DEPENDENCY.pack(
+                dependency_id,
+                _ACTION_CODES[dependency.on_pending],
+                _ACTION_CODES[dependency.on_canceled],
+                _ACTION_CODES[dependency.on_failed],
+                _ACTION_CODES[dependency.on_completed],
+            )
+            dependency_count += 1
+        if command_id is None:
+            command_id = self.next_id
+            self.next_id += 1
+            self.ids[command] = command_id
+        if self._written is not None:
+            self._written.add(command_id)
+        if queued:
+            if command.response.status not in _FINAL_STATUSES:
+                self.live[command_id] = command
+        else:
+            self.declared.add(command_id)
+        self.append(
+            _RECORD_SUBMIT if queued else _RECORD_DECLARE,
+            command_id,
+            b"".join(
+                (
+                    _NAME_LENGTH.pack(len(name)),
+                    name,
+                    _DEPENDENCY_COUNT.pack(dependency_count),
+                    dependencies,
+                    args,
+                )
+            ),
+        )
+        if command.response.status != ResponseStatus.CREATED:
+            self.write_status(command_id, command.response.status)
+        if command.deferral_count:
+            self.append(_RECORD_DEFERRALS, command_id, _DEFERRAL_COUNT.pack(command.deferral_count))
+        return command_id
+
+    def written_ids(self) -> set[int]:
+        """Ids of the commands written to this writer, only available with `track_written`."""
+        if self._written is None:
+            raise ValueError("This writer does not track written commands.")
+        return self._written
+
+    def write_status(self, command_id: int, status: ResponseStatus) -> None:
+        self.append(_RECORD_STATUS, command_id, bytes((_STATUS_CODES[status],)))
+        if status in _FINAL_STATUSES:
+            self.live.pop(command_id, None)
+
+
+class _RecordReader:
+    """Rebuilds commands from records, later records are applied on top of earlier ones."""
+
+    def __init__(self, registry: CommandRegistry):
+        if isinstance(registry, Mapping):
+            self._types_by_name = dict(registry)
+        else:
+            self._types_by_name = {
+                command_type_name(command_type): command_type for command_type in registry
+            }
+        self.commands: dict[int, Command[CommandArgs, CommandResponse]] = {}
+        self.queued: dict[int, None] = {}  # insertion ordered set
+
+    @staticmethod
+    @contextmanager
+    def read_file(path: str, magic: bytes) -> Iterator[tuple[list[_Record], int]]:
+        """
+        Read the valid records of a file, stopping at the first torn or corrupt record.
+
+        The file is memory-mapped, records reference it without copying and are only valid inside the `with` block.
+        The mapping is closed when the block exits.
+
+        Yields:
+            tuple[list[_Record], int]: The records, and the length of the valid part of the file.
+        """
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                yield [], 0
+                return
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        records: list[_Record] = []
+        data = memoryview(mapping)
+        try:
+            if bytes(data[: len(magic)]) != magic:
+                raise ValueError(f"{path} is not a command journal or snapshot.")
+            offset = len(magic)
+            while offset + _RECORD_HEADER.size <= len(data):
+                crc, record_type, command_id, length = _RECORD_HEADER.unpack_from(data, offset)
+                payload_start = offset + _RECORD_HEADER.size
+                payload = data[payload_start : payload_start + length]
+                if len(payload) < length or (
+                    # a torn write at the end of the file, or a corrupt record
+                    zlib.crc32(payload, zlib.crc32(data[offset + 4 : payload_start])) != crc
+                ):
+                    payload.release()
+                    break
+                records.append(_Record(record_type, command_id, payload))
+                offset = payload_start + length
+            yield records, offset
+        finally:
+            # every view of the mapping has to be released before it can be closed
+            for record in records:
+                record.payload.release()
+            data.release()
+            mapping.close()
+
+    def apply(self, records: list[_Record]) -> None:
+        for record in records:
+            if record.record_type == _RECORD_STATUS:
+                command = self.commands.get(record.command_id)
+                if command is None:
+                    continue  # finished before the snapshot it was compacted into
+                status = _STATUS_BY_CODE[record.payload[0]]
+                command.response.status = status
+                if status in _FINAL_STATUSES:
+                    self.queued.pop(record.command_id, None)
+                continue
+            if record.record_type == _RECORD_DEFERRALS:
+                command = self.commands.get(record.command_id)
+                if command is not None:
+                    (command.deferral_count,) = _DEFERRAL_COUNT.unpack(record.payload)
+                continue
+            if record.record_type == _RECORD_ENQUEUE:
+                if self.commands[record.command_id].response.status not in _FINAL_STATUSES:
+                    self.queued[record.command_id] = None
+                continue
+            if record.command_id not in self.commands:
+                self.commands[record.command_id] = self._decode_command(record.payload)
+            if (
+                record.record_type == _RECORD_SUBMIT
+                and self.commands[record.command_id].response.status not in _FINAL_STATUSES
+            ):
+                self.queued[record.command_id] = None
+
+    def _decode_command(self, payload: memoryview) -> Command[CommandArgs, CommandResponse]:
+        (name_length,) = _NAME_LENGTH.unpack_from(payload, 0)
+        offset = _NAME_LENGTH.size
+        name = bytes(payload[offset : offset + name_length]).decode()
+        offset += name_length
+        (dependency_count,) = _DEPENDENCY_COUNT.unpack_from(payload, offset)
+        offset += _DEPENDENCY_COUNT.size
+        dependencies: list[DependencyEntry | Command[Any, Any]] = []
+        for _ in range(dependency_count):
+            dependency_id, on_pending, on_canceled, on_failed, on_completed = (
+                _DEPENDENCY.unpack_from(payload, offset)
+            )
+            offset += _DEPENDENCY.size
+            dependencies.append(
+                DependencyEntry(
+                    self.commands[dependency_id],
+                    on_pending=_ACTION_NAMES[on_pending],  # type: ignore[arg-type]
+                    on_canceled=_ACTION_NAMES[on_canceled],  # type: ignore[arg-type]
+                    on_failed=_ACTION_NAMES[on_failed],  # type: ignore[arg-type]
+                    on_completed=_ACTION_NAMES[on_completed],  # type: ignore[arg-type]
+                )
+            )
+        args = pickle.loads(payload[offset:])
+        return self._types_by_name[name](args, dependencies=dependencies)
+
+    def pending(self) -> list[Command[Any, Any]]:
+        """The commands that were queued but had not reached a final status, in submission order."""
+        return [self.commands[command_id] for command_id in self.queued]
+
+
+def _write_file_atomically(path: str, magic: bytes, data: bytes | bytearray) -> None:
+    """Write a file next to `path`, fsync it, and move it into place."""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(magic)
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def write_snapshot(path: Union[str, "os.PathLike[str]"], commands: Iterable[Command[Any, Any]]) -> None:
+    """
+    Write a snapshot of queued commands, their args, statuses and dependency edges to a compact binary file.
+
+    Args:
+        path (str | PathLike): Path of the snapshot file, it is replaced atomically.
+        commands (Iterable[Command[Any, Any]]): The queued commands, in queue order.
+    """
+    writer = _RecordWriter(getLogger(__name__))
+    for command in commands:
+        writer.write_command(command, queued=True)
+    _write_file_atomically(os.fspath(path), _SNAPSHOT_MAGIC, writer.buffer)
+
+
+def read_snapshot(
+    path: Union[str, "os.PathLike[str]"], registry: CommandRegistry
+) -> list[Command[Any, Any]]:
+    """
+    Rebuild the queued commands of a snapshot written by `write_snapshot()`.
+
+    Args:
+        path (str | PathLike): Path of the snapshot file.
+        registry (CommandRegistry): The command classes that may appear in the snapshot.
+
+    Raises:
+        KeyError: If the snapshot contains a command class that is not in the registry.
+
+    Returns:
+        list[Command[Any, Any]]: The queued commands, in queue order.
+    """
+    reader = _RecordReader(registry)
+    with reader.read_file(os.fspath(path), _SNAPSHOT_MAGIC) as (records, _):
+        reader.apply(records)
+    return reader.pending()
+
+
+class CommandJournal:
+    """
+    An append-only journal of command submissions and status transitions, used to recover a `CommandQueue` after a crash.
+
+    Records are compact binary entries (a CRC-protected header, the command class name, dependency edges and the pickled
+    args). They are buffered in memory and group-committed: the buffer is written and fsync'd when `commit()` is called
+    (`CommandQueue` does this after every pass), and by a background flusher thread once `group_commit_bytes` have been
+    buffered, or `group_commit_interval_s` has passed since the last commit. Recording never waits for the disk, and a
+    commit only blocks recording while it takes the buffer. A submission is only durable once it has been committed.
+
+    `compact()` folds the journal into a snapshot, so recovery does not have to replay an ever-growing file.
+
+    Commands that cannot be pickled (e.g. `CommandChain`) are not journaled, and dependencies added after a command was
+    submitted are not recorded.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, "os.PathLike[str]"],
+        group_commit_bytes: int = 1 << 20,
+        group_commit_interval_s: float = 0.05,
+        fsync: bool = True,
+    ):
+        """
+        Open (or create) a journal file for appending.
+
+        Args:
+            path (str | PathLike): Path of the journal file. Segments rotated out by `compact()` are stored next to it as `<path>.<n>`.
+            group_commit_bytes (int, optional): Commit once this many bytes are buffered. Defaults to 1 MiB.
+            group_commit_interval_s (float, optional): Commit when a record is added this long after the last commit. Defaults to 0.05.
+            fsync (bool, optional): Whether to fsync on commit, disable only if durability across power loss is not needed. Defaults to True.
+        """
+        self.path = os.fspath(path)
+        self.logger = getLogger(f"{self.__class__.__module__}.{self.__class__.__name__}@{id(self)}")
+        self._group_commit_bytes = group_commit_bytes
+        self._group_commit_interval_s = group_commit_interval_s
+        self._fsync = fsync
+        self._file = self._open_segment()
+        self._writer = _RecordWriter(self.logger)
+        # guards the record writer
+        self._lock = Lock()
+        # serializes writing, fsyncing and rotating the file, taken before `_lock` when both are needed
+        self._io_lock = Lock()
+        self._last_commit = monotonic()
+        self._compaction: Optional[Thread] = None
+        # started by the first record that needs a size- or interval-triggered commit
+        self._flusher: Optional[Thread] = None
+        self._flush_requested = Event()
+        self._closed = False
+
+    def _open_segment(self) -> BufferedWriter:
+        file = open(self.path, "ab")
+        if file.tell() == 0:
+            file.write(_JOURNAL_MAGIC)
+        return file
+
+    def _rotated_segments(self) -> list[str]:
+        """Paths of the segments rotated out by `compact()` that have not been deleted yet, oldest first."""
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        numbers = sorted(
+            int(name[len(prefix) :])
+            for name in os.listdir(directory)
+            if name.startswith(prefix) and name[len(prefix) :].isdigit()
+        )
+        return [f"{self.path}.{number}" for number in numbers]
+
+    # Writing
+
+    def _maybe_commit_locked(self) -> None:
+        """Wake the flusher if the buffer is due for a commit."""
+        if (
+            len(self._writer.buffer) >= self._group_commit_bytes
+            or monotonic() - self._last_commit >= self._group_commit_interval_s
+        ):
+            if self._flusher is None:
+                self._flusher = Thread(target=self._flush_loop, name=f"flusher of {self.path}", daemon=True)
+                self._flusher.start()
+            self._flush_requested.set()
+
+    def _flush_loop(self) -> None:
+        """Commit whenever a record asks for it, until the journal is closed."""
+        while True:
+            self._flush_requested.wait()
+            self._flush_requested.clear()
+            if self._closed:
+                return
+            try:
+                self.commit()
+            except Exception:
+                self.logger.exception("Group commit failed, the records stay buffered")
+
+    def record_submit(self, command: Command[Any, Any]) -> None:
+        """
+        Record that a command was submitted to the queue. Commands that were already journaled are ignored.
+
+        Args:
+            command (Command[Any, Any]): The submitted command.
+        """
+        with self._lock:
+            self._writer.write_command(command, queued=True)
+            self._maybe_commit_locked()
+
+    def record_status(self, command: Command[Any, Any]) -> None:
+        """
+        Record the current status of a command. Commands that were never journaled are ignored.
+
+        Args:
+            command (Command[Any, Any]): The command whose status changed.
+        """
+        with self._lock:
+            command_id = self._writer.ids.get(command)
+            if command_id is None:
+                return
+            self._writer.write_status(command_id, command.response.status)
+            self._maybe_commit_locked()
+
+    def _commit_locked(self) -> None:
+        """Write and fsync the buffer, must hold both `_io_lock` and `_lock`."""
+        if self._writer.buffer:
+            self._file.write(self._writer.buffer)
+            self._writer.buffer.clear()
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        self._last_commit = monotonic()
+
+    def commit(self) -> None:
+        """Write all buffered records to the journal file and fsync it. Records can be added while the file is fsync'd."""
+        with self._io_lock:
+            with self._lock:
+                buffer = self._writer.buffer
+                if not buffer:
+                    return
+                self._writer.buffer = bytearray()
+            try:
+                self._file.write(buffer)
+                self._file.flush()
+                if self._fsync:
+                    os.fsync(self._file.fileno())
+            except BaseException:
+                # keep the records, in order, for the next commit
+                with self._lock:
+                    self._writer.buffer[:0] = buffer
+                raise
+            self._last_commit = monotonic()
+
+    def close(self) -> None:
+        """Commit any buffered records, stop the flusher, wait for a running compaction, and close the journal file."""
+        self.wait_for_compaction()
+        self._closed = True
+        if self._flusher is not None:
+            self._flush_requested.set()
+            self._flusher.join()
+        with self._io_lock, self._lock:
+            self._commit_locked()
+            self._file.close()
+
+    # Compaction
+
+    def compact(self, snapshot_path: Union[str, "os.PathLike[str]"], background: bool = True) -> None:
+        """
+        Fold everything journaled so far into a snapshot, and delete the journal segments it replaces.
+
+        The live commands are encoded and the journal is rotated to a fresh segment while holding the journal lock.
+        Writing and fsyncing the snapshot, and deleting the old segments, happens on a background thread if `background`
+        is set. Until that finishes, recovery uses the previous snapshot and the old segments.
+
+        Args:
+            snapshot_path (str | PathLike): Path of the snapshot file, pass the same path to `CommandQueue.recover()`.
+            background (bool, optional): Whether to write the snapshot on a background thread. Defaults to True.
+        """
+        self.wait_for_compaction()
+        with self._io_lock, self._lock:
+            self._commit_locked()
+            snapshot = _RecordWriter(
+                self.logger,
+                ids=self._writer.ids,
+                next_id=self._writer.next_id,
+                track_written=True,
+            )
+            for command in list(self._writer.live.values()):
+                snapshot.write_command(command, queued=True)
+            # commands that are not in the snapshot are forgotten, they are written again if they are needed later
+            kept = snapshot.written_ids()
+            self._writer.ids = WeakKeyDictionary(
+                (command, command_id)
+                for command, command_id in self._writer.ids.items()
+                if command_id in kept
+            )
+            self._writer.declared = snapshot.declared
+            self._writer.next_id = snapshot.next_id
+            # rotate the journal, so records written from now on are not deleted with the old segments
+            self._file.close()
+            old_segments = self._rotated_segments()
+            next_number = int(old_segments[-1].rsplit(".", 1)[1]) + 1 if old_segments else 1
+            rotated = f"{self.path}.{next_number}"
+            os.replace(self.path, rotated)
+            old_segments.append(rotated)
+            self._file = self._open_segment()
+            self._commit_locked()
+
+        def finish() -> None:
+            _write_file_atomically(os.fspath(snapshot_path), _SNAPSHOT_MAGIC, snapshot.buffer)
+            for segment in old_segments:
+                os.remove(segment)
+
+        if background:
+            self._compaction = Thread(target=finish, name=f"compaction of {self.path}")
+            self._compaction.start()
+        else:
+            finish()
+
+    def wait_for_compaction(self) -> None:
+        """Block until a background compaction started by `compact()` has finished."""
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    # Reading
+
+    def replay(
+        self,
+        registry: CommandRegistry,
+        snapshot_path: Optional[Union[str, "os.PathLike[str]"]] = None,
+    ) -> list[Command[Any, Any]]:
+        """
+        Rebuild the recorded commands, and continue journaling them under their recorded ids.
+
+        The snapshot (if it exists) is loaded first, then rotated segments that were not compacted yet, then the journal.
+
+        Args:
+            registry (CommandRegistry): The command classes that may appear in the journal.
+            snapshot_path (Optional[str | PathLike], optional): Snapshot written by `compact()`. Defaults to None.
+
+        Raises:
+            KeyError: If the journal contains a command class that is not in the registry.
+
+        Returns:
+            list[Command[Any, Any]]: The commands that were submitted but had not reached a final status, in submission order.
+        """
+        reader = _RecordReader(registry)
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            with reader.read_file(os.fspath(snapshot_path), _SNAPSHOT_MAGIC) as (records, _):
+                reader.apply(records)
+        with self._io_lock, self._lock:
+            self._commit_locked()
+            for segment in self._rotated_segments():
+                with reader.read_file(segment, _JOURNAL_MAGIC) as (records, _):
+                    reader.apply(records)
+            with reader.read_file(self.path, _JOURNAL_MAGIC) as (records, valid_length):
+                reader.apply(records)
+            if valid_length < self._file.tell():
+                # drop a torn tail, so new records are not appended after garbage
+                self._file.truncate(valid_length)
+            for command_id, command in reader.commands.items():
+                self._writer.ids[command] = command_id
+                if command_id in reader.queued:
+                    self._writer.live[command_id] = command
+                elif command.response.status == ResponseStatus.CREATED:
+                    self._writer.declared.add(command_id)
+            self._writer.next_id = max(self._writer.next_id, max(reader.commands, default=-1) + 1)
+        return reader.pending()
@@ -1,23 +1,43 @@
 """Helper classes for command lifecycle management."""
 
 from dataclasses import dataclass, field
+from enum import Enum
 from typing import Callable, Generic, Optional, Self, TypeVar, cast
 
 LifecycleResponseType = TypeVar("LifecycleResponseType", bound="LifecycleResponse")
 
 
+class CallbackRecordPolicy(Enum):
+    """
+    Which callback executions are recorded in `LifecycleResponse.executed_callbacks`, see `Command.callback_record_policy`.
+
+    - ALL: Every execution, with the callback and the exception it raised (with its traceback).
+    - ERRORS_ONLY: Only executions that raised, with the callback and the exception.
+    - ERRORS_STRIPPED: Only executions that raised, with the callback's name instead of the callback, and the
+      exception without its traceback, so neither keeps closures or stack frames alive.
+    - NONE: Nothing.
+    """
+
+    ALL = "all"
+    ERRORS_ONLY = "errors_only"
+    ERRORS_STRIPPED = "errors_stripped"
+    NONE = "none"
+
+
 @dataclass
 class CallbackRecord(Generic[LifecycleResponseType]):
     """
     Record of a callback's execution.
 
     Attributes:
-        callback (Callable[[LifecycleResponseType], None]): The callback function that was executed.
+        callback (Optional[Callable[[LifecycleResponseType], None]]): The callback function that was executed, None with `CallbackRecordPolicy.ERRORS_STRIPPED`.
         error (Optional[Exception]): The exception raised during the callback execution, if any.
+        callback_name (Optional[str]): Qualified name of the callback, only set with `CallbackRecordPolicy.ERRORS_STRIPPED`.
     """
 
-    callback: Callable[[LifecycleResponseType], None]
+    callback: Optional[Callable[[LifecycleResponseType], None]]
     error: Optional[Exception] = None
+    callback_name: Optional[str] = None
 
     @property
     def succeeded(self) -> bool:
@@ -47,6 +67,27 @@ class ReasonByCommandMethod(LifecycleResponseReason):
     pass
 
 
+@dataclass
+class ReasonByTimeout(LifecycleResponseReason):
+    """A reason for a lifecycle response that was created because the command ran for too long."""
+
+    pass
+
+
+@dataclass
+class ReasonByCancellation(LifecycleResponseReason):
+    """A reason for a lifecycle response that was created because the command was canceled with `CommandQueue.cancel()`."""
+
+    pass
+
+
+@dataclass
+class ReasonByAdmissionControl(LifecycleResponseReason):
+    """A reason for a lifecycle response that was created because the queue's `AdmissionController` shed the command."""
+
+    pass
+
+
 @dataclass
 class LifecycleResponse:
     """
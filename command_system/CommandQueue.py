@@ -1,15 +1,37 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from logging import getLogger
-from typing import Any, Optional, Type
+import os
+from typing import Any, Callable, Hashable, Optional, Self, Type, Union
 from collections import deque, defaultdict
 import statistics
+from threading import get_ident
 from time import perf_counter
+from weakref import WeakKeyDictionary
 from .Command import Command, CommandArgs, ResponseType
+from .CommandJournal import (
+    CommandJournal,
+    CommandRegistry,
+    command_type_name,
+    read_snapshot,
+    write_snapshot,
+)
+from .Metrics import MetricsObservation, QueueMetrics
+from .AdmissionControl import AdmissionController, _AdmissionWindow
+from .CallbackDispatch import CallbackDispatcher
+from .Cancellation import _deadlines
+from .Profiling import SamplingProfiler
+from .RateLimiting import RateLimiter
+from .Watchdog import CommandWatchdog
+from .Tracing import Span, Tracer, perf_counter_to_epoch_ns
 from .CommandLifecycle import (
+    CallbackRecordPolicy,
     CancelResponse,
     DeferResponse,
     ExecutionResponse,
     LifecycleResponse,
+    ReasonByAdmissionControl,
+    ReasonByCancellation,
+    ReasonByTimeout,
 )
 from .CommandResponse import CommandResponse, ResponseStatus
 from .Dependencies import (
@@ -52,7 +74,10 @@ class QueueProcessResponse:
         num_cancellations (int): Number of times a command was canceled.
         num_successes (int): Number of times a command executed and succeeded.
         num_failures (int): Number of times a command executed and failed.
+        num_parked (int): Number of times a command was parked by the queue's rate limiter.
+        num_delayed (int): Number of times a command was skipped because its type was over its admission budget.
         reached_max_iterations (bool): True if the maximum number of iterations was reached, false otherwise.
+        reached_time_budget (bool): True if processing stopped early because the time budget was used up, false otherwise.
     """
 
     command_log: list[CommandLogEntry]
@@ -62,7 +87,10 @@ class QueueProcessResponse:
     num_cancellations: int = 0
     num_successes: int = 0
     num_failures: int = 0
+    num_parked: int = 0
+    num_delayed: int = 0
     reached_max_iterations: bool = False
+    reached_time_budget: bool = False
 
     def __add__(self, other: "QueueProcessResponse") -> "QueueProcessResponse":
         """
@@ -81,7 +109,10 @@ class QueueProcessResponse:
             num_cancellations=self.num_cancellations + other.num_cancellations,
             num_successes=self.num_successes + other.num_successes,
             num_failures=self.num_failures + other.num_failures,
+            num_parked=self.num_parked + other.num_parked,
+            num_delayed=self.num_delayed + other.num_delayed,
             reached_max_iterations=self.reached_max_iterations or other.reached_max_iterations,
+            reached_time_budget=self.reached_time_budget or other.reached_time_budget,
             command_log=self.command_log + other.command_log,
         )
 
@@ -101,6 +132,18 @@ class _InternalQueueTimingEntry:
     callbacks_elapsed_ms: float = 0
 
 
+@dataclass
+class _InternalLatencyEntry:
+    """
+    Internal latency entry for a command that reached a final status.
+    """
+
+    command_type: Type[Command[Any, Any]]
+    queue_wait_ms: float  # submit -> first processed
+    end_to_end_ms: float  # submit -> final status
+    deferral_count: int
+
+
 @dataclass
 class CommandTimingData:
     """Timing data for a set of commands"""
@@ -110,6 +153,20 @@ class CommandTimingData:
         count: int
         avg_elapsed_ms: float = 0
         std_dev_elapsed_ms: float = 0
+        p50_elapsed_ms: float = 0
+        p99_elapsed_ms: float = 0
+
+        @classmethod
+        def from_samples(cls, samples: list[float]) -> "CommandTimingData.CommandTimingEntry":
+            """Summarize a list of durations (in ms), which must not be empty."""
+            ordered = sorted(samples)
+            return cls(
+                count=len(ordered),
+                avg_elapsed_ms=statistics.mean(ordered),
+                std_dev_elapsed_ms=statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+                p50_elapsed_ms=ordered[(len(ordered) - 1) // 2],
+                p99_elapsed_ms=ordered[min(len(ordered) - 1, (len(ordered) * 99) // 100)],
+            )
 
     should_defer_timing: CommandTimingEntry
     should_defer_percentage: float
@@ -123,18 +180,81 @@ class CommandTimingData:
     execute_failure_percentage: float
     """Percentage of the time execute() returned a failure, or NaN"""
     execute_callbacks: CommandTimingEntry
+    queue_wait: CommandTimingEntry = field(default_factory=lambda: CommandTimingData.CommandTimingEntry(count=0))
+    """Time from `submit()` until the command was first processed, for commands that reached a final status"""
+    end_to_end: CommandTimingEntry = field(default_factory=lambda: CommandTimingData.CommandTimingEntry(count=0))
+    """Time from `submit()` until the command reached a final status"""
+    avg_deferral_count: float = 0
+    """Average number of passes a command was deferred for before reaching a final status, or NaN"""
+
+
+@dataclass
+class _CommandTrace:
+    """Tracing state of a command, see `CommandQueue(tracer=...)`."""
+
+    span: Span
+    ended: bool = False
 
 
 class CommandQueue:
-    def __init__(self, timing_queue_length: int = 0):
+    def __init__(
+        self,
+        timing_queue_length: int = 0,
+        journal: Optional[CommandJournal] = None,
+        tracer: Optional[Tracer] = None,
+        metrics: Optional[QueueMetrics] = None,
+        profiler: Optional[SamplingProfiler] = None,
+        watchdog: Optional[CommandWatchdog] = None,
+        execution_timeout_s: Optional[float] = None,
+        callback_dispatcher: Optional[CallbackDispatcher] = None,
+        callback_record_policy: Optional[CallbackRecordPolicy] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        admission_controller: Optional[AdmissionController] = None,
+    ):
         """
         Construct a new CommandQueue.
 
         Args:
             timing_queue_length (int, optional): Length of the timing queue for performance measurement, set to 0 to disable timing. Defaults to 0.
+            journal (Optional[CommandJournal], optional): Journal to record submissions and final statuses in, so the queue can be recovered with `CommandQueue.recover()`. Defaults to None.
+            tracer (Optional[Tracer], optional): Tracer to open a span per command and per lifecycle stage with, None to disable tracing. Defaults to None.
+            metrics (Optional[QueueMetrics], optional): Metrics to update after every pass, None to disable metrics. Defaults to None.
+            profiler (Optional[SamplingProfiler], optional): Profiler to sample command executions with, None to disable sampling. Defaults to None.
+            watchdog (Optional[CommandWatchdog], optional): Watchdog to report executions that run for too long, None to disable it. Defaults to None.
+            execution_timeout_s (Optional[float], optional): Timeout of commands without their own `timeout_s`, None for no timeout. Defaults to None.
+            callback_dispatcher (Optional[CallbackDispatcher], optional): Dispatcher to run callbacks with, so the processing loop does not wait for them. Callbacks registered with `inline=True` still run on the processing thread. None to call every callback on the processing thread. Defaults to None.
+            callback_record_policy (Optional[CallbackRecordPolicy], optional): Which callback executions are recorded for commands that do not set their own `callback_record_policy`, None for `CallbackRecordPolicy.ALL`. Defaults to None.
+            rate_limiter (Optional[RateLimiter], optional): Rate limits and concurrency caps to hold commands to before executing them, None for no limits. Defaults to None.
+            admission_controller (Optional[AdmissionController], optional): Controller adapting how many commands of each type a pass processes to their measured timings, None to process every command on every pass. Defaults to None.
         """
         self._timing_queue_length = timing_queue_length
+        self._journal = journal
+        self._tracer = tracer
+        self._traces: WeakKeyDictionary[Command[Any, Any], _CommandTrace] = WeakKeyDictionary()
+        # commands whose span was kept open and can now end, see `Command._defer_trace_end()`
+        self._pending_trace_ends: list[Command[Any, Any]] = []
+        self._metrics = metrics
+        self._profiler = profiler
+        self._watchdog = watchdog
+        self._execution_timeout_s = execution_timeout_s
+        self._callback_dispatcher = callback_dispatcher
+        self._callback_record_policy = callback_record_policy
+        self._rate_limiter = rate_limiter
+        # key -> commands over the rate limiter's budget, oldest first, see `_admit()`
+        self._parked: dict[Hashable, deque[Command[Any, Any]]] = {}
+        # number of commands in `_parked`, so `len()` can be read from other threads without walking it
+        self._num_parked_commands = 0
+        # command -> key of the in-flight slot it holds, released by `_finish_execution()`
+        self._rate_limited: dict[Command[Any, Any], Hashable] = {}
+        self._admission_controller = admission_controller
+        self._admission_window = _AdmissionWindow()
+        # latency observations of the current pass, handed to `metrics` at the end of the pass
+        self._metrics_observations: list[MetricsObservation] = []
         self._queue: list[Command[Any, Any]] = []
+        # commands to process right after the current command, see `submit_next()`
+        self._fast_lane: deque[Command[Any, Any]] = deque()
+        # where the next pass starts in `_queue`, if the previous one stopped before reaching the end
+        self._cursor = 0
         self.logger = getLogger(f"{self.__class__.__module__}.{self.__class__.__name__}@{id(self)}")
 
         self._timing_should_defer: deque[_InternalQueueTimingEntry] = deque(
@@ -146,6 +266,11 @@ class CommandQueue:
         self._timing_execute: deque[_InternalQueueTimingEntry] = deque(
             maxlen=timing_queue_length,
         )
+        # command type -> (sum of `method_elapsed_ms`, count) over `_timing_execute`, see `_estimated_execute_s()`
+        self._timing_execute_totals: dict[Type[Command[Any, Any]], tuple[float, int]] = {}
+        self._timing_latency: deque[_InternalLatencyEntry] = deque(
+            maxlen=timing_queue_length,
+        )
 
     def submit(self, command: Command[Any, ResponseType]) -> ResponseType:
         """
@@ -157,9 +282,32 @@ class CommandQueue:
         Returns:
             ResponseType: The response object associated with the command.
         """
+        command.submitted_at = perf_counter()
+        if self._journal is not None:
+            self._journal.record_submit(command)
         self._queue.append(command)
         return command.response
 
+    def submit_next(self, command: Command[Any, ResponseType]) -> ResponseType:
+        """
+        Submit a command to the fast lane, so it is processed right after the command currently being processed, in the same pass.
+
+        Meant to be called from callbacks (e.g. to continue a `CommandChain` without waiting for the next pass), which run on
+        the processing thread. If called between passes, the command is processed first in the next pass.
+        A fast-lane command that is deferred joins the back of the queue.
+
+        Args:
+            command (Command[ArgsType, ResponseType]): The command to be submitted.
+
+        Returns:
+            ResponseType: The response object associated with the command.
+        """
+        command.submitted_at = perf_counter()
+        if self._journal is not None:
+            self._journal.record_submit(command)
+        self._fast_lane.append(command)
+        return command.response
+
     def submit_many(self, *commands: Command[Any, Any]) -> list[CommandResponse]:
         """
         Submit multiple commands to the queue.
@@ -175,6 +323,172 @@ class CommandQueue:
             responses.append(self.submit(command))
         return responses
 
+    @classmethod
+    def recover(
+        cls,
+        path: Union[str, "os.PathLike[str]"],
+        registry: CommandRegistry,
+        timing_queue_length: int = 0,
+        snapshot_path: Optional[Union[str, "os.PathLike[str]"]] = None,
+    ) -> Self:
+        """
+        Rebuild a queue from a journal written by a previous `CommandQueue(journal=CommandJournal(path))`.
+
+        Every journaled command that had not reached a final status is resubmitted, along with its `DependencyEntry` links.
+        Dependencies that had already finished are rebuilt with their final status, but not resubmitted.
+        The returned queue keeps appending to the same journal.
+
+        Args:
+            path (str | PathLike): Path of the journal file.
+            registry (CommandRegistry): The command classes that may appear in the journal, as an iterable of classes or a mapping of `command_type_name()` to class.
+            timing_queue_length (int, optional): Length of the timing queue for performance measurement, set to 0 to disable timing. Defaults to 0.
+            snapshot_path (Optional[str | PathLike], optional): Snapshot written by `compact()`, loaded before replaying the journal. Defaults to None.
+
+        Returns:
+            CommandQueue: The recovered queue.
+        """
+        journal = CommandJournal(path)
+        pending = journal.replay(registry, snapshot_path=snapshot_path)
+        queue = cls(timing_queue_length=timing_queue_length, journal=journal)
+        queue._queue.extend(pending)
+        return queue
+
+    def _pending_commands(self) -> list[Command[Any, Any]]:
+        """All commands held by the queue that have not been removed yet, in queue order."""
+        parked = [command for commands in self._parked.values() for command in commands]
+        return list(self._fast_lane) + self._queue + parked
+
+    def snapshot(self, path: Union[str, "os.PathLike[str]"]) -> None:
+        """
+        Write the commands in the queue to a compact snapshot file, which can be loaded with `CommandQueue.restore()`.
+
+        The snapshot contains each command's class, args and status, and its dependencies (which are restored but not requeued).
+        Commands whose args cannot be pickled are left out. Do not call this while another thread is processing the queue.
+
+        Args:
+            path (str | PathLike): Path of the snapshot file, it is replaced atomically.
+        """
+        write_snapshot(path, self._pending_commands())
+
+    @classmethod
+    def restore(
+        cls,
+        path: Union[str, "os.PathLike[str]"],
+        registry: CommandRegistry,
+        timing_queue_length: int = 0,
+    ) -> Self:
+        """
+        Create a queue containing the commands of a snapshot written by `snapshot()`.
+
+        Args:
+            path (str | PathLike): Path of the snapshot file.
+            registry (CommandRegistry): The command classes that may appear in the snapshot, as an iterable of classes or a mapping of `command_type_name()` to class.
+            timing_queue_length (int, optional): Length of the timing queue for performance measurement, set to 0 to disable timing. Defaults to 0.
+
+        Returns:
+            CommandQueue: The restored queue.
+        """
+        queue = cls(timing_queue_length=timing_queue_length)
+        queue._queue.extend(read_snapshot(path, registry))
+        return queue
+
+    def compact(self, snapshot_path: Union[str, "os.PathLike[str]"], background: bool = True) -> None:
+        """
+        Fold the queue's journal into a snapshot, so `recover()` does not have to replay the whole history.
+
+        See `CommandJournal.compact()`. Pass the same `snapshot_path` to `recover()`.
+
+        Raises:
+            ValueError: If the queue has no journal.
+
+        Args:
+            snapshot_path (str | PathLike): Path of the snapshot file.
+            background (bool, optional): Whether to write the snapshot on a background thread. Defaults to True.
+        """
+        if self._journal is None:
+            raise ValueError("Only queues with a journal can be compacted, use snapshot() instead.")
+        self._journal.compact(snapshot_path, background=background)
+
+    def _set_final_status(self, command: Command[Any, Any], status: ResponseStatus) -> None:
+        """Move a command to a final status (CANCELED, COMPLETED or FAILED), recording it in the journal."""
+        command.response.status = status
+        command.finished_at = perf_counter()
+        if command.submitted_at is not None and command.first_processed_at is not None:
+            queue_wait = command.first_processed_at - command.submitted_at
+            end_to_end = command.finished_at - command.submitted_at
+            self._timing_latency.append(
+                _InternalLatencyEntry(
+                    command_type=command.__class__,
+                    queue_wait_ms=queue_wait * 1000,
+                    end_to_end_ms=end_to_end * 1000,
+                    deferral_count=command.deferral_count,
+                )
+            )
+            if self._metrics is not None:
+                command_type = command_type_name(command.__class__)
+                self._metrics_observations.append(("queue_wait_seconds", command_type, queue_wait))
+                self._metrics_observations.append(("end_to_end_seconds", command_type, end_to_end))
+        if self._journal is not None:
+            self._journal.record_status(command)
+        if self._tracer is not None:
+            self._trace_end(command)
+            self._end_pending_traces()
+
+    # Tracing, all of these are only called if the queue has a tracer
+
+    def _trace_begin(self, command: Command[Any, Any]) -> None:
+        """Open the span of a command, as a child of its `trace_parent`'s span if it has one."""
+        if self._tracer is None:
+            return
+        parent = self._traces.get(command.trace_parent) if command.trace_parent is not None else None
+        self._traces[command] = _CommandTrace(
+            span=self._tracer.start_span(
+                f"command {command.__class__.__qualname__}",
+                parent=parent.span if parent is not None else None,
+                attributes={"command.type": command_type_name(command.__class__)},
+            )
+        )
+
+    def _trace_phase(self, command: Command[Any, Any], name: str, start: float, elapsed: float) -> None:
+        """Record a lifecycle stage that started at `start` (a `perf_counter()` value) as a child span of the command's span."""
+        trace = self._traces.get(command)
+        if self._tracer is None or trace is None:
+            return
+        self._tracer.start_span(
+            name, parent=trace.span, start_time_ns=perf_counter_to_epoch_ns(start)
+        ).end(perf_counter_to_epoch_ns(start + elapsed))
+
+    def _trace_dependency_reasons(
+        self, command: Command[Any, Any], dependency_response: DependencyCheckResponse
+    ) -> None:
+        """Record why the dependencies of a command deferred or canceled it."""
+        trace = self._traces.get(command)
+        if trace is not None:
+            trace.span.set_attribute(
+                "command.dependency_reasons", "; ".join(dependency_response.reasons)
+            )
+
+    def _trace_end(self, command: Command[Any, Any]) -> None:
+        """End the span of a command that reached a final status."""
+        trace = self._traces.get(command)
+        if trace is None or trace.ended:
+            return
+        if command._defer_trace_end(lambda: self._pending_trace_ends.append(command)):
+            return
+        trace.ended = True
+        trace.span.set_attribute("command.deferrals", command.deferral_count)
+        trace.span.set_attribute("command.status", command.response.status.value)
+        trace.span.end()
+
+    def _end_pending_traces(self) -> None:
+        """
+        End the spans of commands that finished since the last call.
+
+        A chain usually finishes in a callback of its last link, its span is only ended once that link's span has.
+        """
+        while self._pending_trace_ends:
+            self._trace_end(self._pending_trace_ends.pop())
+
     def _process_single_command(
         self,
         command: Command[CommandArgs, CommandResponse],
@@ -194,15 +508,54 @@ class CommandQueue:
         if command.response.status == ResponseStatus.CREATED:
             queue_process_response.num_ingested += 1
             command.response.status = ResponseStatus.PENDING
+            command.first_processed_at = perf_counter()
+            if command.submitted_at is None:  # e.g. recovered from a journal
+                command.submitted_at = command.first_processed_at
+            if self._callback_record_policy is not None and command.callback_record_policy is None:
+                command.callback_record_policy = self._callback_record_policy
+            if self._tracer is not None:
+                self._trace_begin(command)
         # now process the command based on its current status
         match command.response.status:
             case ResponseStatus.PENDING:
+                if self._admission_controller is not None and not self._admission_controller._admit(
+                    self._admission_window, command.__class__
+                ):
+                    if not self._admission_controller.shed:
+                        # over its type's budget for this pass, try again on the next one
+                        queue_process_response.num_delayed += 1
+                        return output, False
+                    queue_process_response.num_commands_processed += 1
+                    queue_process_response.num_cancellations += 1
+                    new_cancel_response = CancelResponse(
+                        should_proceed=False,
+                        reason=ReasonByAdmissionControl(
+                            f"Shed, {command.__class__.__qualname__} is over its admission budget for this pass"
+                        ),
+                    )
+                    self._call_callbacks(command.call_on_cancel_callbacks, new_cancel_response)
+                    output.responses.append(new_cancel_response)
+                    self._set_final_status(command, ResponseStatus.CANCELED)
+                    return output, True
                 queue_process_response.num_commands_processed += 1
+                # 0. canceled with `cancel()` before it could execute
+                token = command._cancellation_token
+                if token is not None and token.reason is not None:
+                    queue_process_response.num_cancellations += 1
+                    new_cancel_response = CancelResponse(should_proceed=False, reason=token.reason)
+                    self._call_callbacks(command.call_on_cancel_callbacks, new_cancel_response)
+                    output.responses.append(new_cancel_response)
+                    self._set_final_status(command, ResponseStatus.CANCELED)
+                    return output, True
                 # 1. check dependencies
+                start = perf_counter()
                 dependency_response = command.check_dependencies()
+                if self._tracer is not None:
+                    self._trace_phase(command, "check_dependencies", start, perf_counter() - start)
                 output.dependency_response = dependency_response
                 if dependency_response.status == DependencyAction.DEFER:
                     queue_process_response.num_deferrals += 1
+                    command.deferral_count += 1
                     new_defer_response = DeferResponse(
                         should_proceed=False,
                         reason=ReasonByDependencyCheck(
@@ -210,8 +563,11 @@ class CommandQueue:
                         ),
                     )
                     start = perf_counter()
-                    command.call_on_defer_callbacks(new_defer_response)
+                    self._call_callbacks(command.call_on_defer_callbacks, new_defer_response)
                     elapsed = perf_counter() - start
+                    if self._tracer is not None:
+                        self._trace_phase(command, "on_defer_callbacks", start, elapsed)
+                        self._trace_dependency_reasons(command, dependency_response)
                     self._timing_should_defer.append(
                         _InternalQueueTimingEntry(
                             command_type=command.__class__,
@@ -232,8 +588,11 @@ class CommandQueue:
                         ),
                     )
                     start = perf_counter()
-                    command.call_on_cancel_callbacks(new_cancel_response)
+                    self._call_callbacks(command.call_on_cancel_callbacks, new_cancel_response)
                     elapsed = perf_counter() - start
+                    if self._tracer is not None:
+                        self._trace_phase(command, "on_cancel_callbacks", start, elapsed)
+                        self._trace_dependency_reasons(command, dependency_response)
                     self._timing_should_cancel.append(
                         _InternalQueueTimingEntry(
                             command_type=command.__class__,
@@ -244,12 +603,14 @@ class CommandQueue:
                         )
                     )
                     output.responses.append(new_cancel_response)
-                    command.response.status = ResponseStatus.CANCELED
+                    self._set_final_status(command, ResponseStatus.CANCELED)
                     return output, True
                 # 2. check if we should defer
                 start = perf_counter()
                 defer_response = command.should_defer()
                 elapsed = perf_counter() - start
+                if self._tracer is not None:
+                    self._trace_phase(command, "should_defer", start, elapsed)
                 defer_timing_entry = _InternalQueueTimingEntry(
                     command_type=command.__class__,
                     method_elapsed_ms=elapsed * 1000,
@@ -257,9 +618,12 @@ class CommandQueue:
                 )
                 if not defer_response.should_proceed:
                     queue_process_response.num_deferrals += 1
+                    command.deferral_count += 1
                     start = perf_counter()
-                    command.call_on_defer_callbacks(defer_response)
+                    self._call_callbacks(command.call_on_defer_callbacks, defer_response)
                     elapsed = perf_counter() - start
+                    if self._tracer is not None:
+                        self._trace_phase(command, "on_defer_callbacks", start, elapsed)
                     defer_timing_entry.callbacks_count = command.on_defer_callbacks_count()
                     defer_timing_entry.callbacks_elapsed_ms = elapsed * 1000
                     self._timing_should_defer.append(defer_timing_entry)
@@ -267,106 +631,443 @@ class CommandQueue:
                     return output, False
                 self._timing_should_defer.append(defer_timing_entry)
                 # 3. check if we should cancel
-                start = perf_counter()
-                cancel_response = command.should_cancel()
-                elapsed = perf_counter() - start
-                cancel_timing_entry = _InternalQueueTimingEntry(
-                    command_type=command.__class__,
-                    method_elapsed_ms=elapsed * 1000,
-                    response_should_proceed=cancel_response.should_proceed,
-                )
-                if not cancel_response.should_proceed:
-                    queue_process_response.num_cancellations += 1
-                    start = perf_counter()
-                    command.call_on_cancel_callbacks(cancel_response)
-                    elapsed = perf_counter() - start
-                    cancel_timing_entry.callbacks_count = command.on_cancel_callbacks_count()
-                    cancel_timing_entry.callbacks_elapsed_ms = elapsed * 1000
-                    self._timing_should_cancel.append(cancel_timing_entry)
-                    output.responses.append(cancel_response)
-                    command.response.status = ResponseStatus.CANCELED
+                if self._check_should_cancel(command, output, queue_process_response):
                     return output, True
-                self._timing_should_cancel.append(cancel_timing_entry)
-                # 4. execute the command
-                start = perf_counter()
-                try:
-                    execution_response = command.execute()
-                except Exception as e:
-                    execution_response = ExecutionResponse.failure(str(e))
-                elapsed = perf_counter() - start
-                start = perf_counter()
-                command.call_on_execute_callbacks(execution_response)
-                elapsed_callbacks = perf_counter() - start
-                self._timing_execute.append(
-                    _InternalQueueTimingEntry(
-                        command_type=command.__class__,
-                        method_elapsed_ms=elapsed * 1000,
-                        response_should_proceed=execution_response.should_proceed,
-                        callbacks_count=command.on_execute_callbacks_count(),
-                        callbacks_elapsed_ms=elapsed_callbacks * 1000,
-                    )
-                )
-                output.responses.append(execution_response)
-                if execution_response.should_proceed:
-                    command.response.status = ResponseStatus.COMPLETED
-                    queue_process_response.num_successes += 1
-                else:
-                    command.response.status = ResponseStatus.FAILED
-                    queue_process_response.num_failures += 1
-                return output, True
+                # 4. wait for the rate limiter if the command is over budget
+                if self._rate_limiter is not None and not self._admit(command):
+                    queue_process_response.num_parked += 1
+                    return output, True
+                # 5. execute the command
+                return output, self._dispatch_execution(command, output, queue_process_response)
 
             case ResponseStatus.CANCELED | ResponseStatus.COMPLETED | ResponseStatus.FAILED:
                 queue_process_response.num_commands_processed += 1
+                if self._tracer is not None:
+                    self._trace_end(command)
                 return output, True
         # mypy wants a return statement here, but it should never be reached
         raise RuntimeError(
             f"Command {command} has an invalid response status: {command.response.status}"
         )
 
-    def process_once(self, max_iterations: int = 1000) -> QueueProcessResponse:
+    def _dispatch_execution(
+        self,
+        command: Command[CommandArgs, CommandResponse],
+        output: CommandLogEntry,
+        queue_process_response: QueueProcessResponse,
+    ) -> bool:
+        """Execute a command that passed all of its lifecycle checks.
+
+        Subclasses can override this to execute commands elsewhere, calling `_finish_execution()` once the result is known.
+
+        Returns:
+            bool: True if the command should be removed from the queue, False otherwise.
+        """
+        profiler = self._profiler
+        sampled = profiler is not None and profiler._should_sample()
+        profile = profiler._start_profile() if profiler is not None and sampled else None
+        watched = (
+            self._watchdog._watch(command, self._metrics, get_ident())
+            if self._watchdog is not None
+            else None
+        )
+        timeout_s = self._timeout_for(command)
+        deadline = (
+            _deadlines.schedule(command.cancellation_token, timeout_s, self._timeout_reason(timeout_s))
+            if timeout_s is not None
+            else None
+        )
+        start = perf_counter()
+        try:
+            execution_response = command.execute()
+        except Exception as e:
+            execution_response = ExecutionResponse.failure(str(e))
+        elapsed = perf_counter() - start
+        if deadline is not None:
+            _deadlines.unschedule(deadline)
+        if self._watchdog is not None and watched is not None:
+            self._watchdog._unwatch(watched)
+        token = command._cancellation_token
+        if token is not None and token.reason is not None:
+            # canceled or timed out while executing, whatever `execute()` returned
+            execution_response = ExecutionResponse(should_proceed=False, reason=token.reason)
+        if profile is not None:
+            profile.disable()
+        if profiler is not None and sampled:
+            profiler._record(command, elapsed, profile)
+        self._finish_execution(command, execution_response, elapsed, output, queue_process_response)
+        return True
+
+    def _check_should_cancel(
+        self, command: Command[Any, Any], output: CommandLogEntry, queue_process_response: QueueProcessResponse
+    ) -> bool:
+        """Call `should_cancel()` and its callbacks, returns True if the command was CANCELED."""
+        start = perf_counter()
+        cancel_response = command.should_cancel()
+        elapsed = perf_counter() - start
+        if self._tracer is not None:
+            self._trace_phase(command, "should_cancel", start, elapsed)
+        cancel_timing_entry = _InternalQueueTimingEntry(
+            command_type=command.__class__,
+            method_elapsed_ms=elapsed * 1000,
+            response_should_proceed=cancel_response.should_proceed,
+        )
+        if cancel_response.should_proceed:
+            self._timing_should_cancel.append(cancel_timing_entry)
+            return False
+        queue_process_response.num_cancellations += 1
+        start = perf_counter()
+        self._call_callbacks(command.call_on_cancel_callbacks, cancel_response)
+        elapsed = perf_counter() - start
+        if self._tracer is not None:
+            self._trace_phase(command, "on_cancel_callbacks", start, elapsed)
+        cancel_timing_entry.callbacks_count = command.on_cancel_callbacks_count()
+        cancel_timing_entry.callbacks_elapsed_ms = elapsed * 1000
+        self._timing_should_cancel.append(cancel_timing_entry)
+        output.responses.append(cancel_response)
+        self._set_final_status(command, ResponseStatus.CANCELED)
+        return True
+
+    def _admit(self, command: Command[Any, Any]) -> bool:
+        """Take a slot of the rate limiter for a command, or park it if its key is over budget or has commands waiting."""
+        assert self._rate_limiter is not None
+        key = self._rate_limiter.key_for(command)
+        if key is None:
+            return True
+        parked = self._parked.get(key)
+        if not parked and self._rate_limiter._try_acquire(key):
+            self._rate_limited[command] = key
+            return True
+        if parked is None:
+            parked = self._parked[key] = deque()
+        parked.append(command)
+        self._num_parked_commands += 1
+        return False
+
+    def _release_parked(self, response: QueueProcessResponse, max_iterations: int) -> None:
+        """Execute the parked commands whose key has budget again, oldest first."""
+        assert self._rate_limiter is not None
+        for key, parked in list(self._parked.items()):
+            # canceled commands go back to the queue, to be CANCELED like any other
+            canceled = [
+                command
+                for command in parked
+                if command._cancellation_token is not None and command._cancellation_token.is_canceled
+            ]
+            for command in canceled:
+                parked.remove(command)
+                self._num_parked_commands -= 1
+                self._queue.append(command)
+            while parked and response.num_commands_processed < max_iterations:
+                if not self._rate_limiter._try_acquire(key):
+                    break
+                command = parked.popleft()
+                self._num_parked_commands -= 1
+                response.num_commands_processed += 1
+                output = CommandLogEntry(command=command, responses=[], dependency_response=None)
+                # it may have been parked for a while, e.g. past a deadline `should_cancel()` checks
+                if self._check_should_cancel(command, output, response):
+                    self._rate_limiter._release(key)
+                else:
+                    self._rate_limited[command] = key
+                    self._dispatch_execution(command, output, response)
+                response.command_log.append(output)
+            if not parked:
+                del self._parked[key]
+
+    def _num_parked(self) -> int:
+        return self._num_parked_commands
+
+    def _call_callbacks(self, call: Callable[..., None], response: LifecycleResponse) -> None:
+        """Call `command.call_on_*_callbacks`, with the queue's dispatcher if it has one."""
+        if self._callback_dispatcher is None:
+            call(response)  # subclasses may override `call_on_*_callbacks()` without the dispatcher argument
+        else:
+            call(response, dispatcher=self._callback_dispatcher)
+
+    def _timeout_for(self, command: Command[Any, Any]) -> Optional[float]:
+        """The execution timeout of a command, its own or the queue's."""
+        return command.timeout_s if command.timeout_s is not None else self._execution_timeout_s
+
+    @staticmethod
+    def _timeout_reason(timeout_s: float) -> ReasonByTimeout:
+        return ReasonByTimeout(f"Execution exceeded its timeout of {timeout_s}s")
+
+    def cancel(self, command: Command[Any, Any], reason: str = "Canceled with CommandQueue.cancel()") -> bool:
+        """
+        Cancel a command, by tripping its `cancellation_token`. Safe to call from any thread.
+
+        A command that has not executed yet is CANCELED the next time it is processed, with its cancel callbacks.
+        A command that is executing keeps running until its `execute()` notices the token (or returns), and is then
+        FAILED with a `ReasonByCancellation`, whatever it returned.
+
+        Args:
+            command (Command): The command to cancel.
+            reason (str, optional): Reason of the command's final response. Defaults to "Canceled with CommandQueue.cancel()".
+
+        Returns:
+            bool: True if the command was canceled, False if it already reached a final status or was already canceled.
+        """
+        if command.response.status in (
+            ResponseStatus.CANCELED,
+            ResponseStatus.COMPLETED,
+            ResponseStatus.FAILED,
+        ):
+            return False
+        return command.cancellation_token.cancel(ReasonByCancellation(reason))
+
+    def _finish_execution(
+        self,
+        command: Command[CommandArgs, CommandResponse],
+        execution_response: ExecutionResponse,
+        elapsed: float,
+        output: CommandLogEntry,
+        queue_process_response: QueueProcessResponse,
+    ) -> None:
+        """Call the execute callbacks of a command, record its timing, and move it to its final status.
+
+        Args:
+            elapsed (float): How long `execute()` took, in seconds.
+        """
+        if self._rate_limiter is not None:
+            key = self._rate_limited.pop(command, None)
+            if key is not None:
+                self._rate_limiter._release(key)
+        if self._admission_controller is not None:
+            self._admission_controller._observe(command.__class__, elapsed, not execution_response.should_proceed)
+            execute_s = self._admission_window.execute_s
+            execute_s[command.__class__] = execute_s.get(command.__class__, 0.0) + elapsed
+        start = perf_counter()
+        if self._tracer is not None:
+            self._trace_phase(command, "execute", start - elapsed, elapsed)
+        if self._metrics is not None:
+            self._metrics_observations.append(
+                ("execute_seconds", command_type_name(command.__class__), elapsed)
+            )
+        self._call_callbacks(command.call_on_execute_callbacks, execution_response)
+        elapsed_callbacks = perf_counter() - start
+        if self._tracer is not None:
+            self._trace_phase(command, "on_execute_callbacks", start, elapsed_callbacks)
+        self._record_execute_timing(
+            _InternalQueueTimingEntry(
+                command_type=command.__class__,
+                method_elapsed_ms=elapsed * 1000,
+                response_should_proceed=execution_response.should_proceed,
+                callbacks_count=command.on_execute_callbacks_count(),
+                callbacks_elapsed_ms=elapsed_callbacks * 1000,
+            )
+        )
+        output.responses.append(execution_response)
+        if execution_response.should_proceed:
+            self._set_final_status(command, ResponseStatus.COMPLETED)
+            queue_process_response.num_successes += 1
+        else:
+            self._set_final_status(command, ResponseStatus.FAILED)
+            queue_process_response.num_failures += 1
+
+    def _record_execute_timing(self, entry: _InternalQueueTimingEntry) -> None:
+        """Append to the execute timings, keeping the per-type totals behind `_estimated_execute_s()` up to date."""
+        timings = self._timing_execute
+        if not timings.maxlen:
+            return
+        totals = self._timing_execute_totals
+        if len(timings) == timings.maxlen:
+            dropped = timings[0]
+            total, count = totals[dropped.command_type]
+            totals[dropped.command_type] = (total - dropped.method_elapsed_ms, count - 1)
+        total, count = totals.get(entry.command_type, (0.0, 0))
+        totals[entry.command_type] = (total + entry.method_elapsed_ms, count + 1)
+        timings.append(entry)
+
+    def _estimated_execute_s(self, command: Command[Any, Any]) -> float:
+        """The average `execute()` time of the command's type, as in `get_timing_data()`, 0 if unknown or timing is disabled."""
+        total, count = self._timing_execute_totals.get(command.__class__, (0.0, 0))
+        return total / count / 1000 if count > 0 else 0.0
+
+    def _out_of_time(self, command: Command[Any, Any], response: QueueProcessResponse, deadline: float) -> bool:
+        """Check whether the pass must stop before processing `command` to stay within its time budget.
+
+        The first command of a call is always processed, so every call makes progress.
+        """
+        if not response.command_log:
+            return False
+        remaining = deadline - perf_counter()
+        if remaining <= 0 or self._estimated_execute_s(command) > remaining:
+            response.reached_time_budget = True
+            return True
+        return False
+
+    def _process_fast_lane(
+        self,
+        response: QueueProcessResponse,
+        deferred: list[Command[Any, Any]],
+        max_iterations: int,
+        deadline: Optional[float] = None,
+    ) -> bool:
+        """Process every command in the fast lane, including ones submitted while doing so.
+
+        Deferred commands are added to `deferred`, to be moved to the back of the queue after the pass.
+
+        Returns:
+            bool: False if `max_iterations` or the deadline (a `perf_counter()` value) was reached, True otherwise.
+        """
+        while self._fast_lane:
+            if response.num_commands_processed >= max_iterations:
+                response.reached_max_iterations = True
+                return False
+            if deadline is not None and self._out_of_time(self._fast_lane[0], response, deadline):
+                return False
+            command = self._fast_lane.popleft()
+            command_log_entry, should_remove = self._process_single_command(command, response)
+            response.command_log.append(command_log_entry)
+            if not should_remove:
+                deferred.append(command)
+        return True
+
+    def _process_range(
+        self,
+        start: int,
+        stop: Optional[int],
+        kept: list[Command[Any, Any]],
+        response: QueueProcessResponse,
+        deferred_fast_lane: list[Command[Any, Any]],
+        max_iterations: int,
+        deadline: Optional[float],
+    ) -> tuple[int, bool]:
+        """Process `_queue[start:stop]` in order, adding the commands that stay in the queue to `kept`.
+
+        With `stop=None`, commands appended to the queue meanwhile (e.g. by callbacks) are processed too.
+
+        Returns:
+            int: Index of the first command that was not processed.
+            bool: True if the pass ran out of iterations or time, False otherwise.
+        """
+        queue = self._queue
+        index = start
+        while index < (len(queue) if stop is None else stop):
+            command = queue[index]
+            if response.num_commands_processed >= max_iterations:
+                response.reached_max_iterations = True
+                return index, True
+            if deadline is not None and self._out_of_time(command, response, deadline):
+                return index, True
+            index += 1
+            command_log_entry, should_remove = self._process_single_command(command, response)
+            response.command_log.append(command_log_entry)
+            if not should_remove:
+                kept.append(command)
+            if self._fast_lane and not self._process_fast_lane(
+                response, deferred_fast_lane, max_iterations, deadline
+            ):
+                return index, True
+        return index, False
+
+    def process_once(
+        self, max_iterations: int = 1000, time_budget_ms: Optional[float] = None
+    ) -> QueueProcessResponse:
         """
         Process all commands in the queue a single time.
 
         If a command is deferred, it will not be processed again until the next call to `process_once()`.
 
+        A pass that stops early, because of `max_iterations` or `time_budget_ms`, is resumed by the next call from the first
+        command it did not reach, which then wraps around to the front of the queue. Consecutive bounded calls therefore
+        visit every command in turn, and the commands at the back of the queue are not starved by the ones in front of them.
+
+        With a `time_budget_ms`, the pass stops once the budget is used up, or before a command whose type's average
+        `execute()` time (see `get_timing_data()`, needs `timing_queue_length`) exceeds what is left of it. The first command
+        of a call is always processed.
+
         Args:
             max_iterations (int, optional): Maximum number of commands to process in one call. Defaults to 1000.
+            time_budget_ms (Optional[float], optional): Wall-clock time this call may spend processing commands, None for no limit. Defaults to None.
 
         Returns:
             QueueProcessResponse: Response containing details of the processing.
         """
+        deadline = perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
         response = QueueProcessResponse(command_log=[])
-        to_remove: list[Command[Any, Any]] = []
-        for command in self._queue:
-            if response.num_commands_processed >= max_iterations:
-                response.reached_max_iterations = True
-                break
-            command_log_entry, should_remove = self._process_single_command(command, response)
-            response.command_log.append(command_log_entry)
-            if should_remove:
-                to_remove.append(command)
-        # remove all processed commands
-        for command in to_remove:
-            if command in self._queue:
-                self._queue.remove(command)
+        deferred_fast_lane: list[Command[Any, Any]] = []
+        if self._pending_trace_ends:
+            # finished by a callback that ran outside of the queue's passes
+            self._end_pending_traces()
+        if self._parked:
+            self._release_parked(response, max_iterations)
+        start = min(self._cursor, len(self._queue))
+        # the queue is rebuilt from the commands that stay, rather than removing processed commands one by one
+        kept: list[Command[Any, Any]] = []
+        end, stopped = start, True
+        # fast-lane commands submitted between passes go first
+        if self._process_fast_lane(response, deferred_fast_lane, max_iterations, deadline):
+            end, stopped = self._process_range(
+                start, None, kept, response, deferred_fast_lane, max_iterations, deadline
+            )
+        if stopped:
+            self._queue = self._queue[:start] + kept + self._queue[end:]
+            self._cursor = start + len(kept)
+        elif start == 0:
+            self._queue = kept + self._queue[end:]
+            self._cursor = 0
+        else:
+            # resumed pass, wrap around to the commands before the cursor
+            kept_front: list[Command[Any, Any]] = []
+            front_end, stopped = self._process_range(
+                0, start, kept_front, response, deferred_fast_lane, max_iterations, deadline
+            )
+            # commands appended while wrapping around are processed by the next call
+            self._queue = kept_front + self._queue[front_end:start] + kept + self._queue[end:]
+            self._cursor = len(kept_front) if stopped else 0
+        self._queue.extend(deferred_fast_lane)
+        if self._admission_controller is not None:
+            self._admission_controller._end_pass(self._admission_window)
+            self._admission_window = _AdmissionWindow()
+        if self._journal is not None:
+            self._journal.commit()
+        if self._metrics is not None:
+            self._flush_metrics(response)
         return response
 
-    def process_all(self, max_total_iterations: int = 1000) -> QueueProcessResponse:
+    def _flush_metrics(self, response: QueueProcessResponse) -> None:
+        """Hand the counters of a pass and the latency observations made since the last flush to `metrics`."""
+        if self._metrics is None:
+            return
+        observations, self._metrics_observations = self._metrics_observations, []
+        self._metrics.record_pass(self, response, observations)
+
+    def process_all(
+        self, max_total_iterations: int = 1000, time_budget_ms: Optional[float] = None
+    ) -> QueueProcessResponse:
         """
-        Process all commands in the queue until either all commands are processed, or the maximum number of iterations is reached.
+        Process all commands in the queue until either all commands are processed, or the maximum number of iterations or the time budget is reached.
 
         Args:
             max_total_iterations (int, optional): Maximum number of times `process_once()` can be run. Defaults to 1000.
+            time_budget_ms (Optional[float], optional): Wall-clock time to spend processing commands, see `process_once()`. None for no limit. Defaults to None.
 
         Returns:
             QueueProcessResponse: Response containing details of the processing.
         """
+        deadline = perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
         response = QueueProcessResponse(command_log=[])
-        while len(self._queue) > 0:
+        while len(self) > 0:
             if response.num_commands_processed >= max_total_iterations:
                 response.reached_max_iterations = True
                 break
-            response += self.process_once(max_iterations=max_total_iterations)
+            remaining_ms = (deadline - perf_counter()) * 1000 if deadline is not None else None
+            if remaining_ms is not None and remaining_ms <= 0:
+                response.reached_time_budget = True
+                break
+            pass_response = self.process_once(max_iterations=max_total_iterations, time_budget_ms=remaining_ms)
+            response += pass_response
+            if pass_response.reached_time_budget:
+                break
+            made_progress = (
+                pass_response.num_commands_processed + pass_response.num_successes + pass_response.num_failures
+            ) > 0
+            if self._parked and self._rate_limiter is not None and not made_progress:
+                # only parked commands are left, sleep until one of them can go
+                idle_timeout_s = 0.01 if remaining_ms is None else min(0.01, remaining_ms / 1000)
+                self._rate_limiter._wait(list(self._parked), idle_timeout_s=idle_timeout_s)
         return response
 
     # Magic methods
@@ -378,10 +1079,10 @@ class CommandQueue:
         Returns:
             int: The number of commands in the queue.
         """
-        return len(self._queue)
+        return len(self._queue) + len(self._fast_lane) + self._num_parked()
 
     def __repr__(self) -> str:  # pragma: no cover
-        return f"{self.__class__.__name__}(queue_size={len(self._queue)})"
+        return f"{self.__class__.__name__}(queue_size={len(self)})"
 
     def get_timing_data(self) -> dict[Type[Command[Any, Any]], CommandTimingData]:
         """
@@ -426,29 +1127,15 @@ class CommandQueue:
             for command_type, timings in intermediate_timings.items():
                 if len(timings) == 0:
                     continue
+                callbacks_timing = CommandTimingData.CommandTimingEntry.from_samples(
+                    [entry.callbacks_elapsed_ms for entry in timings]
+                )
+                callbacks_timing.count = sum(entry.callbacks_count for entry in timings)
                 output[command_type] = (
-                    CommandTimingData.CommandTimingEntry(
-                        count=len(timings),
-                        avg_elapsed_ms=statistics.mean(
-                            entry.method_elapsed_ms for entry in timings
-                        ),
-                        std_dev_elapsed_ms=(
-                            statistics.stdev(entry.method_elapsed_ms for entry in timings)
-                            if len(timings) > 1
-                            else 0.0
-                        ),
-                    ),
-                    CommandTimingData.CommandTimingEntry(
-                        count=sum(entry.callbacks_count for entry in timings),
-                        avg_elapsed_ms=statistics.mean(
-                            entry.callbacks_elapsed_ms for entry in timings
-                        ),
-                        std_dev_elapsed_ms=(
-                            statistics.stdev(entry.callbacks_elapsed_ms for entry in timings)
-                            if len(timings) > 1
-                            else 0.0
-                        ),
+                    CommandTimingData.CommandTimingEntry.from_samples(
+                        [entry.method_elapsed_ms for entry in timings]
                     ),
+                    callbacks_timing,
                 )
                 output_failure_percentage[command_type] = 1 - sum(
                     entry.response_should_proceed for entry in timings
@@ -460,10 +1147,15 @@ class CommandQueue:
         execute_subtimings, failure_percents = calculate_subtimings(self._timing_execute)
 
         # now build the output
+        latencies = defaultdict[Type[Command[Any, Any]], list[_InternalLatencyEntry]](list)
+        for latency_entry in self._timing_latency:
+            latencies[latency_entry.command_type].append(latency_entry)
+
         encountered_command_types: set[Type[Command[Any, Any]]] = set(
             should_defer_subtimings.keys()
             | should_cancel_subtimings.keys()
             | execute_subtimings.keys()
+            | latencies.keys()
         )
         COMMAND_TIMINGS = 0
         CALLBACKS_TIMINGS = 1
@@ -479,4 +1171,17 @@ class CommandQueue:
                 execute_failure_percentage=failure_percents[command_type],
                 execute_callbacks=execute_subtimings[command_type][CALLBACKS_TIMINGS],
             )
+            if latencies[command_type]:
+                entries = latencies[command_type]
+                output[command_type].queue_wait = CommandTimingData.CommandTimingEntry.from_samples(
+                    [entry.queue_wait_ms for entry in entries]
+                )
+                output[command_type].end_to_end = CommandTimingData.CommandTimingEntry.from_samples(
+                    [entry.end_to_end_ms for entry in entries]
+                )
+                output[command_type].avg_deferral_count = statistics.mean(
+                    entry.deferral_count for entry in entries
+                )
+            else:
+                output[command_type].avg_deferral_count = float("nan")
         return output
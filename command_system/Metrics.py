@@ -0,0 +1,260 @@
+"""Prometheus-compatible metrics for command queues, see `CommandQueue(metrics=...)`."""
+
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Iterator, Sequence
+from weakref import WeakKeyDictionary
+
+if TYPE_CHECKING:
+    from .CommandQueue import CommandQueue, QueueProcessResponse
+
+DEFAULT_LATENCY_BUCKETS_S: tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# (histogram name, command type name, observed seconds)
+MetricsObservation = tuple[str, str, float]
+
+_COUNTERS: dict[str, str] = {
+    "num_commands_processed": "Commands processed by the queue.",
+    "num_ingested": "Commands that moved from CREATED to PENDING.",
+    "num_deferrals": "Times a command was deferred.",
+    "num_cancellations": "Times a command was canceled.",
+    "num_successes": "Times a command executed and succeeded.",
+    "num_failures": "Times a command executed and failed.",
+    "num_parked": "Times a command was parked by the queue's rate limiter.",
+    "num_delayed": "Times a command was skipped because its type was over its admission budget.",
+}
+
+_SLOW_COMMANDS_HELP = "Executions that exceeded their CommandWatchdog threshold, per command type."
+
+_HISTOGRAMS: dict[str, str] = {
+    "execute_seconds": "Time spent in execute(), per command type.",
+    "queue_wait_seconds": "Time from submit() until a command was first processed, per command type.",
+    "end_to_end_seconds": "Time from submit() until a command reached a final status, per command type.",
+}
+
+
+@dataclass
+class _Histogram:
+    """A histogram with fixed buckets, `counts[i]` holds the observations in `(buckets[i - 1], buckets[i]]`."""
+
+    buckets: Sequence[float]
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class QueueMetrics:
+    """
+    Cumulative metrics of one or more command queues, exposed in the Prometheus text format.
+
+    Queues update the metrics once per `process_once()` (a single lock acquisition), and a scrape only formats the
+    current values. Share one instance between queues (e.g. the shards of a `ShardedCommandQueue`) to aggregate them,
+    the queue depth gauge is the sum over all of them.
+
+    Exposes, prefixed with `namespace`:
+        - counters `<namespace>_<counter>_total` for `commands_processed`, `ingested`, `deferrals`, `cancellations`, `successes`, `failures`, `parked` (see `RateLimiter`) and `delayed` (see `AdmissionController`)
+        - the counter `<namespace>_slow_commands_total`, labelled with `command_type`, see `CommandWatchdog`
+        - the gauge `<namespace>_depth`, the number of commands held by the queues after their last pass
+        - histograms `<namespace>_execute_seconds`, `<namespace>_queue_wait_seconds` and `<namespace>_end_to_end_seconds`,
+          labelled with `command_type`
+
+    Use `render()` to produce the text exposition format, or register the instance with a `prometheus_client`
+    registry (`REGISTRY.register(metrics)`), which calls `collect()`.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "command_queue",
+        latency_buckets_s: Sequence[float] = DEFAULT_LATENCY_BUCKETS_S,
+    ):
+        """
+        Construct a new QueueMetrics.
+
+        Args:
+            namespace (str, optional): Prefix of every metric name. Defaults to "command_queue".
+            latency_buckets_s (Sequence[float], optional): Upper bounds of the latency histogram buckets, in seconds. Defaults to `DEFAULT_LATENCY_BUCKETS_S`.
+        """
+        self._namespace = namespace
+        self._buckets = tuple(sorted(latency_buckets_s))
+        self._lock = Lock()
+        self._counters = dict.fromkeys(_COUNTERS, 0)
+        self._depths: WeakKeyDictionary["CommandQueue", int] = WeakKeyDictionary()
+        # command type name -> executions reported by a `CommandWatchdog`
+        self._slow_commands: dict[str, int] = {}
+        # histogram name -> command type name -> histogram
+        self._histograms: dict[str, dict[str, _Histogram]] = {name: {} for name in _HISTOGRAMS}
+
+    def record_pass(
+        self,
+        queue: "CommandQueue",
+        response: "QueueProcessResponse",
+        observations: list[MetricsObservation],
+    ) -> None:
+        """
+        Add the counters of a pass and its latency observations, and update the depth of `queue`. Called by the queue.
+
+        Args:
+            queue (CommandQueue): The queue that ran the pass.
+            response (QueueProcessResponse): The response of the pass.
+            observations (list[MetricsObservation]): `(histogram name, command type name, seconds)` observations made during the pass.
+        """
+        depth = len(queue)
+        with self._lock:
+            for name in self._counters:
+                self._counters[name] += getattr(response, name)
+            self._depths[queue] = depth
+            for histogram_name, command_type, value in observations:
+                histograms = self._histograms[histogram_name]
+                histogram = histograms.get(command_type)
+                if histogram is None:
+                    histogram = histograms[command_type] = _Histogram(self._buckets)
+                histogram.observe(value)
+
+    def record_slow_command(self, command_type: str) -> None:
+        """
+        Count an execution that exceeded its `CommandWatchdog` threshold. Called by the watchdog.
+
+        Args:
+            command_type (str): Name of the command type, see `command_type_name()`.
+        """
+        with self._lock:
+            self._slow_commands[command_type] = self._slow_commands.get(command_type, 0) + 1
+
+    def _snapshot(
+        self,
+    ) -> tuple[
+        dict[str, int], dict[str, int], int, dict[str, dict[str, tuple[list[int], float, int]]]
+    ]:
+        """Copy the current values under the lock."""
+        with self._lock:
+            counters = dict(self._counters)
+            slow_commands = dict(self._slow_commands)
+            depth = sum(self._depths.values())
+            histograms = {
+                name: {
+                    command_type: (list(histogram.counts), histogram.total, histogram.count)
+                    for command_type, histogram in by_type.items()
+                }
+                for name, by_type in self._histograms.items()
+            }
+        return counters, slow_commands, depth, histograms
+
+    def _counter_name(self, field_name: str) -> str:
+        return f"{self._namespace}_{field_name.removeprefix('num_')}_total"
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format (version 0.0.4).
+
+        Returns:
+            str: The metrics, ready to be served with content type `text/plain; version=0.0.4`.
+        """
+        counters, slow_commands, depth, histograms = self._snapshot()
+        lines: list[str] = []
+        for field_name, help_text in _COUNTERS.items():
+            name = self._counter_name(field_name)
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines.append(f"{name} {counters[field_name]}")
+        name = f"{self._namespace}_slow_commands_total"
+        lines += [f"# HELP {name} {_SLOW_COMMANDS_HELP}", f"# TYPE {name} counter"]
+        for command_type, value in sorted(slow_commands.items()):
+            lines.append(f"{name}{_format_labels({'command_type': command_type})} {value}")
+        name = f"{self._namespace}_depth"
+        lines += [
+            f"# HELP {name} Commands held by the queue after its last pass.",
+            f"# TYPE {name} gauge",
+            f"{name} {depth}",
+        ]
+        for histogram_name, help_text in _HISTOGRAMS.items():
+            name = f"{self._namespace}_{histogram_name}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for command_type, (counts, total, count) in sorted(histograms[histogram_name].items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*self._buckets, float("inf")), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels({"command_type": command_type, "le": _format_value(bound)})
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = _format_labels({"command_type": command_type})
+                lines.append(f"{name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{name}_count{labels} {count}")
+        return "\n".join(lines) + "\n"
+
+    def collect(self) -> Iterator[Any]:  # pragma: no cover - needs prometheus_client
+        """
+        Yield the metrics as `prometheus_client` metric families, so this can be registered as a custom collector.
+
+        Requires the optional `prometheus_client` package.
+        """
+        from prometheus_client.core import (  # type: ignore[import-not-found]
+            CounterMetricFamily,
+            GaugeMetricFamily,
+            HistogramMetricFamily,
+        )
+
+        counters, slow_commands, depth, histograms = self._snapshot()
+        for field_name, help_text in _COUNTERS.items():
+            # prometheus_client adds the `_total` suffix itself
+            yield CounterMetricFamily(
+                self._counter_name(field_name).removesuffix("_total"), help_text, value=counters[field_name]
+            )
+        slow_family = CounterMetricFamily(
+            f"{self._namespace}_slow_commands", _SLOW_COMMANDS_HELP, labels=["command_type"]
+        )
+        for command_type, value in sorted(slow_commands.items()):
+            slow_family.add_metric([command_type], value)
+        yield slow_family
+        yield GaugeMetricFamily(
+            f"{self._namespace}_depth", "Commands held by the queue after its last pass.", value=depth
+        )
+        for histogram_name, help_text in _HISTOGRAMS.items():
+            family = HistogramMetricFamily(
+                f"{self._namespace}_{histogram_name}", help_text, labels=["command_type"]
+            )
+            for command_type, (counts, total, _) in sorted(histograms[histogram_name].items()):
+                cumulative = 0
+                buckets: list[tuple[str, float]] = []
+                for bound, bucket_count in zip((*self._buckets, float("inf")), counts):
+                    cumulative += bucket_count
+                    buckets.append((_format_value(bound), cumulative))
+                family.add_metric([command_type], buckets, total)
+            yield family
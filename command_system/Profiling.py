@@ -0,0 +1,230 @@
+"""Low-overhead sampling of command executions, see `CommandQueue(profiler=...)`."""
+
+import cProfile
+import heapq
+import math
+import pstats
+import random
+from dataclasses import dataclass, field
+from io import StringIO
+from itertools import count
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Optional, Type
+
+if TYPE_CHECKING:
+    from .Command import Command
+
+
+@dataclass
+class _RunningStats:
+    """Mean and variance of a stream of values (Welford's algorithm), so memory does not grow with the samples."""
+
+    count: int = 0
+    mean: float = 0.0
+    _squared_deviations: float = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._squared_deviations += delta * (value - self.mean)
+
+    def variance(self) -> float:
+        """Sample variance, 0 with fewer than two values."""
+        return self._squared_deviations / (self.count - 1) if self.count > 1 else 0.0
+
+
+@dataclass
+class ExecutionEstimate:
+    """
+    Estimated execution cost of one command type, extrapolated from the sampled executions.
+
+    Attributes:
+        samples (int): Number of sampled executions.
+        estimated_executions (float): Estimated number of executions, `samples * sample_every`.
+        avg_elapsed_ms (float): Average duration of `execute()` over the samples.
+        std_error_ms (float): Standard error of `avg_elapsed_ms`, 0 with a single sample.
+        estimated_total_ms (float): Estimated time spent in `execute()` over all executions.
+        share (float): Fraction of the estimated total time of all command types spent in this one.
+    """
+
+    samples: int
+    estimated_executions: float
+    avg_elapsed_ms: float
+    std_error_ms: float
+    estimated_total_ms: float
+    share: float = 0.0
+
+
+@dataclass(order=True)
+class ProfiledExecution:
+    """
+    A sampled execution captured with `cProfile`, one of the slowest seen by a `SamplingProfiler`.
+
+    Attributes:
+        elapsed_ms (float): Duration of `execute()`, including the profiler's own overhead.
+        command_type (Type[Command]): Type of the command.
+        args (str): Repr of the command's args.
+        profile (cProfile.Profile): The profile of the execution, see `stats()`.
+    """
+
+    elapsed_ms: float
+    _order: int = field(repr=False)  # breaks ties, profiles are not comparable
+    command_type: Type["Command[Any, Any]"] = field(compare=False)
+    args: str = field(compare=False)
+    profile: cProfile.Profile = field(compare=False, repr=False)
+
+    def stats(self, sort_key: str = "cumulative", limit: int = 20) -> str:
+        """
+        Format the profile of the execution.
+
+        Args:
+            sort_key (str, optional): `pstats` sort key. Defaults to "cumulative".
+            limit (int, optional): Maximum number of functions to include. Defaults to 20.
+
+        Returns:
+            str: The formatted statistics.
+        """
+        output = StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats(sort_key).print_stats(limit)
+        return output.getvalue()
+
+
+class SamplingProfiler:
+    """
+    Measures 1 in `sample_every` command executions, to find which command types dominate execution time.
+
+    Unlike `timing_queue_length`, which records every lifecycle stage of every command, unsampled executions only cost
+    a locked counter decrement. The gap between two samples is drawn uniformly from `[1, 2 * sample_every - 1]`, so every
+    execution is sampled with probability `1 / sample_every` without locking onto periodic workloads, and per-type totals
+    are estimated by scaling the samples up.
+
+    With `capture_slowest > 0`, sampled executions run under `cProfile` and the profiles of the slowest ones are kept.
+    That adds the profiler's overhead to sampled executions only.
+
+    A profiler can be shared between queues (e.g. the shards of a `ShardedCommandQueue`). It only sees commands
+    executed by the queue itself, so it has no effect on a `RemoteCommandQueue`.
+    """
+
+    def __init__(self, sample_every: int = 100, capture_slowest: int = 0, seed: Optional[int] = None):
+        """
+        Construct a new SamplingProfiler.
+
+        Args:
+            sample_every (int, optional): Average number of executions per sample, 1 samples every execution. Defaults to 100.
+            capture_slowest (int, optional): Number of slowest sampled executions to keep a `cProfile` profile of, 0 to disable. Defaults to 0.
+            seed (Optional[int], optional): Seed of the sampling gaps, for reproducible runs. Defaults to None.
+
+        Raises:
+            ValueError: If `sample_every` is less than 1 or `capture_slowest` is negative.
+        """
+        if sample_every < 1:
+            raise ValueError(f"sample_every must be at least 1, got {sample_every}.")
+        if capture_slowest < 0:
+            raise ValueError(f"capture_slowest cannot be negative, got {capture_slowest}.")
+        self._sample_every = sample_every
+        self._capture_slowest = capture_slowest
+        self._random = random.Random(seed)
+        self._countdown = self._next_gap()
+        self._lock = Lock()
+        self._samples: dict[Type["Command[Any, Any]"], _RunningStats] = {}
+        # min-heap, so the fastest of the kept profiles is the one replaced
+        self._slowest: list[ProfiledExecution] = []
+        self._order = count()
+
+    @property
+    def sample_every(self) -> int:
+        """Average number of executions per sample."""
+        return self._sample_every
+
+    def _next_gap(self) -> int:
+        return self._random.randint(1, 2 * self._sample_every - 1)
+
+    def _should_sample(self) -> bool:
+        """Called by the queue before every execution, possibly from several processing threads at once."""
+        with self._lock:
+            self._countdown -= 1
+            if self._countdown > 0:
+                return False
+            self._countdown = self._next_gap()
+            return True
+
+    def _start_profile(self) -> Optional[cProfile.Profile]:
+        """Start a `cProfile` profile for a sampled execution, if profiles are captured."""
+        if self._capture_slowest == 0:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active
+            return None
+        return profile
+
+    def _record(
+        self, command: "Command[Any, Any]", elapsed: float, profile: Optional[cProfile.Profile]
+    ) -> None:
+        """Record a sampled execution that took `elapsed` seconds."""
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            stats = self._samples.get(command.__class__)
+            if stats is None:
+                stats = self._samples[command.__class__] = _RunningStats()
+            stats.add(elapsed_ms)
+            if profile is None:
+                return
+            if len(self._slowest) >= self._capture_slowest and elapsed_ms <= self._slowest[0].elapsed_ms:
+                return
+            execution = ProfiledExecution(
+                elapsed_ms=elapsed_ms,
+                _order=next(self._order),
+                command_type=command.__class__,
+                args=repr(command.args),
+                profile=profile,
+            )
+            if len(self._slowest) < self._capture_slowest:
+                heapq.heappush(self._slowest, execution)
+            else:
+                heapq.heapreplace(self._slowest, execution)
+
+    def estimates(self) -> dict[Type["Command[Any, Any]"], ExecutionEstimate]:
+        """
+        Estimate the execution cost of every sampled command type.
+
+        Returns:
+            dict[Type[Command], ExecutionEstimate]: The estimates, by command type.
+        """
+        with self._lock:
+            samples = {
+                command_type: (stats.count, stats.mean, stats.variance())
+                for command_type, stats in self._samples.items()
+            }
+        output: dict[Type["Command[Any, Any]"], ExecutionEstimate] = {}
+        for command_type, (sample_count, mean, variance) in samples.items():
+            output[command_type] = ExecutionEstimate(
+                samples=sample_count,
+                estimated_executions=sample_count * self._sample_every,
+                avg_elapsed_ms=mean,
+                std_error_ms=math.sqrt(variance / sample_count),
+                estimated_total_ms=mean * sample_count * self._sample_every,
+            )
+        grand_total = sum(estimate.estimated_total_ms for estimate in output.values())
+        if grand_total > 0:
+            for estimate in output.values():
+                estimate.share = estimate.estimated_total_ms / grand_total
+        return output
+
+    def slowest(self) -> list[ProfiledExecution]:
+        """
+        Get the captured profiles of the slowest sampled executions.
+
+        Returns:
+            list[ProfiledExecution]: Up to `capture_slowest` executions, slowest first.
+        """
+        with self._lock:
+            return sorted(self._slowest, reverse=True)
+
+    def clear(self) -> None:
+        """Forget all samples and captured profiles."""
+        with self._lock:
+            self._samples.clear()
+            self._slowest.clear()
@@ -0,0 +1,188 @@
+"""Queue-level rate limits and concurrency caps, see `CommandQueue(rate_limiter=...)`."""
+
+from dataclasses import dataclass
+from threading import Condition
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Mapping, Optional
+
+if TYPE_CHECKING:
+    from .Command import Command
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    The budget of one key of a `RateLimiter`.
+
+    Attributes:
+        rate_per_s (Optional[float]): Number of commands that can start executing per second, None for no rate limit.
+        burst (int): Capacity of the token bucket, i.e. how many commands can start at once after an idle period.
+        max_in_flight (Optional[int]): Number of commands that can be executing at the same time, None for no cap.
+    """
+
+    rate_per_s: Optional[float] = None
+    burst: int = 1
+    max_in_flight: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if self.rate_per_s is not None and self.rate_per_s <= 0:
+            raise ValueError(f"rate_per_s must be positive, got {self.rate_per_s}.")
+        if self.burst < 1:
+            raise ValueError(f"burst must be at least 1, got {self.burst}.")
+        if self.max_in_flight is not None and self.max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1, got {self.max_in_flight}.")
+
+
+@dataclass
+class _Bucket:
+    """The state of one key: a token bucket refilled lazily, and the number of commands executing."""
+
+    limit: RateLimit
+    tokens: float
+    updated_at: float
+    in_flight: int = 0
+
+    def refill(self, now: float) -> None:
+        if self.limit.rate_per_s is not None:
+            self.tokens = min(
+                float(self.limit.burst), self.tokens + (now - self.updated_at) * self.limit.rate_per_s
+            )
+        self.updated_at = now
+
+    def wait_time(self) -> Optional[float]:
+        """Seconds until the next token, 0 if one is available, None if only an in-flight command can free the key."""
+        if self.limit.max_in_flight is not None and self.in_flight >= self.limit.max_in_flight:
+            return None
+        if self.limit.rate_per_s is None or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.limit.rate_per_s
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limits and max-in-flight caps, keyed by command class or by a custom key.
+
+    A queue with a rate limiter checks it right before executing a command that passed its lifecycle checks.
+    A command over its key's budget is parked in a per-key waiting list instead of being deferred, so neither
+    its `should_defer()` nor its defer callbacks run again. Parked commands are released in submission order at the
+    start of the queue's passes, once their key has a token and a free slot, and then executed right away.
+    `process_all()` sleeps until the next token when parked commands are all that is left.
+
+    By default a command's key is the closest class in its MRO that has a limit, so subclasses share the budget of
+    their base class. A custom `key` function can return any hashable (e.g. an API host), or None for no limit.
+
+    One limiter can be shared between queues (e.g. the shards of a `ShardedCommandQueue`), which then share the
+    budgets. With a `RemoteCommandQueue`, a command is in flight until its result is back.
+    """
+
+    def __init__(
+        self,
+        limits: Mapping[Hashable, RateLimit],
+        key: Optional[Callable[["Command[Any, Any]"], Optional[Hashable]]] = None,
+        default: Optional[RateLimit] = None,
+    ):
+        """
+        Construct a new RateLimiter.
+
+        Args:
+            limits (Mapping[Hashable, RateLimit]): Limits by key, command classes unless a custom `key` is given.
+            key (Optional[Callable[[Command], Optional[Hashable]]], optional): Function mapping a command to its key, None to key commands by class. Defaults to None.
+            default (Optional[RateLimit], optional): Limit of keys that are not in `limits`, each key gets its own budget. None to not limit them. Defaults to None.
+        """
+        self._limits = dict(limits)
+        self._key = key
+        self._default = default
+        self._condition = Condition()
+        self._buckets: dict[Hashable, _Bucket] = {}
+
+    def key_for(self, command: "Command[Any, Any]") -> Optional[Hashable]:
+        """
+        Get the key whose budget a command counts against.
+
+        Args:
+            command (Command): The command.
+
+        Returns:
+            Optional[Hashable]: The key, None if the command is not limited.
+        """
+        if self._key is not None:
+            key = self._key(command)
+            if key is None or (key not in self._limits and self._default is None):
+                return None
+            return key
+        for base in command.__class__.__mro__:
+            if base in self._limits:
+                return base
+        return command.__class__ if self._default is not None else None
+
+    def _bucket(self, key: Hashable, now: float) -> _Bucket:
+        """The state of a key, created full on first use. Must hold the lock."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limit = self._limits.get(key, self._default)
+            assert limit is not None  # `key_for()` only returns limited keys
+            bucket = self._buckets[key] = _Bucket(limit=limit, tokens=float(limit.burst), updated_at=now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def _try_acquire(self, key: Hashable) -> bool:
+        """Take a token and an in-flight slot of a key if both are available, called by the queue before an execution."""
+        with self._condition:
+            bucket = self._bucket(key, perf_counter())
+            if bucket.wait_time() != 0:
+                return False
+            if bucket.limit.rate_per_s is not None:
+                bucket.tokens -= 1
+            bucket.in_flight += 1
+            return True
+
+    def _release(self, key: Hashable) -> None:
+        """Free the in-flight slot taken by `_try_acquire()`, called by the queue once the execution finished."""
+        with self._condition:
+            self._buckets[key].in_flight -= 1
+            self._condition.notify_all()
+
+    def _wait(self, keys: list[Hashable], idle_timeout_s: float) -> None:
+        """
+        Wait until one of the keys might have a token and a free slot.
+
+        Keys that are only waiting on in-flight commands wake the caller when one finishes, or after `idle_timeout_s`.
+        """
+        with self._condition:
+            now = perf_counter()
+            timeout = idle_timeout_s
+            for key in keys:
+                wait_time = self._bucket(key, now).wait_time()
+                if wait_time is not None:
+                    timeout = min(timeout, wait_time)
+            if timeout > 0:
+                self._condition.wait(timeout)
+
+    def available_tokens(self, key: Hashable) -> float:
+        """
+        Get the number of tokens in a key's bucket.
+
+        Args:
+            key (Hashable): The key, see `key_for()`.
+
+        Returns:
+            float: The tokens, `inf` if the key has no rate limit.
+        """
+        with self._condition:
+            bucket = self._bucket(key, perf_counter())
+            return bucket.tokens if bucket.limit.rate_per_s is not None else float("inf")
+
+    def in_flight(self, key: Hashable) -> int:
+        """
+        Get the number of commands of a key that are executing.
+
+        Args:
+            key (Hashable): The key, see `key_for()`.
+
+        Returns:
+            int: The number of commands in flight.
+        """
+        with self._condition:
+            bucket = self._buckets.get(key)
+            return bucket.in_flight if bucket is not None else 0
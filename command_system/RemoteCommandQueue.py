@@ -0,0 +1,413 @@
+"""Execute commands in worker processes while a coordinator keeps the queue and dependency state."""
+
+import multiprocessing
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from itertools import count
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from time import perf_counter
+from types import TracebackType
+from typing import Any, Callable, Optional, Type
+
+from .Command import Command, CommandArgs
+from .CommandChain import CommandChain
+from .CommandLifecycle import (
+    ExecutionResponse,
+    LifecycleResponseReason,
+    ReasonByTimeout,
+)
+from .CommandQueue import CommandLogEntry, CommandQueue, QueueProcessResponse
+from .CommandResponse import CommandResponse
+from .Watchdog import _WatchedExecution
+
+# coordinator -> worker: a batch of (token, command class, command args), or None to shut down
+_WorkBatch = Optional[list[tuple[int, Type[Command[Any, Any]], CommandArgs]]]
+# worker -> coordinator: a batch of (token, execution response, command response, elapsed seconds),
+# the command response is None if the command could not be constructed
+_ResultBatch = list[tuple[int, ExecutionResponse, Optional[CommandResponse], float]]
+
+
+class RemoteTransport(ABC):
+    """
+    A bidirectional message channel between the coordinator and a single worker.
+
+    Messages are batches of plain python objects, implementations decide how they are serialized.
+    """
+
+    @abstractmethod
+    def send(self, message: Any) -> None:
+        """Send a message to the other end."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def recv(self) -> Any:
+        """Receive the next message, blocking until one is available."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def poll(self, timeout: float = 0) -> bool:
+        """Return True if a message can be received without blocking, waiting up to `timeout` seconds."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self) -> None:
+        """Close this end of the transport."""
+        raise NotImplementedError
+
+
+class PipeTransport(RemoteTransport):
+    """A transport over one end of a `multiprocessing.Pipe()`, messages are pickled."""
+
+    def __init__(self, connection: Connection):
+        self._connection = connection
+
+    def send(self, message: Any) -> None:
+        self._connection.send(message)
+
+    def recv(self) -> Any:
+        return self._connection.recv()
+
+    def poll(self, timeout: float = 0) -> bool:
+        return self._connection.poll(timeout)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def run_remote_worker(transport: RemoteTransport) -> None:
+    """
+    Worker loop: pull batches of commands from the coordinator, execute them and report the results back.
+
+    Each result batch also tells the coordinator the worker is ready for more work. Runs until the coordinator sends `None`.
+
+    Args:
+        transport (RemoteTransport): The worker's end of the transport.
+    """
+    transport.send([])  # ready for the first batch
+    while True:
+        batch: _WorkBatch = transport.recv()
+        if batch is None:
+            break
+        results: _ResultBatch = []
+        for token, command_type, args in batch:
+            try:
+                command = command_type(args)
+            except Exception as e:
+                results.append((token, ExecutionResponse.failure(str(e)), None, 0.0))
+                continue
+            start = perf_counter()
+            try:
+                execution_response = command.execute()
+            except Exception as e:
+                execution_response = ExecutionResponse.failure(str(e))
+            results.append((token, execution_response, command.response, perf_counter() - start))
+        transport.send(results)
+    transport.close()
+
+
+@dataclass
+class _RemoteWorker:
+    transport: RemoteTransport
+    ready: bool = False
+    process: Optional[BaseProcess] = None
+
+
+def _is_chain(command: Command[Any, Any]) -> bool:
+    return isinstance(command, CommandChain)
+
+
+class RemoteCommandQueue(CommandQueue):
+    """
+    A CommandQueue that executes commands on remote workers.
+
+    The coordinator (this queue) keeps every command, runs the dependency, `should_defer()` and `should_cancel()` checks,
+    and calls all callbacks. Commands that are ready to execute are sent to workers as `(command class, args)` in
+    batches, and the worker's `ExecutionResponse` and command response are copied back when they arrive.
+
+    Commands and their args must be picklable by the transport, and their class importable by the worker.
+    Commands that need the coordinator (e.g. `CommandChain`) are executed locally.
+    """
+
+    def __init__(
+        self,
+        transports: list[RemoteTransport],
+        batch_size: int = 64,
+        timing_queue_length: int = 0,
+        execute_locally: Callable[[Command[Any, Any]], bool] = _is_chain,
+        poll_interval_s: float = 0.001,
+        **queue_kwargs: Any,
+    ):
+        """
+        Construct a new RemoteCommandQueue.
+
+        Args:
+            transports (list[RemoteTransport]): One transport per worker, each worker should be running `run_remote_worker()`.
+            batch_size (int, optional): Maximum number of commands sent to a worker in one message. Defaults to 64.
+            timing_queue_length (int, optional): Length of the timing queue for performance measurement, set to 0 to disable timing. Defaults to 0.
+            execute_locally (Callable[[Command], bool], optional): Predicate selecting commands that are executed by the coordinator. Defaults to `CommandChain` instances.
+            poll_interval_s (float, optional): How long to wait on each transport when waiting for results. Defaults to 0.001.
+            **queue_kwargs: Other options of `CommandQueue`. For commands sent to a worker, `execution_timeout_s` and the `watchdog` count from when the command is sent (a watchdog with `fail_on_timeout=True` marks them FAILED), a `rate_limiter` holds a command in flight until its result is back, and a `profiler` only samples commands executed by the coordinator.
+        """
+        super().__init__(timing_queue_length=timing_queue_length, **queue_kwargs)
+        if not transports:
+            raise ValueError("RemoteCommandQueue needs at least one transport.")
+        self._workers = [_RemoteWorker(transport=transport) for transport in transports]
+        self._batch_size = batch_size
+        self._execute_locally = execute_locally
+        self._poll_interval_s = poll_interval_s
+        self._tokens = count()
+        # token -> (command, log entry), for commands that were dispatched but have no result yet
+        self._in_flight: dict[int, tuple[Command[Any, Any], CommandLogEntry]] = {}
+        # token -> watched execution, for commands sent to a worker if the queue has a watchdog
+        self._watched: dict[int, _WatchedExecution] = {}
+        # token -> when it was sent to a worker, and (deadline, timeout) for commands with an execution timeout
+        self._sent_at: dict[int, float] = {}
+        self._deadlines: dict[int, tuple[float, float]] = {}
+        # set by `cancel()`, so in-flight commands are only scanned for tripped tokens when there can be one
+        self._cancel_requested = False
+        self._outgoing: list[tuple[int, Type[Command[Any, Any]], CommandArgs]] = []
+        # set when a pass neither dispatched nor finished anything, e.g. everything left depends on in-flight commands
+        self._stalled = False
+
+    @classmethod
+    def with_local_workers(cls, num_workers: int, **queue_kwargs: Any) -> "RemoteCommandQueue":
+        """
+        Create a RemoteCommandQueue backed by `num_workers` local worker processes connected with pipes.
+
+        Call `close()` (or use the queue as a context manager) to shut the workers down.
+
+        Args:
+            num_workers (int): Number of worker processes to start.
+            **queue_kwargs: Other options of the queue, e.g. `batch_size`, `timing_queue_length` or `rate_limiter`.
+
+        Returns:
+            RemoteCommandQueue: The queue, with its workers already started.
+        """
+        context = multiprocessing.get_context()
+        transports: list[RemoteTransport] = []
+        processes: list[BaseProcess] = []
+        for _ in range(num_workers):
+            coordinator_end, worker_end = context.Pipe()
+            process: BaseProcess = context.Process(
+                target=run_remote_worker, args=(PipeTransport(worker_end),), daemon=True
+            )
+            process.start()
+            worker_end.close()
+            transports.append(PipeTransport(coordinator_end))
+            processes.append(process)
+        queue = cls(transports, **queue_kwargs)
+        for worker, process in zip(queue._workers, processes):
+            worker.process = process
+        return queue
+
+    def _dispatch_execution(
+        self,
+        command: Command[CommandArgs, CommandResponse],
+        output: CommandLogEntry,
+        queue_process_response: QueueProcessResponse,
+    ) -> bool:
+        """Queue the command to be sent to a worker, its result is applied on a later `process_once()`."""
+        if self._execute_locally(command):
+            return super()._dispatch_execution(command, output, queue_process_response)
+        token = next(self._tokens)
+        self._in_flight[token] = (command, output)
+        self._outgoing.append((token, command.__class__, command.args))
+        return True
+
+    def _estimated_execute_s(self, command: Command[Any, Any]) -> float:
+        """Sending a command to a worker takes no time on the coordinator, only local executions count against a time budget."""
+        if not self._execute_locally(command):
+            return 0.0
+        return super()._estimated_execute_s(command)
+
+    def _send_batches(self) -> None:
+        """Hand out pending commands to every worker that is ready for more work."""
+        for worker in self._workers:
+            if not self._outgoing:
+                return
+            if worker.ready:
+                batch = self._outgoing[: self._batch_size]
+                del self._outgoing[: self._batch_size]
+                worker.transport.send(batch)
+                worker.ready = False
+                # timeouts and the watchdog's clock start once a command is handed to a worker
+                sent_at = perf_counter()
+                for token, _, _ in batch:
+                    command = self._in_flight[token][0]
+                    self._sent_at[token] = sent_at
+                    timeout_s = self._timeout_for(command)
+                    if timeout_s is not None:
+                        self._deadlines[token] = (sent_at + timeout_s, timeout_s)
+                    if self._watchdog is not None:
+                        self._watched[token] = self._watchdog._watch(command, self._metrics, thread_id=None)
+
+    def _apply_results(
+        self, results: _ResultBatch, queue_process_response: QueueProcessResponse
+    ) -> None:
+        """Copy the results of remotely executed commands back onto the local commands."""
+        for token, execution_response, remote_response, elapsed in results:
+            in_flight = self._in_flight.pop(token, None)
+            if in_flight is None:  # expired, see `_expire_in_flight()`
+                continue
+            command, output = in_flight
+            self._deadlines.pop(token, None)
+            self._sent_at.pop(token, None)
+            watched = self._watched.pop(token, None)
+            if self._watchdog is not None and watched is not None:
+                self._watchdog._unwatch(watched)
+            if remote_response is not None:
+                for name, value in vars(remote_response).items():
+                    if name != "status":
+                        setattr(command.response, name, value)
+            self._finish_execution(
+                command, execution_response, elapsed, output, queue_process_response
+            )
+            queue_process_response.command_log.append(output)
+
+    def _expire_in_flight(self, queue_process_response: QueueProcessResponse) -> bool:
+        """
+        Mark the in-flight commands that were canceled, exceeded their timeout or were timed out by the watchdog as FAILED.
+
+        Their workers are not interrupted, late results are ignored. Returns True if any command was expired.
+        """
+        now = perf_counter()
+        expired: dict[int, LifecycleResponseReason] = {}
+        for token, (deadline, timeout_s) in self._deadlines.items():
+            if now >= deadline:
+                expired[token] = self._timeout_reason(timeout_s)
+        for token, watched_execution in self._watched.items():
+            if watched_execution.timed_out and token not in expired:
+                expired[token] = ReasonByTimeout(
+                    f"Timed out by the watchdog after {now - watched_execution.started_at:.3f}s"
+                    f" (threshold {watched_execution.deadline - watched_execution.started_at:.3f}s)"
+                )
+        if self._cancel_requested:
+            self._cancel_requested = False
+            for token, (command, _) in self._in_flight.items():
+                cancellation_token = command._cancellation_token
+                if cancellation_token is not None and cancellation_token.reason is not None:
+                    expired.setdefault(token, cancellation_token.reason)
+        if not expired:
+            return False
+        self._outgoing = [item for item in self._outgoing if item[0] not in expired]
+        for token, reason in expired.items():
+            command, output = self._in_flight.pop(token)
+            self._deadlines.pop(token, None)
+            watched = self._watched.pop(token, None)
+            if self._watchdog is not None and watched is not None:
+                self._watchdog._unwatch(watched)
+            command.cancellation_token.cancel(reason)
+            sent_at = self._sent_at.pop(token, None)
+            elapsed = now - sent_at if sent_at is not None else 0.0
+            execution_response = ExecutionResponse(should_proceed=False, reason=command.cancellation_token.reason)
+            self._finish_execution(command, execution_response, elapsed, output, queue_process_response)
+            queue_process_response.command_log.append(output)
+        return True
+
+    def cancel(self, command: Command[Any, Any], reason: str = "Canceled with CommandQueue.cancel()") -> bool:
+        """
+        Cancel a command, see `CommandQueue.cancel()`.
+
+        A command that was dispatched to a worker is FAILED with a `ReasonByCancellation` on the next pass, without
+        waiting for the worker, which is not interrupted. Its late result is ignored.
+        """
+        if not super().cancel(command, reason):
+            return False
+        self._cancel_requested = True
+        return True
+
+    def _receive_results(
+        self, queue_process_response: QueueProcessResponse, block: bool, deadline: Optional[float] = None
+    ) -> None:
+        """
+        Apply every result batch that has arrived, optionally waiting until at least one arrives or a command times out.
+
+        With a `deadline` (a `perf_counter()` value), never waits past it.
+        """
+        received_any = False
+        while True:
+            for worker in self._workers:
+                while worker.transport.poll(0):
+                    self._apply_results(worker.transport.recv(), queue_process_response)
+                    worker.ready = True
+                    received_any = True
+            if self._expire_in_flight(queue_process_response):
+                received_any = True
+            if received_any or not block or (deadline is not None and perf_counter() >= deadline):
+                return
+            for worker in self._workers:
+                if worker.transport.poll(self._poll_interval_s):
+                    break
+
+    def process_once(
+        self, max_iterations: int = 1000, time_budget_ms: Optional[float] = None
+    ) -> QueueProcessResponse:
+        """
+        Apply results that arrived from the workers, process all commands in the queue a single time, and send newly ready commands to the workers.
+
+        If commands are still being executed remotely and the queue has nothing to process, or its previous pass neither
+        dispatched nor finished a command (e.g. everything left depends on in-flight commands), this waits until at least
+        one worker reports back, the watchdog times out a command, or the time budget is used up. Rate-limited commands
+        that are parked cap that wait at 10ms, so they are released when their key has a token again.
+
+        Args:
+            max_iterations (int, optional): Maximum number of commands to process in one call. Defaults to 1000.
+            time_budget_ms (Optional[float], optional): Wall-clock time this call may spend, see `CommandQueue.process_once()`. Only commands executed locally count against it with their estimated `execute()` time. None for no limit. Defaults to None.
+
+        Returns:
+            QueueProcessResponse: Response containing details of the processing, including the results of remotely executed commands.
+        """
+        deadline = perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
+        response = QueueProcessResponse(command_log=[])
+        block = len(self._in_flight) > 0 and (self._stalled or len(self._queue) + len(self._fast_lane) == 0)
+        wait_until = deadline
+        if block and self._parked:
+            wait_until = min(perf_counter() + 0.01, deadline if deadline is not None else float("inf"))
+        self._receive_results(response, block=block, deadline=wait_until)
+        if self._metrics is not None:
+            # the base class only counts what happens during its own pass
+            self._flush_metrics(response)
+        self._send_batches()
+        remaining_ms = max(0.0, (deadline - perf_counter()) * 1000) if deadline is not None else None
+        num_in_flight = len(self._in_flight)
+        pass_response = super().process_once(max_iterations=max_iterations, time_budget_ms=remaining_ms)
+        self._stalled = (
+            len(self._in_flight) <= num_in_flight
+            and pass_response.num_successes + pass_response.num_failures + pass_response.num_cancellations == 0
+        )
+        response += pass_response
+        self._send_batches()
+        return response
+
+    def _pending_commands(self) -> list[Command[Any, Any]]:
+        """All commands held by the queue, including commands that are being executed remotely."""
+        return super()._pending_commands() + [command for command, _ in self._in_flight.values()]
+
+    def close(self) -> None:
+        """Shut down all workers and close their transports. Commands still in flight are abandoned."""
+        for worker in self._workers:
+            worker.transport.send(None)
+            worker.transport.close()
+            if worker.process is not None:
+                worker.process.join()
+
+    def __enter__(self) -> "RemoteCommandQueue":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        """
+        Get the number of commands in the queue, including commands that are being executed remotely.
+
+        Returns:
+            int: The number of commands in the queue.
+        """
+        return super().__len__() + len(self._in_flight)
@@ -0,0 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Any, Callable, Hashable, Optional
+
+from .Command import Command, ResponseType
+from .CommandQueue import QueueProcessResponse
+from .CommandResponse import CommandResponse
+from .ThreadSafeCommandQueue import ThreadSafeCommandQueue
+
+
+class ShardedCommandQueue:
+    """
+    A queue that partitions commands across several `ThreadSafeCommandQueue` shards, each drained by its own worker thread.
+
+    Commands are routed to a shard by the hash of `shard_key(command)`, or round-robin if no key function is given.
+    A worker whose shard runs dry (or only contains deferred commands) steals not-yet-ingested commands from the
+    busiest shard's inbox, or, once every inbox is empty, ingested commands from a shard that is between passes. Dependencies are evaluated against the shared command responses, so `DependencyEntry` links between
+    commands on different shards are honoured.
+
+    Throughput scales with the number of shards for I/O-bound commands, and for CPU-bound commands on free-threaded
+    Python builds.
+    """
+
+    def __init__(
+        self,
+        num_shards: int = 4,
+        shard_key: Optional[Callable[[Command[Any, Any]], Hashable]] = None,
+        timing_queue_length: int = 0,
+        ingest_batch_size: int = 64,
+        idle_sleep_s: float = 0.0005,
+        **queue_kwargs: Any,
+    ):
+        """
+        Construct a new ShardedCommandQueue.
+
+        Args:
+            num_shards (int, optional): Number of shards and worker threads. Defaults to 4.
+            shard_key (Optional[Callable[[Command], Hashable]], optional): Function mapping a command to a key used to pick its shard, None for round-robin. Defaults to None.
+            timing_queue_length (int, optional): Length of the timing queue of each shard, set to 0 to disable timing. Defaults to 0.
+            ingest_batch_size (int, optional): Maximum number of commands a shard ingests per pass, the rest can be stolen by idle workers. Defaults to 64.
+            idle_sleep_s (float, optional): How long an idle worker sleeps before looking for work again. Defaults to 0.0005.
+            **queue_kwargs: Other options of `ThreadSafeCommandQueue`, passed to every shard. Objects such as a `tracer`, `metrics` or a `rate_limiter` are shared by the shards, so a rate limiter's limits apply to the whole queue while an `admission_controller`'s budgets apply to each shard's passes.
+        """
+        if num_shards < 1:
+            raise ValueError(f"num_shards must be at least 1, got {num_shards}.")
+        self._shards = [
+            ThreadSafeCommandQueue(
+                timing_queue_length=timing_queue_length, ingest_batch_size=ingest_batch_size, **queue_kwargs
+            )
+            for _ in range(num_shards)
+        ]
+        # commands move between shards when they are stolen, so their spans are shared (and so are chains' parent spans)
+        for shard in self._shards[1:]:
+            shard._traces = self._shards[0]._traces
+        self._shard_key = shard_key
+        self._round_robin = count()
+        self._ingest_batch_size = ingest_batch_size
+        self._idle_sleep_s = idle_sleep_s
+        self._busy_workers = 0
+        self._busy_workers_lock = Lock()
+        # iterations `process_all()` has left to hand out to the workers
+        self._iterations_left = 0
+        # shards whose worker has returned from `_work()`, so nobody else will process what is left on them
+        self._exited_shards: set[ThreadSafeCommandQueue] = set()
+
+    @property
+    def shards(self) -> list[ThreadSafeCommandQueue]:
+        """
+        The shards of this queue, e.g. to inspect their `get_timing_data()`.
+
+        **Do not modify the returned list.**
+        """
+        return self._shards
+
+    def _pick_shard(self, command: Command[Any, Any]) -> ThreadSafeCommandQueue:
+        """Pick the shard a command should be submitted to."""
+        if self._shard_key is None:
+            return self._shards[next(self._round_robin) % len(self._shards)]
+        return self._shards[hash(self._shard_key(command)) % len(self._shards)]
+
+    def submit(self, command: Command[Any, ResponseType]) -> ResponseType:
+        """
+        Submit a command to one of the shards. Safe to call from any thread.
+
+        Args:
+            command (Command[ArgsType, ResponseType]): The command to be submitted.
+
+        Returns:
+            ResponseType: The response object associated with the command.
+        """
+        return self._pick_shard(command).submit(command)
+
+    def submit_many(self, *commands: Command[Any, Any]) -> list[CommandResponse]:
+        """
+        Submit multiple commands to the shards. Safe to call from any thread.
+
+        Args:
+            *commands (Command[ArgsType, ResponseType]): The commands to be submitted.
+
+        Returns:
+            list[ResponseType]: List of response objects associated with the submitted commands.
+        """
+        return [self.submit(command) for command in commands]
+
+    def cancel(self, command: Command[Any, Any], reason: str = "Canceled with CommandQueue.cancel()") -> bool:
+        """
+        Cancel a command, wherever it is. Safe to call from any thread, see `CommandQueue.cancel()`.
+
+        Args:
+            command (Command): The command to cancel.
+            reason (str, optional): Reason of the command's final response. Defaults to "Canceled with CommandQueue.cancel()".
+
+        Returns:
+            bool: True if the command was canceled, False if it already reached a final status or was already canceled.
+        """
+        # only the command's token is involved, so any shard can do it
+        return self._shards[0].cancel(command, reason)
+
+    def _steal_into(self, shard: ThreadSafeCommandQueue, from_queues: bool = False) -> bool:
+        """
+        Steal half of the busiest other shard's inbox into `shard`, returns True if anything was stolen.
+
+        If every other inbox is empty and `from_queues` is set, steal half of the ingested commands of the busiest
+        shard that is not running a pass instead. Shards with a running worker keep their last command, the shards
+        of exited workers can be emptied.
+        """
+        others = [other for other in self._shards if other is not shard]
+        victim = max(others, key=lambda other: other.inbox_size(), default=None)
+        if victim is not None and victim.inbox_size() > 0:
+            stolen = victim.steal(max(1, min(victim.inbox_size() // 2, self._ingest_batch_size)))
+        else:
+            stolen = []
+            for victim in sorted(others, key=len, reverse=True) if from_queues else []:
+                if victim in self._exited_shards:
+                    max_count = len(victim)
+                else:
+                    # leave a shard its last command
+                    max_count = len(victim) // 2
+                if max_count == 0:
+                    continue
+                stolen = victim.steal_queued(min(max_count, self._ingest_batch_size))
+                if stolen:
+                    break
+        if not stolen:
+            return False
+        shard._adopt(stolen)
+        return True
+
+    def _reserve_iterations(self) -> int:
+        """Take a share of the iterations left to `process_all()` for one pass, 0 if there are none left."""
+        with self._busy_workers_lock:
+            reserved = min(self._iterations_left, max(1, self._iterations_left // len(self._shards)))
+            self._iterations_left -= reserved
+            return reserved
+
+    def _return_iterations(self, unused: int) -> None:
+        """Give back the iterations a pass reserved but did not use."""
+        with self._busy_workers_lock:
+            self._iterations_left += unused
+
+    def _set_busy(self, busy: bool) -> None:
+        """Mark the calling worker as busy or idle."""
+        with self._busy_workers_lock:
+            self._busy_workers += 1 if busy else -1
+
+    def _work(self, shard: ThreadSafeCommandQueue, deadline: Optional[float] = None) -> QueueProcessResponse:
+        """
+        Worker loop for a single shard.
+
+        Runs until every shard is empty, the iterations shared by all workers are spent, the deadline (a
+        `perf_counter()` value) has passed, or this worker is idle and no busy worker is left that could produce
+        more work for it.
+        """
+        response = QueueProcessResponse(command_log=[])
+        busy = True
+        try:
+            while True:
+                remaining_ms = (deadline - perf_counter()) * 1000 if deadline is not None else None
+                if remaining_ms is not None and remaining_ms <= 0:
+                    response.reached_time_budget = True
+                    return response
+                if len(shard) == 0 and not self._steal_into(shard, from_queues=True):
+                    if busy:
+                        self._set_busy(False)
+                        busy = False
+                    if len(self) == 0 or self._busy_workers == 0:
+                        return response
+                    sleep(self._idle_sleep_s)
+                    continue
+                if not busy:
+                    self._set_busy(True)
+                    busy = True
+                reserved = self._reserve_iterations()
+                if reserved == 0:
+                    break
+                pass_response = shard.process_once(max_iterations=reserved, time_budget_ms=remaining_ms)
+                self._return_iterations(reserved - pass_response.num_commands_processed)
+                response += pass_response
+                made_progress = (
+                    pass_response.num_successes
+                    + pass_response.num_failures
+                    + pass_response.num_cancellations
+                ) > 0
+                if not made_progress and not self._steal_into(shard):
+                    # everything left on this shard is waiting on something, give other workers a chance
+                    sleep(self._idle_sleep_s)
+            response.reached_max_iterations = True
+            return response
+        finally:
+            with self._busy_workers_lock:
+                self._exited_shards.add(shard)
+                if busy:
+                    self._busy_workers -= 1
+
+    def process_all(
+        self, max_total_iterations: int = 1000, time_budget_ms: Optional[float] = None
+    ) -> QueueProcessResponse:
+        """
+        Process all commands on all shards concurrently until every shard is empty, the workers have processed `max_total_iterations` commands between them, or the time budget is used up.
+
+        Blocks until every worker has finished.
+
+        Args:
+            max_total_iterations (int, optional): Maximum number of commands all workers together can process. Defaults to 1000.
+            time_budget_ms (Optional[float], optional): Wall-clock time the workers may spend processing commands, see `CommandQueue.process_once()`. None for no limit. Defaults to None.
+
+        Returns:
+            QueueProcessResponse: Combined response of all workers.
+        """
+        deadline = perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
+        self._busy_workers = len(self._shards)
+        self._iterations_left = max_total_iterations
+        self._exited_shards = set()
+        with ThreadPoolExecutor(max_workers=len(self._shards)) as executor:
+            futures = [executor.submit(self._work, shard, deadline) for shard in self._shards]
+            response = QueueProcessResponse(command_log=[])
+            for future in futures:
+                response += future.result()
+        return response
+
+    # Magic methods
+
+    def __len__(self) -> int:
+        """
+        Get the number of commands across all shards.
+
+        Returns:
+            int: The number of commands in the queue.
+        """
+        return sum(len(shard) for shard in self._shards)
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return f"{self.__class__.__name__}(num_shards={len(self._shards)}, queue_size={len(self)})"
@@ -0,0 +1,183 @@
+from collections import deque
+from threading import Lock
+from time import perf_counter
+from typing import Any, Optional
+
+from .Command import Command, ResponseType
+from .CommandJournal import CommandJournal
+from .CommandQueue import CommandQueue, QueueProcessResponse
+from .CommandResponse import CommandResponse
+
+
+class ThreadSafeCommandQueue(CommandQueue):
+    """
+    A CommandQueue that can be submitted to from many threads while another thread processes it.
+
+    Submitted commands are appended to an inbox, which is swapped out and moved into the queue at the start of
+    every `process_once()` call. Producers only ever hold the inbox lock for the duration of an append, and never
+    contend with the processing loop itself.
+
+    Commands submitted while a pass is running (including from callbacks) are processed on the next pass.
+    Commands still waiting in the inbox can be taken by another queue with `steal()`, and commands already in the
+    queue with `steal_queued()` between passes.
+    """
+
+    def __init__(
+        self,
+        timing_queue_length: int = 0,
+        journal: Optional[CommandJournal] = None,
+        ingest_batch_size: Optional[int] = None,
+        **queue_kwargs: Any,
+    ):
+        """
+        Construct a new ThreadSafeCommandQueue.
+
+        Args:
+            timing_queue_length (int, optional): Length of the timing queue for performance measurement, set to 0 to disable timing. Defaults to 0.
+            journal (Optional[CommandJournal], optional): Journal to record submissions and final statuses in, so the queue can be recovered with `ThreadSafeCommandQueue.recover()`. Defaults to None.
+            ingest_batch_size (Optional[int], optional): Maximum number of commands to move from the inbox into the queue per pass, None to move the whole inbox at once. Defaults to None.
+            **queue_kwargs: Other options of `CommandQueue`, e.g. `tracer`, `metrics` or `rate_limiter`.
+        """
+        super().__init__(timing_queue_length=timing_queue_length, journal=journal, **queue_kwargs)
+        self._ingest_batch_size = ingest_batch_size
+        self._inbox: deque[Command[Any, Any]] = deque()
+        self._inbox_lock = Lock()
+        # only one thread may process the queue at a time, producers never take this lock
+        self._process_lock = Lock()
+
+    def submit(self, command: Command[Any, ResponseType]) -> ResponseType:
+        """
+        Submit a command to the queue. Safe to call from any thread.
+
+        Args:
+            command (Command[ArgsType, ResponseType]): The command to be submitted.
+
+        Returns:
+            ResponseType: The response object associated with the command.
+        """
+        command.submitted_at = perf_counter()
+        if self._journal is not None:
+            self._journal.record_submit(command)
+        with self._inbox_lock:
+            self._inbox.append(command)
+        return command.response
+
+    def submit_many(self, *commands: Command[Any, Any]) -> list[CommandResponse]:
+        """
+        Submit multiple commands to the queue, taking the inbox lock only once. Safe to call from any thread.
+
+        Args:
+            *commands (Command[ArgsType, ResponseType]): The commands to be submitted.
+
+        Returns:
+            list[ResponseType]: List of response objects associated with the submitted commands.
+        """
+        submitted_at = perf_counter()
+        for command in commands:
+            command.submitted_at = submitted_at
+        if self._journal is not None:
+            for command in commands:
+                self._journal.record_submit(command)
+        with self._inbox_lock:
+            self._inbox.extend(commands)
+        return [command.response for command in commands]
+
+    def _adopt(self, commands: list[Command[Any, Any]]) -> None:
+        """Append commands stolen from another queue to the inbox, keeping their `submitted_at` and journal records."""
+        with self._inbox_lock:
+            self._inbox.extend(commands)
+
+    def _swap_inbox(self) -> deque[Command[Any, Any]]:
+        """Take the commands to ingest this pass out of the inbox, oldest first."""
+        with self._inbox_lock:
+            if self._ingest_batch_size is None or len(self._inbox) <= self._ingest_batch_size:
+                inbox, self._inbox = self._inbox, deque()
+                return inbox
+            return deque(self._inbox.popleft() for _ in range(self._ingest_batch_size))
+
+    def steal(self, max_count: int) -> list[Command[Any, Any]]:
+        """
+        Remove up to `max_count` of the most recently submitted commands that have not been ingested yet.
+
+        Commands that are already in the queue (e.g. deferred commands) are never stolen. Safe to call from any thread.
+
+        Args:
+            max_count (int): Maximum number of commands to steal.
+
+        Returns:
+            list[Command[Any, Any]]: The stolen commands, in submission order.
+        """
+        with self._inbox_lock:
+            stolen = [self._inbox.pop() for _ in range(min(max_count, len(self._inbox)))]
+        stolen.reverse()
+        return stolen
+
+    def steal_queued(self, max_count: int) -> list[Command[Any, Any]]:
+        """
+        Remove up to `max_count` of the most recently ingested commands from the queue, unless a pass is running.
+
+        Used to rebalance commands that were ingested but not processed yet (e.g. when a pass stopped early, or the
+        commands were deferred). Never blocks: returns nothing if another thread is processing the queue. Safe to call
+        from any thread.
+
+        Args:
+            max_count (int): Maximum number of commands to steal.
+
+        Returns:
+            list[Command[Any, Any]]: The stolen commands, in queue order.
+        """
+        if not self._process_lock.acquire(blocking=False):
+            return []
+        try:
+            num_stolen = min(max_count, len(self._queue))
+            if num_stolen == 0:
+                return []
+            stolen = self._queue[-num_stolen:]
+            del self._queue[-num_stolen:]
+            # the next pass clamps `_cursor` to the shorter queue
+            return stolen
+        finally:
+            self._process_lock.release()
+
+    def inbox_size(self) -> int:
+        """
+        Get the number of commands that have been submitted but not yet ingested.
+
+        Returns:
+            int: The number of commands waiting in the inbox.
+        """
+        return len(self._inbox)
+
+    def _pending_commands(self) -> list[Command[Any, Any]]:
+        """All commands held by the queue, including commands that have not been ingested yet."""
+        with self._inbox_lock:
+            inbox = list(self._inbox)
+        return super()._pending_commands() + inbox
+
+    def process_once(
+        self, max_iterations: int = 1000, time_budget_ms: Optional[float] = None
+    ) -> QueueProcessResponse:
+        """
+        Move newly submitted commands into the queue (up to `ingest_batch_size`), then process all commands in the queue a single time.
+
+        Only one thread can process the queue at a time, concurrent calls will block until the current pass finishes.
+
+        Args:
+            max_iterations (int, optional): Maximum number of commands to process in one call. Defaults to 1000.
+            time_budget_ms (Optional[float], optional): Wall-clock time this call may spend processing commands, see `CommandQueue.process_once()`. None for no limit. Defaults to None.
+
+        Returns:
+            QueueProcessResponse: Response containing details of the processing.
+        """
+        with self._process_lock:
+            self._queue.extend(self._swap_inbox())
+            return super().process_once(max_iterations=max_iterations, time_budget_ms=time_budget_ms)
+
+    def __len__(self) -> int:
+        """
+        Get the number of commands in the queue, including commands that have been submitted but not yet ingested.
+
+        Returns:
+            int: The number of commands in the queue.
+        """
+        return super().__len__() + len(self._inbox)
@@ -0,0 +1,155 @@
+"""Pluggable tracing of command lifecycles, see `CommandQueue(tracer=...)`."""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from itertools import count
+from threading import Lock
+from time import perf_counter_ns, time_ns
+from typing import Optional, Union
+
+AttributeValue = Union[str, bool, int, float]
+
+# perf_counter() timestamps are converted to wall-clock nanoseconds with this offset
+_EPOCH_OFFSET_NS = time_ns() - perf_counter_ns()
+
+
+def perf_counter_to_epoch_ns(perf_counter_s: float) -> int:
+    """Convert a `time.perf_counter()` timestamp to nanoseconds since the epoch."""
+    return int(perf_counter_s * 1_000_000_000) + _EPOCH_OFFSET_NS
+
+
+class Span(ABC):
+    """A single timed operation, possibly with a parent span."""
+
+    @abstractmethod
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        """Set an attribute on the span."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def end(self, end_time_ns: Optional[int] = None) -> None:
+        """End the span, at `end_time_ns` (nanoseconds since the epoch) or now."""
+        raise NotImplementedError
+
+
+class Tracer(ABC):
+    """
+    Creates spans for the command lifecycle.
+
+    A queue with a tracer opens one span per command (`command <type name>`) when the command is first processed,
+    and ends it when the command reaches a final status. Each lifecycle stage it goes through gets a child span:
+    `check_dependencies`, `should_defer`, `should_cancel`, `execute`, and `on_defer_callbacks`, `on_cancel_callbacks`
+    or `on_execute_callbacks`. Adapting this to OpenTelemetry only takes wrapping `start_span()` and the returned span.
+    """
+
+    @abstractmethod
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[Span] = None,
+        start_time_ns: Optional[int] = None,
+        attributes: Optional[dict[str, AttributeValue]] = None,
+    ) -> Span:
+        """
+        Start a new span.
+
+        Args:
+            name (str): Name of the span.
+            parent (Optional[Span], optional): Parent span, None for a root span. Defaults to None.
+            start_time_ns (Optional[int], optional): Start time in nanoseconds since the epoch, None for now. Defaults to None.
+            attributes (Optional[dict[str, AttributeValue]], optional): Initial attributes of the span. Defaults to None.
+
+        Returns:
+            Span: The started span.
+        """
+        raise NotImplementedError
+
+
+@dataclass
+class RecordedSpan(Span):
+    """
+    A span recorded by `InMemoryTracer`.
+
+    Attributes:
+        name (str): Name of the span.
+        span_id (int): Identifier of the span, unique within its tracer.
+        parent_id (Optional[int]): Identifier of the parent span, None for a root span.
+        start_time_ns (int): Start time in nanoseconds since the epoch.
+        end_time_ns (Optional[int]): End time in nanoseconds since the epoch, None until the span has ended.
+        attributes (dict[str, AttributeValue]): Attributes of the span.
+    """
+
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    start_time_ns: int
+    end_time_ns: Optional[int] = None
+    attributes: dict[str, AttributeValue] = field(default_factory=dict)
+    _tracer: Optional["InMemoryTracer"] = field(default=None, repr=False, compare=False)
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+    def end(self, end_time_ns: Optional[int] = None) -> None:
+        if self.end_time_ns is not None:
+            return
+        self.end_time_ns = time_ns() if end_time_ns is None else end_time_ns
+        if self._tracer is not None:
+            self._tracer._record(self)
+
+
+class InMemoryTracer(Tracer):
+    """A tracer that keeps every finished span in memory, meant for tests."""
+
+    def __init__(self) -> None:
+        self._ids = count(1)
+        self._lock = Lock()
+        self._finished: list[RecordedSpan] = []
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[Span] = None,
+        start_time_ns: Optional[int] = None,
+        attributes: Optional[dict[str, AttributeValue]] = None,
+    ) -> Span:
+        return RecordedSpan(
+            name=name,
+            span_id=next(self._ids),
+            parent_id=parent.span_id if isinstance(parent, RecordedSpan) else None,
+            start_time_ns=time_ns() if start_time_ns is None else start_time_ns,
+            attributes=dict(attributes or {}),
+            _tracer=self,
+        )
+
+    def _record(self, span: RecordedSpan) -> None:
+        with self._lock:
+            self._finished.append(span)
+
+    @property
+    def finished_spans(self) -> list[RecordedSpan]:
+        """
+        The spans that have ended, in the order they ended.
+
+        Returns:
+            list[RecordedSpan]: A copy of the finished spans.
+        """
+        with self._lock:
+            return list(self._finished)
+
+    def children(self, span: RecordedSpan) -> list[RecordedSpan]:
+        """
+        Get the finished children of a span.
+
+        Args:
+            span (RecordedSpan): The parent span.
+
+        Returns:
+            list[RecordedSpan]: The finished spans whose parent is `span`, in the order they ended.
+        """
+        return [child for child in self.finished_spans if child.parent_id == span.span_id]
+
+    def clear(self) -> None:
+        """Forget all finished spans."""
+        with self._lock:
+            self._finished.clear()
@@ -0,0 +1,243 @@
+"""Detection of commands whose `execute()` runs for too long, see `CommandQueue(watchdog=...)`."""
+
+import sys
+from collections import deque
+from dataclasses import dataclass
+from logging import Logger, getLogger
+from threading import Condition, Thread
+from time import perf_counter
+from traceback import format_stack
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, Optional, Type
+
+from .CommandJournal import command_type_name
+
+if TYPE_CHECKING:
+    from .Command import Command
+    from .Metrics import QueueMetrics
+
+
+@dataclass
+class SlowExecution:
+    """
+    A command execution that exceeded its threshold, as reported by a `CommandWatchdog`.
+
+    Attributes:
+        command_type (Type[Command]): Type of the command.
+        args (str): Summary of the command's args, at most `CommandWatchdog.max_args_length` characters.
+        threshold_s (float): The threshold that was exceeded.
+        elapsed_s (float): How long the command had been executing when it was reported.
+        stack (Optional[str]): Stack of the executing thread, None if the command is executed in another process.
+        timed_out (bool): True if the command was marked FAILED because of it.
+    """
+
+    command_type: Type["Command[Any, Any]"]
+    args: str
+    threshold_s: float
+    elapsed_s: float
+    stack: Optional[str]
+    timed_out: bool = False
+
+
+@dataclass(eq=False)
+class _WatchedExecution:
+    """An execution the watchdog keeps an eye on, from `_watch()` until `_unwatch()`."""
+
+    command: "Command[Any, Any]"
+    started_at: float
+    deadline: float
+    thread_id: Optional[int]  # None if executed in another process
+    metrics: Optional["QueueMetrics"]
+    reported: bool = False
+    timed_out: bool = False
+
+
+class CommandWatchdog:
+    """
+    Watches the commands that are being executed from a background thread, and reports the ones that run for too long.
+
+    When an execution exceeds the threshold of its command type, the watchdog logs a warning with the command type,
+    a summary of its args and the stack of the executing thread, counts it in the queue's `QueueMetrics` (if any) as
+    `<namespace>_slow_commands_total`, and keeps it in `slow_executions`. Every execution is reported at most once.
+
+    A synchronous `execute()` cannot be interrupted, so a queue executing commands itself only reports them. With
+    `fail_on_timeout=True`, a `RemoteCommandQueue` marks a slow command FAILED with a `ReasonByTimeout` on its next pass,
+    so its dependents and its place in the queue are freed without waiting for the worker. A late result is ignored.
+    There the clock starts when the command's batch is sent to a worker, so it includes the earlier commands of its batch.
+
+    One watchdog can be shared between queues. Its thread starts with the first execution it watches, call `stop()`
+    (or use it as a context manager) to stop it.
+    """
+
+    def __init__(
+        self,
+        threshold_s: float = 1.0,
+        thresholds: Optional[dict[Type["Command[Any, Any]"], float]] = None,
+        check_interval_s: Optional[float] = None,
+        fail_on_timeout: bool = False,
+        max_args_length: int = 200,
+        max_reports: int = 100,
+        logger: Optional[Logger] = None,
+    ):
+        """
+        Construct a new CommandWatchdog.
+
+        Args:
+            threshold_s (float, optional): Threshold of command types without a specific one, in seconds. Defaults to 1.0.
+            thresholds (Optional[dict[Type[Command], float]], optional): Thresholds by command type, subclasses inherit the threshold of their closest listed base class. Defaults to None.
+            check_interval_s (Optional[float], optional): How often the watchdog thread checks the executions, None for a quarter of the smallest threshold. Defaults to None.
+            fail_on_timeout (bool, optional): Let queues that execute commands concurrently mark slow commands FAILED. Defaults to False.
+            max_args_length (int, optional): Maximum length of the args summary. Defaults to 200.
+            max_reports (int, optional): Number of most recent reports kept in `slow_executions`. Defaults to 100.
+            logger (Optional[Logger], optional): Logger to report slow executions to. Defaults to this module's logger.
+
+        Raises:
+            ValueError: If a threshold or `check_interval_s` is not positive.
+        """
+        self._thresholds = dict(thresholds or {})
+        if threshold_s <= 0 or any(value <= 0 for value in self._thresholds.values()):
+            raise ValueError("Watchdog thresholds must be positive.")
+        if check_interval_s is None:
+            check_interval_s = min([threshold_s, *self._thresholds.values()]) / 4
+        if check_interval_s <= 0:
+            raise ValueError(f"check_interval_s must be positive, got {check_interval_s}.")
+        self._threshold_s = threshold_s
+        self._check_interval_s = check_interval_s
+        self._fail_on_timeout = fail_on_timeout
+        self.max_args_length = max_args_length
+        self._logger = logger or getLogger(__name__)
+        self._condition = Condition()
+        self._watched: set[_WatchedExecution] = set()
+        self._slow_executions: deque[SlowExecution] = deque(maxlen=max_reports)
+        self._thread: Optional[Thread] = None
+        # bumped by stop(), a thread exits once the generation it was started for is over
+        self._generation = 0
+
+    @property
+    def fail_on_timeout(self) -> bool:
+        """Whether queues that execute commands concurrently mark slow commands FAILED."""
+        return self._fail_on_timeout
+
+    def threshold_for(self, command_type: Type["Command[Any, Any]"]) -> float:
+        """
+        Get the threshold of a command type.
+
+        Args:
+            command_type (Type[Command]): The command type.
+
+        Returns:
+            float: The threshold in seconds.
+        """
+        for base in command_type.__mro__:
+            if base in self._thresholds:
+                return self._thresholds[base]
+        return self._threshold_s
+
+    @property
+    def slow_executions(self) -> list[SlowExecution]:
+        """
+        The most recent slow executions, oldest first.
+
+        Returns:
+            list[SlowExecution]: A copy of the reports.
+        """
+        with self._condition:
+            return list(self._slow_executions)
+
+    def _watch(
+        self,
+        command: "Command[Any, Any]",
+        metrics: Optional["QueueMetrics"],
+        thread_id: Optional[int],
+    ) -> _WatchedExecution:
+        """Start watching an execution, called by the queue right before it starts."""
+        now = perf_counter()
+        watched = _WatchedExecution(
+            command=command,
+            started_at=now,
+            deadline=now + self.threshold_for(command.__class__),
+            thread_id=thread_id,
+            metrics=metrics,
+        )
+        with self._condition:
+            self._watched.add(watched)
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, args=(self._generation,), name="CommandWatchdog", daemon=True
+                )
+                self._thread.start()
+        return watched
+
+    def _unwatch(self, watched: _WatchedExecution) -> None:
+        """Stop watching an execution, called by the queue once it finished."""
+        with self._condition:
+            self._watched.discard(watched)
+
+    def _run(self, generation: int) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait(self._check_interval_s)
+                if self._generation != generation:
+                    return
+                now = perf_counter()
+                overdue = [
+                    watched for watched in self._watched if not watched.reported and now >= watched.deadline
+                ]
+                for watched in overdue:
+                    watched.reported = True
+                    # only executions in another process can be abandoned
+                    watched.timed_out = self._fail_on_timeout and watched.thread_id is None
+            if overdue:
+                frames = sys._current_frames()
+                for watched in overdue:
+                    self._report(watched, now, frames)
+
+    def _report(self, watched: _WatchedExecution, now: float, frames: dict[int, Any]) -> None:
+        """Log, count and keep a slow execution."""
+        command_type = watched.command.__class__
+        args = repr(watched.command.args)
+        if len(args) > self.max_args_length:
+            args = args[: self.max_args_length - 3] + "..."
+        frame = frames.get(watched.thread_id) if watched.thread_id is not None else None
+        stack = "".join(format_stack(frame)) if frame is not None else None
+        slow_execution = SlowExecution(
+            command_type=command_type,
+            args=args,
+            threshold_s=watched.deadline - watched.started_at,
+            elapsed_s=now - watched.started_at,
+            stack=stack,
+            timed_out=watched.timed_out,
+        )
+        with self._condition:
+            self._slow_executions.append(slow_execution)
+        if watched.metrics is not None:
+            watched.metrics.record_slow_command(command_type_name(command_type))
+        self._logger.warning(
+            "%s has been executing for %.3fs (threshold %.3fs)%s, args: %s\n%s",
+            command_type.__qualname__,
+            slow_execution.elapsed_s,
+            slow_execution.threshold_s,
+            ", marking it FAILED" if watched.timed_out else "",
+            args,
+            stack if stack is not None else "(executing in another process, no stack available)",
+        )
+
+    def stop(self) -> None:
+        """Stop the watchdog thread. It is started again by the next execution it watches."""
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self._generation += 1
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def __enter__(self) -> "CommandWatchdog":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.stop()
@@ -1,11 +1,37 @@
 from .Command import Command, CommandArgs
 from .CommandLifecycle import (
+    CallbackRecord,
+    CallbackRecordPolicy,
     CancelResponse,
     DeferResponse,
     ExecutionResponse,
     ReasonByCommandMethod,
+    ReasonByCancellation,
+    ReasonByTimeout,
+    ReasonByAdmissionControl,
 )
+from .Cancellation import CancellationToken, CommandCanceledError
 from .CommandQueue import CommandQueue, QueueProcessResponse, CommandTimingData
+from .CommandJournal import CommandJournal
+from .Tracing import InMemoryTracer, RecordedSpan, Span, Tracer
+from .Metrics import QueueMetrics
+from .Profiling import ExecutionEstimate, ProfiledExecution, SamplingProfiler
+from .Watchdog import CommandWatchdog, SlowExecution
+from .RateLimiting import RateLimit, RateLimiter
+from .AdmissionControl import AdmissionBudget, AdmissionController
+from .CallbackDispatch import (
+    AsyncioCallbackDispatcher,
+    CallbackDispatcher,
+    ExecutorCallbackDispatcher,
+)
+from .ThreadSafeCommandQueue import ThreadSafeCommandQueue
+from .ShardedCommandQueue import ShardedCommandQueue
+from .RemoteCommandQueue import (
+    PipeTransport,
+    RemoteCommandQueue,
+    RemoteTransport,
+    run_remote_worker,
+)
 from .CommandResponse import CommandResponse, ResponseStatus
 from .Dependencies import (
     DependencyAction,
@@ -13,7 +39,19 @@ from .Dependencies import (
     DependencyEntry,
     ReasonByDependencyCheck,
 )
-from .CommandChain import CommandChain, CommandChainArgs, CommandChainResponse, CommandChainBuilder
+from .CommandChain import (
+    CommandChain,
+    CommandChainArgs,
+    CommandChainResponse,
+    CommandChainBuilder,
+    CommandChainLink,
+    CommandChainMapLink,
+    CommandChainLocalLink,
+    CommandChainStopLink,
+    CommandChainBranchLink,
+    ChainTemplate,
+)
+from .ChainPipeline import ChainPipeline, PipelineResult
 
 __all__ = [
     # Basic command components
@@ -25,13 +63,54 @@ __all__ = [
     "DeferResponse",
     "CancelResponse",
     "ExecutionResponse",
+    "CallbackRecord",
+    "CallbackRecordPolicy",
     # Lifecycle response reasons
     "ReasonByCommandMethod",
     "ReasonByDependencyCheck",
+    "ReasonByTimeout",
+    "ReasonByCancellation",
+    "ReasonByAdmissionControl",
+    # Cancellation
+    "CancellationToken",
+    "CommandCanceledError",
     # Queueing components
     "CommandQueue",
+    "ThreadSafeCommandQueue",
+    "ShardedCommandQueue",
+    # Remote execution
+    "RemoteCommandQueue",
+    "RemoteTransport",
+    "PipeTransport",
+    "run_remote_worker",
     "QueueProcessResponse",
     "CommandTimingData",
+    # Persistence
+    "CommandJournal",
+    # Tracing
+    "Tracer",
+    "Span",
+    "InMemoryTracer",
+    "RecordedSpan",
+    # Metrics
+    "QueueMetrics",
+    # Profiling
+    "SamplingProfiler",
+    "ExecutionEstimate",
+    "ProfiledExecution",
+    # Watchdog
+    "CommandWatchdog",
+    "SlowExecution",
+    # Rate limiting
+    "RateLimit",
+    "RateLimiter",
+    # Admission control
+    "AdmissionController",
+    "AdmissionBudget",
+    # Callback dispatch
+    "CallbackDispatcher",
+    "ExecutorCallbackDispatcher",
+    "AsyncioCallbackDispatcher",
     # Dependency management
     "DependencyEntry",
     "DependencyCheckResponse",
@@ -41,4 +120,12 @@ __all__ = [
     "CommandChainArgs",
     "CommandChainResponse",
     "CommandChainBuilder",
+    "CommandChainLink",
+    "CommandChainMapLink",
+    "CommandChainLocalLink",
+    "CommandChainStopLink",
+    "CommandChainBranchLink",
+    "ChainTemplate",
+    "ChainPipeline",
+    "PipelineResult",
 ]
@@ -0,0 +1,98 @@
+import pytest
+
+from command_system import (
+    AdmissionController,
+    CommandQueue,
+    ReasonByAdmissionControl,
+    ResponseStatus,
+    ShardedCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_profiling import SleepArgs, SleepCommand
+
+
+def test_no_limits_until_overloaded():
+    controller = AdmissionController(target_latency_ms=1000)
+    queue = CommandQueue(admission_controller=controller)
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(50)))
+    response = queue.process_once()
+    assert response.num_successes == 50
+    assert response.num_delayed == 0
+    assert controller.budgets()[AddOneCommand].budget == 1000
+
+
+def test_slow_type_is_delayed_while_fast_type_runs():
+    controller = AdmissionController(latency_targets={SleepCommand: 5})
+    queue = CommandQueue(admission_controller=controller)
+    queue.submit_many(*(SleepCommand(SleepArgs(seconds=0.01)) for _ in range(4)))
+    queue.process_once()
+    # 4 slow executions over their target, the budget drops to half of what the pass used
+    assert controller.budgets()[SleepCommand].budget == 2
+    queue.submit_many(*(SleepCommand(SleepArgs(seconds=0.01)) for _ in range(4)))
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(10)))
+    response = queue.process_once()
+    assert response.num_delayed == 2
+    assert response.num_successes == 12
+    assert controller.budgets()[SleepCommand].budget == 1
+    assert queue.process_all().num_successes == 2
+
+
+def test_budget_recovers_additively():
+    controller = AdmissionController(max_failure_rate=0.5, smoothing=1.0, max_budget=4)
+    queue = CommandQueue(admission_controller=controller)
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=0, should_fail=True)) for _ in range(4)))
+    queue.process_once()
+    assert controller.budgets()[AddOneCommand].budget == 2
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(20)))
+    budgets = []
+    while len(queue) > 0:
+        queue.process_once()
+        budgets.append(controller.budgets()[AddOneCommand].budget)
+    assert budgets[:3] == [3, 4, 4]
+
+
+def test_pass_target_throttles_the_most_expensive_type():
+    controller = AdmissionController(target_pass_ms=15)
+    queue = CommandQueue(admission_controller=controller)
+    queue.submit_many(*(SleepCommand(SleepArgs(seconds=0.01)) for _ in range(4)))
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(4)))
+    queue.process_once()
+    budgets = controller.budgets()
+    assert budgets[SleepCommand].budget == 2
+    assert budgets[AddOneCommand].budget == 1000
+
+
+def test_shed_cancels_commands_over_budget():
+    controller = AdmissionController(target_latency_ms=5, shed=True)
+    queue = CommandQueue(admission_controller=controller)
+    queue.submit_many(*(SleepCommand(SleepArgs(seconds=0.01)) for _ in range(2)))
+    queue.process_once()
+    responses = queue.submit_many(*(SleepCommand(SleepArgs(seconds=0.01)) for _ in range(3)))
+    queue_response = queue.process_once()
+    assert [response.status for response in responses] == [
+        ResponseStatus.COMPLETED,
+        ResponseStatus.CANCELED,
+        ResponseStatus.CANCELED,
+    ]
+    assert queue_response.num_cancellations == 2
+    assert isinstance(queue_response.command_log[-1].responses[-1].reason, ReasonByAdmissionControl)
+
+
+def test_shared_between_shards():
+    controller = AdmissionController(target_latency_ms=1000)
+    queue = ShardedCommandQueue(num_shards=2, admission_controller=controller)
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(40)))
+    assert queue.process_all().num_successes == 40
+    assert controller.budgets()[AddOneCommand].executions == 40
+
+
+def test_rejects_invalid_arguments():
+    with pytest.raises(ValueError):
+        AdmissionController(min_budget=0)
+    with pytest.raises(ValueError):
+        AdmissionController(min_budget=5, max_budget=4)
+    with pytest.raises(ValueError):
+        AdmissionController(decrease=1)
+    with pytest.raises(ValueError):
+        AdmissionController(max_failure_rate=1)
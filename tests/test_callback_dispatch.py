@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+
+from command_system import (
+    AsyncioCallbackDispatcher,
+    CommandChainBuilder,
+    CommandQueue,
+    ExecutorCallbackDispatcher,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_defer_cancel import ExternalSystem, WaitToHelloArgs, WaitToHelloCommand
+
+
+def test_slow_callbacks_do_not_hold_up_the_queue():
+    dispatcher = ExecutorCallbackDispatcher(max_workers=4)
+    queue = CommandQueue(callback_dispatcher=dispatcher)
+    commands = [AddOneCommand(AddOneArgs(number=i)) for i in range(8)]
+    for command in commands:
+        command.add_on_execute_callback(lambda _: time.sleep(0.1))
+        command.add_on_execute_callback(lambda _: None)
+    queue.submit_many(*commands)
+    start = time.perf_counter()
+    queue_response = queue.process_all()
+    assert time.perf_counter() - start < 0.1
+    assert dispatcher.wait_idle(timeout=5)
+    dispatcher.shutdown()
+    # callback records are filled in as the callbacks complete
+    execution_responses = [entry.responses[-1] for entry in queue_response.command_log]
+    assert len(execution_responses) == 8
+    for execution_response in execution_responses:
+        assert len(execution_response.executed_callbacks) == 2
+        assert all(record.succeeded for record in execution_response.executed_callbacks)
+
+
+def test_callbacks_keep_their_order_per_command():
+    dispatcher = ExecutorCallbackDispatcher(max_workers=4)
+    queue = CommandQueue(callback_dispatcher=dispatcher)
+    external_system = ExternalSystem()
+    events: dict[int, list[str]] = {}
+    commands = [WaitToHelloCommand(WaitToHelloArgs(external_system)) for _ in range(5)]
+    for index, command in enumerate(commands):
+        log = events.setdefault(index, [])
+        command.add_on_defer_callback(lambda _, log=log: (time.sleep(0.01), log.append("defer")))
+        command.add_on_execute_callback(lambda _, log=log: log.append("execute 1"))
+        command.add_on_execute_callback(lambda _, log=log: log.append("execute 2"))
+    queue.submit_many(*commands)
+    queue.process_once()
+    queue.process_once()
+    external_system.name = "World"
+    queue.process_all()
+    assert dispatcher.wait_idle(timeout=5)
+    dispatcher.shutdown()
+    assert all(log == ["defer", "defer", "execute 1", "execute 2"] for log in events.values())
+
+
+def test_inline_callbacks_and_chains_run_on_the_processing_thread():
+    dispatcher = ExecutorCallbackDispatcher(max_workers=1)
+    queue = CommandQueue(callback_dispatcher=dispatcher)
+    threads: list[str] = []
+    command = AddOneCommand(AddOneArgs(number=0))
+    command.add_on_execute_callback(lambda _: threads.append(threading.current_thread().name), inline=True)
+    queue.submit(command)
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(1, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .build(queue)
+    )
+    chain_response = queue.submit(chain)
+    queue.process_all()
+    assert threads == [threading.current_thread().name]
+    assert chain_response.output_data == 3
+    dispatcher.shutdown()
+
+
+def test_inline_is_set_per_registration():
+    dispatcher = ExecutorCallbackDispatcher(max_workers=1)
+    queue = CommandQueue(callback_dispatcher=dispatcher)
+    external_system = ExternalSystem()
+    threads: list[str] = []
+
+    def record_thread(_) -> None:
+        threads.append(threading.current_thread().name)
+
+    command = WaitToHelloCommand(WaitToHelloArgs(external_system))
+    command.add_on_defer_callback(record_thread, inline=True)
+    command.add_on_execute_callback(record_thread)
+    queue.submit(command)
+    queue.process_once()
+    external_system.name = "World"
+    queue.process_all()
+    assert dispatcher.wait_idle(timeout=5)
+    dispatcher.shutdown()
+    assert threads[0] == threading.current_thread().name
+    assert threads[1] != threading.current_thread().name
+
+
+def test_asyncio_dispatcher():
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever)
+    loop_thread.start()
+    try:
+        queue = CommandQueue(callback_dispatcher=AsyncioCallbackDispatcher(loop))
+        done = threading.Event()
+        threads: list[int] = []
+        command = AddOneCommand(AddOneArgs(number=0))
+        command.add_on_execute_callback(lambda _: threads.append(threading.get_ident()))
+        command.add_on_execute_callback(lambda _: done.set())
+        queue.submit(command)
+        queue.process_all()
+        assert done.wait(timeout=5)
+        assert threads == [loop_thread.ident]
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+
+
+def test_a_raising_batch_does_not_stop_the_others():
+    dispatcher = ExecutorCallbackDispatcher(max_workers=1)
+    command = AddOneCommand(AddOneArgs(number=0))
+    ran: list[str] = []
+
+    def interrupt() -> None:
+        raise KeyboardInterrupt
+
+    def fail() -> None:
+        raise ValueError("batch failed")
+
+    dispatcher.dispatch(command, lambda: time.sleep(0.05))
+    dispatcher.dispatch(command, interrupt)
+    dispatcher.dispatch(command, lambda: ran.append("after interrupt"))
+    dispatcher.dispatch(command, fail)
+    dispatcher.dispatch(command, lambda: ran.append("after failure"))
+    assert dispatcher.wait_idle(timeout=2)
+    dispatcher.shutdown()
+    assert ran == ["after interrupt", "after failure"]
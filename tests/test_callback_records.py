@@ -0,0 +1,79 @@
+import gc
+
+import pytest
+
+from command_system import CallbackRecordPolicy, CommandQueue, ExecutionResponse
+
+from test_command_chain import AddOneArgs, AddOneCommand
+
+
+def failing_callback(response: ExecutionResponse) -> None:
+    raise ValueError("callback failed")
+
+
+def succeeding_callback(response: ExecutionResponse) -> None:
+    pass
+
+
+def run(queue: CommandQueue, command: AddOneCommand) -> ExecutionResponse:
+    command.add_on_execute_callback(succeeding_callback)
+    command.add_on_execute_callback(failing_callback)
+    queue.submit(command)
+    return queue.process_all().command_log[-1].responses[-1]
+
+
+def test_records_everything_by_default():
+    response = run(CommandQueue(), AddOneCommand(AddOneArgs(number=0)))
+    assert [record.callback for record in response.executed_callbacks] == [succeeding_callback, failing_callback]
+    assert response.executed_callbacks[1].errored
+    assert response.executed_callbacks[1].error.__traceback__ is not None
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [(CallbackRecordPolicy.NONE, 0), (CallbackRecordPolicy.ERRORS_ONLY, 1), (CallbackRecordPolicy.ERRORS_STRIPPED, 1)],
+)
+def test_queue_policy(policy, expected):
+    response = run(CommandQueue(callback_record_policy=policy), AddOneCommand(AddOneArgs(number=0)))
+    assert len(response.executed_callbacks) == expected
+    if policy is CallbackRecordPolicy.ERRORS_ONLY:
+        assert response.executed_callbacks[0].callback is failing_callback
+    if policy is CallbackRecordPolicy.ERRORS_STRIPPED:
+        [record] = response.executed_callbacks
+        assert record.callback is None
+        assert record.callback_name == "failing_callback"
+        assert isinstance(record.error, ValueError)
+        assert record.error.__traceback__ is None
+
+
+def test_command_policy_takes_precedence():
+    command = AddOneCommand(AddOneArgs(number=0))
+    command.callback_record_policy = CallbackRecordPolicy.ALL
+    response = run(CommandQueue(callback_record_policy=CallbackRecordPolicy.NONE), command)
+    assert len(response.executed_callbacks) == 2
+
+
+class Owner:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def on_execute(self, response: ExecutionResponse) -> None:
+        self.calls += 1
+
+
+def test_weak_callbacks():
+    queue = CommandQueue()
+    kept, dropped = Owner(), Owner()
+    first = AddOneCommand(AddOneArgs(number=0))
+    first.add_on_execute_callback(kept.on_execute, weak=True)
+    second = AddOneCommand(AddOneArgs(number=0))
+    second.add_on_execute_callback(dropped.on_execute, weak=True)
+    dropped_calls = dropped.calls
+    del dropped
+    gc.collect()
+    queue.submit_many(first, second)
+    queue_response = queue.process_all()
+    assert kept.calls == 1
+    assert dropped_calls == 0
+    # a callback that was garbage collected is skipped without a record
+    assert len(queue_response.command_log[1].responses[-1].executed_callbacks) == 0
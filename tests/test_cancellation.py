@@ -0,0 +1,112 @@
+import threading
+import time
+from dataclasses import dataclass
+
+from command_system import (
+    CancelResponse,
+    Command,
+    CommandArgs,
+    CommandQueue,
+    CommandResponse,
+    ExecutionResponse,
+    ReasonByCancellation,
+    ReasonByTimeout,
+    RemoteCommandQueue,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_profiling import SleepArgs, SleepCommand
+
+
+@dataclass
+class PollArgs(CommandArgs):
+    started: threading.Event
+    iterations: int = 1000
+
+
+class PollCommand(Command[PollArgs, CommandResponse]):
+    """Does its work in small steps, checking its cancellation token in between."""
+
+    ARGS = PollArgs
+    _response_type = CommandResponse
+
+    def execute(self) -> ExecutionResponse:
+        self.args.started.set()
+        for _ in range(self.args.iterations):
+            self.cancellation_token.raise_if_canceled()
+            time.sleep(0.005)
+        return ExecutionResponse.success()
+
+
+def test_cancel_before_execution():
+    queue = CommandQueue()
+    command = AddOneCommand(AddOneArgs(number=1))
+    cancel_responses: list[CancelResponse] = []
+    command.add_on_cancel_callback(cancel_responses.append)
+    queue.submit(command)
+    assert queue.cancel(command, reason="not needed anymore")
+    assert not queue.cancel(command)
+    queue_response = queue.process_all()
+    assert command.response.status == ResponseStatus.CANCELED
+    assert command.response.result == 0
+    assert queue_response.num_cancellations == 1
+    assert cancel_responses[0].reason == ReasonByCancellation("not needed anymore")
+    assert not queue.cancel(command)
+
+
+def test_cancel_while_executing():
+    queue = ThreadSafeCommandQueue()
+    started = threading.Event()
+    command = PollCommand(PollArgs(started))
+    execute_responses: list[ExecutionResponse] = []
+    command.add_on_execute_callback(execute_responses.append)
+    queue.submit(command)
+    worker = threading.Thread(target=queue.process_all)
+    worker.start()
+    assert started.wait(timeout=5)
+    assert queue.cancel(command)
+    worker.join(timeout=5)
+    assert command.response.status == ResponseStatus.FAILED
+    assert execute_responses[0].reason == ReasonByCancellation("Canceled with CommandQueue.cancel()")
+    assert command.cancellation_token.is_canceled
+
+
+def test_command_timeout():
+    command = PollCommand(PollArgs(threading.Event()))
+    command.timeout_s = 0.05
+    queue = CommandQueue()
+    queue.submit(command)
+    start = time.perf_counter()
+    queue_response = queue.process_all()
+    assert time.perf_counter() - start < 1
+    assert command.response.status == ResponseStatus.FAILED
+    assert isinstance(queue_response.command_log[-1].responses[-1].reason, ReasonByTimeout)
+
+
+def test_queue_timeout_applies_to_uncooperative_commands():
+    queue = CommandQueue(execution_timeout_s=0.02)
+    slow = queue.submit(SleepCommand(SleepArgs(seconds=0.1)))
+    fast = queue.submit(SleepCommand(SleepArgs(seconds=0)))
+    queue.process_all()
+    # `execute()` could not be interrupted, but its result is discarded
+    assert slow.status == ResponseStatus.FAILED
+    assert fast.status == ResponseStatus.COMPLETED
+
+
+def test_remote_timeout_and_cancel():
+    with RemoteCommandQueue.with_local_workers(num_workers=2, batch_size=1) as queue:
+        timed = SleepCommand(SleepArgs(seconds=0.5))
+        timed.timeout_s = 0.05
+        canceled = SleepCommand(SleepArgs(seconds=0.5))
+        queue.submit_many(timed, canceled)
+        queue.process_once()  # both are sent to a worker
+        assert queue.cancel(canceled)
+        start = time.perf_counter()
+        queue_response = queue.process_all()
+        assert time.perf_counter() - start < 0.4
+    assert timed.response.status == ResponseStatus.FAILED
+    assert canceled.response.status == ResponseStatus.FAILED
+    reasons = {type(entry.responses[-1].reason) for entry in queue_response.command_log}
+    assert reasons == {ReasonByTimeout, ReasonByCancellation}
@@ -0,0 +1,108 @@
+from command_system import (
+    CommandChainBuilder,
+    CommandQueue,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+
+
+def test_map_reduce():
+    queue = CommandQueue()
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .gather(lambda x: range(x, x + 4))
+        .map(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .reduce(lambda total, x: total + x, 0)
+        .build(queue)
+    )
+    queue.submit(chain)
+    response = queue.process_all()
+    assert chain.response.status == ResponseStatus.COMPLETED
+    assert response.num_commands_processed == 1 + 1 + 4
+    assert chain.response.intermediate_results[2] == [2, 3, 4, 5]
+    assert chain.response.output_data == 14
+
+
+def test_map_branches_are_submitted_together():
+    # on a ThreadSafeCommandQueue every branch lands in the inbox at once, so they all run in the same pass
+    queue = ThreadSafeCommandQueue()
+    chain = (
+        CommandChainBuilder[list[int], list[int]]
+        .start([1, 2, 3], lambda xs: AddOneArgs(number=0), AddOneCommand, lambda response: [1, 2, 3])
+        .map(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .build(queue)
+    )
+    queue.submit(chain)
+    queue.process_once()  # chain
+    queue.process_once()  # first link
+    response = queue.process_once()  # all branches
+    assert response.num_successes == 3
+    assert chain.response.output_data == [2, 3, 4]
+
+
+def test_map_over_empty_input():
+    queue = CommandQueue()
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: [])
+        .map(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .reduce(lambda total, x: total + x, 0)
+        .build(queue)
+    )
+    queue.submit(chain)
+    queue.process_all()
+    assert chain.response.output_data == 0
+
+
+def test_map_branch_failure_fails_chain():
+    queue = CommandQueue()
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: [1, 2, 3])
+        .map(
+            lambda x: AddOneArgs(number=x, should_fail=x == 2),
+            AddOneCommand,
+            lambda response: response.result,
+        )
+        .reduce(lambda total, x: total + x, 0)
+        .build(queue)
+    )
+    queue.submit(chain)
+    queue.process_all()
+    assert chain.response.status == ResponseStatus.FAILED
+    assert chain.response.output_data is None
+
+
+def test_map_branch_cancellation_fails_chain():
+    queue = CommandQueue()
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: [1, 2])
+        .map(
+            lambda x: AddOneArgs(number=x, should_cancel=x == 1),
+            AddOneCommand,
+            lambda response: response.result,
+        )
+        .build(queue)
+    )
+    queue.submit(chain)
+    queue.process_all()
+    assert chain.response.status == ResponseStatus.FAILED
+    assert chain.response.output_data is None
+
+
+def test_same_pass_map_reduce():
+    queue = CommandQueue()
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: [1, 2, 3])
+        .map(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .gather(sum)
+        .build(queue, same_pass=True)
+    )
+    queue.submit(chain)
+    queue.process_once()
+    assert chain.response.output_data == 9
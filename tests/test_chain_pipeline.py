@@ -0,0 +1,159 @@
+from dataclasses import dataclass, field
+import time
+
+import pytest
+
+from command_system import (
+    ChainPipeline,
+    Command,
+    CommandArgs,
+    CommandChainBuilder,
+    CommandResponse,
+    ExecutionResponse,
+    RemoteCommandQueue,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+
+
+@dataclass
+class StageArgs(CommandArgs):
+    number: int
+    stage: int
+    in_flight: dict[int, list[int]] = field(default_factory=dict)
+
+
+class StageCommand(Command[StageArgs, CommandResponse]):
+    ARGS = StageArgs
+    _response_type = CommandResponse
+
+    def execute(self) -> ExecutionResponse:
+        return ExecutionResponse.success()
+
+
+@dataclass
+class SleepArgs(CommandArgs):
+    number: int
+    seconds: float
+
+
+@dataclass
+class SleepResponse(CommandResponse):
+    result: int = 0
+
+
+class SleepCommand(Command[SleepArgs, SleepResponse]):
+    ARGS = SleepArgs
+    _response_type = SleepResponse
+
+    def execute(self) -> ExecutionResponse:
+        time.sleep(self.args.seconds)
+        self.response.result = self.args.number
+        return ExecutionResponse.success()
+
+
+def add_three():
+    return (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .gather(lambda x: x * 10)
+        .then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+    )
+
+
+def test_pipeline_results():
+    queue = ThreadSafeCommandQueue()
+    pipeline = ChainPipeline(add_three().compile(), queue, max_in_flight=4)
+    results = list(pipeline.run(range(50)))
+    assert len(results) == 50
+    assert all(result.status == ResponseStatus.COMPLETED for result in results)
+    assert sorted((result.index, result.output_data) for result in results) == [
+        (i, (i + 2) * 10 + 1) for i in range(50)
+    ]
+    assert len(queue) == 0
+
+
+class RecordingQueue(ThreadSafeCommandQueue):
+    def __init__(self):
+        super().__init__()
+        self.passes: list[int] = []
+
+    def process_once(self, max_iterations: int = 1000):
+        response = super().process_once(max_iterations)
+        self.passes.append(response.num_successes)
+        return response
+
+
+def test_pipeline_stages_overlap_with_bounded_in_flight():
+    queue = RecordingQueue()
+    pipeline = ChainPipeline(add_three(), queue, max_in_flight=3)
+    pulled: list[int] = []
+
+    def source():
+        for i in range(30):
+            pulled.append(i)
+            yield i
+
+    results = pipeline.run(source())
+    next(results)
+    # inputs are pulled lazily, as the first stage makes room
+    assert len(pulled) < 30
+    assert len(list(results)) + 1 == 30
+    # never more than max_in_flight commands per stage, and once the pipeline is full all 3 stages run every pass
+    assert max(queue.passes) == 3 * 3
+    assert queue.passes.count(9) >= 5
+
+
+def test_pipeline_failed_inputs():
+    queue = ThreadSafeCommandQueue()
+    chain = CommandChainBuilder[int, int].start(
+        0,
+        lambda x: AddOneArgs(number=x, should_fail=x % 2 == 1),
+        AddOneCommand,
+        lambda response: response.result,
+    ).then(lambda x: AddOneArgs(number=x, should_cancel=x == 5), AddOneCommand, lambda r: r.result)
+    results = {result.index: result for result in ChainPipeline(chain, queue).run(range(10))}
+    assert [i for i, result in sorted(results.items()) if result.status == ResponseStatus.FAILED] == [
+        1, 3, 4, 5, 7, 9,
+    ]
+    assert results[0].output_data == 2
+
+
+def test_pipeline_raising_user_code_fails_the_input():
+    def extract(response):
+        if response.result == 3:
+            raise RuntimeError("extractor")
+        return response.result
+
+    chain = CommandChainBuilder[int, int].start(
+        0, lambda x: AddOneArgs(number=x), AddOneCommand, extract
+    ).then(lambda x: AddOneArgs(number=x) if x != 4 else 1 / 0, AddOneCommand, lambda r: r.result)
+    results = {result.index: result for result in ChainPipeline(chain, ThreadSafeCommandQueue()).run(range(5))}
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    assert [i for i, result in sorted(results.items()) if result.status == ResponseStatus.FAILED] == [2, 3]
+    assert results[4].output_data == 6
+
+
+def test_pipeline_rejects_map_links():
+    chain = add_three().map(lambda x: AddOneArgs(number=x), AddOneCommand, lambda r: r.result)  # type: ignore
+    with pytest.raises(ValueError):
+        ChainPipeline(chain, ThreadSafeCommandQueue())
+
+
+def test_pipeline_throughput_approaches_slowest_stage():
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: SleepArgs(number=x, seconds=0.01), SleepCommand, lambda r: r.result)
+        .then(lambda x: SleepArgs(number=x, seconds=0.02), SleepCommand, lambda r: r.result)
+    )
+    with RemoteCommandQueue.with_local_workers(4, batch_size=1) as queue:
+        pipeline = ChainPipeline(chain, queue, max_in_flight=2)
+        start = time.perf_counter()
+        results = list(pipeline.run(range(16)))
+        elapsed = time.perf_counter() - start
+    assert sorted(result.output_data for result in results) == list(range(16))
+    # sequentially this takes 16 * 0.03 = 0.48s
+    assert elapsed < 0.4
@@ -0,0 +1,75 @@
+import pytest
+
+from command_system import (
+    CommandChainBuilder,
+    CommandQueue,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_defer_cancel import ExternalSystem, WaitToHelloArgs, WaitToHelloCommand
+
+
+def build_chain(queue: CommandQueue, length: int, same_pass: bool):
+    builder = CommandChainBuilder[int, int].start(
+        0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result
+    )
+    for _ in range(length - 1):
+        builder = builder.then(
+            lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result
+        )
+    return builder.build(queue, same_pass=same_pass)
+
+
+@pytest.mark.parametrize("queue_type", [CommandQueue, ThreadSafeCommandQueue])
+def test_same_pass_chain_completes_in_one_pass(queue_type: type[CommandQueue]):
+    queue = queue_type()
+    others = [queue.submit(AddOneCommand(AddOneArgs(number=i))) for i in range(100)]
+    chain = build_chain(queue, 20, same_pass=True)
+    queue.submit(chain)
+    response = queue.process_once()
+    assert chain.response.status == ResponseStatus.COMPLETED
+    assert chain.response.output_data == 20
+    assert response.num_commands_processed == 100 + 1 + 20
+    assert all(other.status == ResponseStatus.COMPLETED for other in others)
+    assert len(queue) == 0
+
+
+def test_default_chain_needs_a_pass_per_link():
+    # links submitted from a callback wait in the inbox until the next pass
+    queue = ThreadSafeCommandQueue()
+    chain = build_chain(queue, 20, same_pass=False)
+    queue.submit(chain)
+    for _ in range(20):
+        queue.process_once()
+        assert chain.response.output_data is None
+    queue.process_once()
+    assert chain.response.output_data == 20
+    assert chain.response.output_data == 20
+
+
+def test_same_pass_chain_respects_max_iterations():
+    queue = CommandQueue()
+    chain = build_chain(queue, 10, same_pass=True)
+    queue.submit(chain)
+    response = queue.process_once(max_iterations=5)
+    assert response.reached_max_iterations
+    assert response.num_commands_processed == 5
+    assert len(queue) == 1  # the next link waits in the fast lane
+    queue.process_once()
+    assert chain.response.output_data == 10
+
+
+def test_deferred_fast_lane_command_moves_to_back_of_queue():
+    queue = ThreadSafeCommandQueue()
+    external_system = ExternalSystem()
+    deferred = WaitToHelloCommand(WaitToHelloArgs(external_system))
+    queue.submit_next(deferred)
+    response = queue.process_once()
+    assert response.num_deferrals == 1
+    assert len(queue) == 1
+    external_system.name = "World"
+    queue.process_once()
+    assert deferred.response.status == ResponseStatus.COMPLETED
+    assert len(queue) == 0
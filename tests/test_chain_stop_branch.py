@@ -0,0 +1,78 @@
+from command_system import (
+    ChainPipeline,
+    CommandChainBuilder,
+    CommandChainLink,
+    CommandQueue,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+
+
+def add_one(x: int) -> AddOneArgs:
+    return AddOneArgs(number=x)
+
+
+def result(response) -> int:
+    return response.result
+
+
+def chain_with_stop():
+    builder = CommandChainBuilder[int, int].start(0, add_one, AddOneCommand, result).stop_if(
+        lambda x: x > 5
+    )
+    for _ in range(10):
+        builder = builder.then(add_one, AddOneCommand, result)
+    return builder
+
+
+def test_stop_if_skips_remaining_links():
+    queue = CommandQueue()
+    chain = chain_with_stop().compile().instantiate(10, queue)
+    queue.submit(chain)
+    response = queue.process_all()
+    assert chain.response.status == ResponseStatus.COMPLETED
+    assert chain.response.output_data == 11
+    assert response.num_commands_processed == 2  # chain + first link
+
+
+def test_stop_if_continues_when_false():
+    queue = CommandQueue()
+    chain = chain_with_stop().build(queue)
+    queue.submit(chain)
+    response = queue.process_all()
+    assert chain.response.output_data == 11
+    assert response.num_commands_processed == 12
+
+
+def test_branch_selects_command():
+    double = CommandChainLink(lambda x: AddOneArgs(number=x * 2 - 1), AddOneCommand, result)
+    fail = CommandChainLink(lambda x: AddOneArgs(number=x, should_fail=True), AddOneCommand, result)
+    builder = (
+        CommandChainBuilder[int, int]
+        .start(0, add_one, AddOneCommand, result)
+        .branch(lambda x: double if x % 2 == 0 else fail)
+    )
+    queue = CommandQueue()
+    template = builder.compile()
+    even, odd = template.instantiate(1, queue), template.instantiate(0, queue)
+    queue.submit_many(even, odd)
+    queue.process_all()
+    assert even.response.output_data == 4
+    assert odd.response.status == ResponseStatus.FAILED
+
+
+def test_pipeline_stop_and_branch():
+    queue = ThreadSafeCommandQueue()
+    double = CommandChainLink(lambda x: AddOneArgs(number=x * 2 - 1), AddOneCommand, result)
+    builder = (
+        CommandChainBuilder[int, int]
+        .start(0, add_one, AddOneCommand, result)
+        .stop_if(lambda x: x > 5)
+        .branch(lambda x: double)
+    )
+    results = sorted(
+        (r.index, r.output_data) for r in ChainPipeline(builder.compile(), queue).run(range(8))
+    )
+    assert results == [(i, (i + 1) * 2 if i + 1 <= 5 else i + 1) for i in range(8)]
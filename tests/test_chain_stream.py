@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+from command_system import (
+    CommandChainBuilder,
+    CommandQueue,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+
+
+def add_one_chain(length: int) -> CommandChainBuilder[int, int]:
+    builder = CommandChainBuilder[int, int].start(
+        0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result
+    )
+    for _ in range(length - 1):
+        builder = builder.then(
+            lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result
+        )
+    return builder
+
+
+def test_stream_yields_each_result_without_retaining():
+    queue = ThreadSafeCommandQueue()
+    chain = add_one_chain(5).build(queue, retain_results=False)
+    queue.submit(chain)
+    stream = chain.stream()
+    first = next(stream)
+    assert first == 1
+    # the next link has not been processed yet
+    assert len(queue) == 1
+    assert list(stream) == [2, 3, 4, 5]
+    assert chain.response.output_data == 5
+    assert chain.response.intermediate_results == []
+    assert chain.response.responses == []
+
+
+def test_stream_stops_on_failure():
+    queue = CommandQueue()
+    chain = (
+        add_one_chain(2)
+        .then(lambda x: AddOneArgs(number=x, should_fail=True), AddOneCommand, lambda r: r.result)
+        .then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda r: r.result)
+        .build(queue)
+    )
+    queue.submit(chain)
+    assert list(chain.stream()) == [1, 2]
+    assert chain.response.status == ResponseStatus.FAILED
+
+
+def test_stream_with_queue_processed_by_another_thread():
+    queue = ThreadSafeCommandQueue()
+    chain = add_one_chain(10).build(queue, retain_results=False)
+    queue.submit(chain)
+    stream = chain.stream(drive=False)
+    processor = threading.Thread(target=queue.process_all)
+    processor.start()
+    assert list(stream) == list(range(1, 11))
+    processor.join()
+
+
+def test_astream():
+    async def consume() -> list[int]:
+        queue = ThreadSafeCommandQueue()
+        chain = add_one_chain(3).gather(lambda x: x * 10).build(queue, retain_results=False)
+        queue.submit(chain)
+        return [result async for result in chain.astream()]
+
+    assert asyncio.run(consume()) == [1, 2, 3, 30]
+
+
+def test_stream_stops_when_a_link_raises():
+    def broken_extractor(response):
+        raise ValueError("cannot extract")
+
+    def broken_factory(x):
+        raise ValueError("cannot build args")
+
+    for chain_builder in (
+        add_one_chain(1).then(lambda x: AddOneArgs(number=x), AddOneCommand, broken_extractor),
+        add_one_chain(1).then(broken_factory, AddOneCommand, lambda r: r.result),
+    ):
+        queue = CommandQueue()
+        chain = chain_builder.then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda r: r.result).build(queue)
+        queue.submit(chain)
+        assert list(chain.stream()) == [1]
+        assert chain.response.status == ResponseStatus.FAILED
+        queue = CommandQueue()
+        chain = chain_builder.build(queue)
+        queue.submit(chain)
+
+        async def consume():
+            return [result async for result in chain.astream()]
+
+        assert asyncio.run(consume()) == [1]
+        assert chain.response.status == ResponseStatus.FAILED
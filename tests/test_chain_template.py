@@ -0,0 +1,50 @@
+import pytest
+
+from command_system import (
+    ChainTemplate,
+    CommandChainBuilder,
+    CommandChainLink,
+    CommandQueue,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+
+
+def add_two_template() -> ChainTemplate[int, int]:
+    return (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .compile()
+    )
+
+
+def test_instantiate():
+    template = add_two_template()
+    queue = CommandQueue()
+    chains = [template.instantiate(i, queue) for i in range(3)]
+    queue.submit_many(*chains)
+    queue.process_all()
+    assert [chain.response.output_data for chain in chains] == [2, 3, 4]
+    assert len(template) == 2
+
+
+def test_submit_many_advances_links_in_lockstep():
+    template = add_two_template()
+    queue = ThreadSafeCommandQueue()
+    responses = template.submit_many(range(100), queue)
+    assert queue.process_once().num_commands_processed == 100  # chains
+    assert queue.process_once().num_commands_processed == 100  # first links
+    assert queue.process_once().num_commands_processed == 100  # second links
+    assert len(queue) == 0
+    assert all(response.status == ResponseStatus.COMPLETED for response in responses)
+    assert [response.output_data for response in responses] == [i + 2 for i in range(100)]
+
+
+def test_compile_validates_links():
+    with pytest.raises(ValueError):
+        CommandChainBuilder[int, int](0, []).compile()
+    with pytest.raises(ValueError):
+        ChainTemplate([CommandChainLink(lambda x: x, int, lambda x: x)])  # type: ignore[arg-type]
@@ -142,3 +142,23 @@ def test_cannot_then_without_start():
             AddOneCommand,
             lambda response: response.result,
         )
+
+
+def test_builders_share_prefix():
+    base = CommandChainBuilder[int, int].start(
+        0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result
+    )
+    for _ in range(499):
+        base = base.then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+    double = base.then(lambda x: AddOneArgs(number=x * 2), AddOneCommand, lambda response: response.result)
+    triple = base.then(lambda x: AddOneArgs(number=x * 3), AddOneCommand, lambda response: response.result)
+    assert len(base) == len(base.links) == 500
+    assert len(double) == len(triple) == 501
+    assert double.links[:500] == base.links
+    assert double.links[-1] is not triple.links[-1]
+
+    queue = CommandQueue()
+    chains = [double.build(queue), triple.build(queue)]
+    queue.submit_many(*chains)
+    queue.process_all(max_total_iterations=10_000)
+    assert [chain.response.output_data for chain in chains] == [1001, 1501]
@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+import threading
+import time
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandJournal,
+    CommandQueue,
+    CommandResponse,
+    DeferResponse,
+    DependencyEntry,
+    ExecutionResponse,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+
+@dataclass
+class JournaledArgs(CommandArgs):
+    name: str
+    defer: bool = False
+
+
+class JournaledCommand(Command[JournaledArgs, CommandResponse]):
+    ARGS = JournaledArgs
+    _response_type = CommandResponse
+
+    def should_defer(self) -> DeferResponse:
+        if self.args.defer:
+            return DeferResponse.defer("Waiting for recovery.")
+        return DeferResponse.proceed()
+
+    def execute(self) -> ExecutionResponse:
+        return ExecutionResponse.success()
+
+
+def test_recover_pending_commands(tmp_path):
+    path = tmp_path / "queue.journal"
+    queue = CommandQueue(journal=CommandJournal(path))
+    done = JournaledCommand(JournaledArgs("done"))
+    waiting = JournaledCommand(JournaledArgs("waiting", defer=True))
+    never_submitted = JournaledCommand(JournaledArgs("never submitted"))
+    dependant = JournaledCommand(
+        JournaledArgs("dependant"),
+        dependencies=[
+            DependencyEntry(done, on_completed="proceed"),
+            DependencyEntry(waiting, on_pending="defer"),
+            DependencyEntry(never_submitted, on_pending="proceed"),
+        ],
+    )
+    queue.submit_many(done, dependant, waiting)
+    queue.process_once()
+    assert done.response.status == ResponseStatus.COMPLETED
+    assert len(queue) == 2
+    # the process "crashes" here, without closing the journal
+
+    recovered = CommandQueue.recover(path, [JournaledCommand])
+    assert len(recovered) == 2
+    recovered_dependant, recovered_waiting = recovered._queue
+    assert recovered_dependant.args == JournaledArgs("dependant")
+    assert recovered_waiting.args == JournaledArgs("waiting", defer=True)
+    dependencies = recovered_dependant._dependencies
+    assert [dependency.command.args.name for dependency in dependencies] == [
+        "done",
+        "waiting",
+        "never submitted",
+    ]
+    assert dependencies[0].command.response.status == ResponseStatus.COMPLETED
+    assert dependencies[1].command is recovered_waiting
+    assert dependencies[2].on_pending == "proceed"
+
+    recovered_waiting.args.defer = False
+    recovered.process_all()
+    assert recovered_dependant.response.status == ResponseStatus.COMPLETED
+    assert len(recovered) == 0
+    recovered._journal.close()
+
+    # the recovered queue kept journaling, so nothing is left to recover
+    assert len(CommandQueue.recover(path, [JournaledCommand])) == 0
+
+
+def test_recover_declared_then_submitted(tmp_path):
+    path = tmp_path / "queue.journal"
+    queue = ThreadSafeCommandQueue(journal=CommandJournal(path))
+    first = JournaledCommand(JournaledArgs("first"))
+    second = JournaledCommand(JournaledArgs("second"), dependencies=[first])
+    queue.submit_many(second, first)
+    queue._journal.commit()
+
+    recovered = CommandQueue.recover(path, {"test_journal.JournaledCommand": JournaledCommand})
+    assert [command.args.name for command in recovered._queue] == ["second", "first"]
+    recovered.process_all()
+    assert len(recovered) == 0
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    path = tmp_path / "queue.journal"
+    journal = CommandJournal(path)
+    queue = CommandQueue(journal=journal)
+    queue.submit_many(*(JournaledCommand(JournaledArgs(str(i))) for i in range(10)))
+    journal.close()
+    with open(path, "r+b") as file:
+        file.truncate(path.stat().st_size - 3)
+    recovered = CommandQueue.recover(path, [JournaledCommand])
+    assert [command.args.name for command in recovered._queue] == [str(i) for i in range(9)]
+    # the torn record was dropped, so records written after recovery are readable
+    recovered.submit(JournaledCommand(JournaledArgs("after recovery")))
+    recovered._journal.close()
+    recovered = CommandQueue.recover(path, [JournaledCommand])
+    assert len(recovered) == 10
+
+
+def test_group_commits_do_not_block_producers(tmp_path):
+    path = tmp_path / "queue.journal"
+    journal = CommandJournal(path, group_commit_bytes=1)
+    queue = ThreadSafeCommandQueue(journal=journal)
+    # hold the file like a slow fsync would, submitting must still return
+    with journal._io_lock:
+        submitter = threading.Thread(
+            target=lambda: queue.submit_many(*(JournaledCommand(JournaledArgs(str(i))) for i in range(5)))
+        )
+        submitter.start()
+        submitter.join(timeout=5)
+        assert not submitter.is_alive()
+    # the flusher commits in the background
+    deadline = time.monotonic() + 5
+    while journal._writer.buffer and time.monotonic() < deadline:
+        time.sleep(0.001)
+    with journal._io_lock:  # the write of the taken buffer has finished
+        pass
+    recovered = CommandQueue.recover(path, [JournaledCommand])
+    assert [command.args.name for command in recovered._queue] == [str(i) for i in range(5)]
+    journal.close()
+    recovered._journal.close()
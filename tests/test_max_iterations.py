@@ -1,12 +1,17 @@
+import math
 from dataclasses import dataclass
 from typing import Callable, Optional
 
+import pytest
+
 from command_system import (
     Command,
     CommandArgs,
     CommandQueue,
     CommandResponse,
+    DeferResponse,
     ExecutionResponse,
+    ReasonByCommandMethod,
     ResponseStatus,
 )
 
@@ -59,3 +64,44 @@ def test_max_iterations_process_all():
     queue_response = queue.process_all(max_total_iterations=100)
     assert queue_response.num_commands_processed == 100
     assert len(queue) == 50  # 50 remaining commands in the queue
+
+
+class CountVisitsCommand(RunFunctionCommand):
+    """Deferred forever, counts how many times the queue looked at it."""
+
+    def __init__(self, args: RunFunctionArgs):
+        super().__init__(args)
+        self.visits = 0
+
+    def should_defer(self) -> DeferResponse:
+        self.visits += 1
+        return DeferResponse(should_proceed=False, reason=ReasonByCommandMethod("waiting"))
+
+
+@pytest.mark.parametrize("num_commands, max_iterations", [(111, 100), (250, 40), (10, 3)])
+def test_bounded_passes_visit_every_command(num_commands, max_iterations):
+    queue = CommandQueue()
+    commands = [CountVisitsCommand(RunFunctionArgs()) for _ in range(num_commands)]
+    queue.submit_many(*commands)
+    passes = math.ceil(num_commands / max_iterations)
+    for _ in range(passes):
+        queue.process_once(max_iterations=max_iterations)
+    assert all(command.visits >= 1 for command in commands)
+    # visits are spread evenly, no command is looked at twice before every other one was looked at once
+    assert max(command.visits for command in commands) - min(command.visits for command in commands) <= 1
+    assert sum(command.visits for command in commands) == passes * max_iterations
+
+
+def test_resumed_pass_wraps_around_and_removes_finished_commands():
+    queue = CommandQueue()
+    waiting = [CountVisitsCommand(RunFunctionArgs()) for _ in range(3)]
+    finishing = [queue.submit(RunFunctionCommand(RunFunctionArgs())) for _ in range(3)]
+    queue.submit_many(*waiting)
+    queue.process_once(max_iterations=4)  # 3 finish, 1 deferred
+    assert [command.visits for command in waiting] == [1, 0, 0]
+    queue_response = queue.process_once(max_iterations=100)
+    # resumes at the second waiting command, wraps around to the first, and stops there
+    assert queue_response.num_commands_processed == 3
+    assert [command.visits for command in waiting] == [2, 1, 1]
+    assert all(response.status == ResponseStatus.COMPLETED for response in finishing)
+    assert len(queue) == 3
@@ -0,0 +1,92 @@
+from command_system import (
+    AdmissionController,
+    CommandQueue,
+    QueueMetrics,
+    RateLimit,
+    RateLimiter,
+    ShardedCommandQueue,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_defer_cancel import ExternalSystem, WaitToHelloArgs, WaitToHelloCommand
+
+
+def parse(text: str) -> dict[str, float]:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_counters_and_depth():
+    metrics = QueueMetrics()
+    queue = CommandQueue(metrics=metrics)
+    external_system = ExternalSystem()
+    queue.submit(WaitToHelloCommand(WaitToHelloArgs(external_system)))
+    queue.submit_many(
+        AddOneCommand(AddOneArgs(number=0)),
+        AddOneCommand(AddOneArgs(number=0, should_fail=True)),
+        AddOneCommand(AddOneArgs(number=0, should_cancel=True)),
+    )
+    queue.process_once()
+    samples = parse(metrics.render())
+    assert samples["command_queue_ingested_total"] == 4
+    assert samples["command_queue_deferrals_total"] == 1
+    assert samples["command_queue_successes_total"] == 1
+    assert samples["command_queue_failures_total"] == 1
+    assert samples["command_queue_cancellations_total"] == 1
+    assert samples["command_queue_depth"] == 1
+
+    external_system.name = "World"
+    queue.process_once()
+    samples = parse(metrics.render())
+    assert samples["command_queue_commands_processed_total"] == 5
+    assert samples["command_queue_successes_total"] == 2
+    assert samples["command_queue_depth"] == 0
+
+
+def test_latency_histograms():
+    metrics = QueueMetrics(latency_buckets_s=(1.0, 0.001))
+    queue = ThreadSafeCommandQueue(metrics=metrics)
+    for i in range(3):
+        queue.submit(AddOneCommand(AddOneArgs(number=i)))
+    queue.process_all()
+    text = metrics.render()
+    assert "# TYPE command_queue_execute_seconds histogram" in text
+    samples = parse(text)
+    labels = 'command_type="test_command_chain.AddOneCommand"'
+    assert samples[f'command_queue_execute_seconds_bucket{{{labels},le="0.001"}}'] == 3
+    assert samples[f'command_queue_execute_seconds_bucket{{{labels},le="1.0"}}'] == 3
+    assert samples[f'command_queue_execute_seconds_bucket{{{labels},le="+Inf"}}'] == 3
+    assert samples[f"command_queue_execute_seconds_count{{{labels}}}"] == 3
+    assert samples[f"command_queue_end_to_end_seconds_count{{{labels}}}"] == 3
+    assert samples[f"command_queue_queue_wait_seconds_count{{{labels}}}"] == 3
+    assert samples[f"command_queue_end_to_end_seconds_sum{{{labels}}}"] > 0
+
+
+def test_shared_between_shards():
+    metrics = QueueMetrics(namespace="sharded")
+    queue = ShardedCommandQueue(num_shards=3, metrics=metrics)
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(30)))
+    queue.process_all()
+    samples = parse(metrics.render())
+    assert samples["sharded_successes_total"] == 30
+    assert samples["sharded_depth"] == 0
+
+
+def test_parked_and_delayed_counters():
+    metrics = QueueMetrics()
+    limiter = RateLimiter({AddOneCommand: RateLimit(rate_per_s=0.001, burst=1)})
+    limited = CommandQueue(metrics=metrics, rate_limiter=limiter)
+    limited.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(3)))
+    limited.process_once()
+    throttled = CommandQueue(metrics=metrics, admission_controller=AdmissionController(max_budget=1))
+    throttled.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(3)))
+    throttled.process_once()
+    samples = parse(metrics.render())
+    assert samples["command_queue_parked_total"] == 2
+    assert samples["command_queue_delayed_total"] == 2
+    assert samples["command_queue_successes_total"] == 2
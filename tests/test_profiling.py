@@ -0,0 +1,113 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import pytest
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandQueue,
+    CommandResponse,
+    ExecutionResponse,
+    SamplingProfiler,
+    ShardedCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+
+
+@dataclass
+class SleepArgs(CommandArgs):
+    seconds: float
+
+
+class SleepCommand(Command[SleepArgs, CommandResponse]):
+    ARGS = SleepArgs
+    _response_type = CommandResponse
+
+    def execute(self) -> ExecutionResponse:
+        time.sleep(self.args.seconds)
+        return ExecutionResponse.success()
+
+
+def test_samples_every_execution():
+    profiler = SamplingProfiler(sample_every=1)
+    queue = CommandQueue(profiler=profiler)
+    for i in range(5):
+        queue.submit(AddOneCommand(AddOneArgs(number=i)))
+    queue.submit(SleepCommand(SleepArgs(seconds=0.01)))
+    queue.process_all()
+    estimates = profiler.estimates()
+    assert estimates[AddOneCommand].samples == 5
+    assert estimates[AddOneCommand].estimated_executions == 5
+    assert estimates[SleepCommand].avg_elapsed_ms >= 10
+    assert estimates[SleepCommand].std_error_ms == 0
+    assert estimates[SleepCommand].share > 0.5
+    assert sum(estimate.share for estimate in estimates.values()) == pytest.approx(1)
+
+
+def test_estimates_scale_up_samples():
+    profiler = SamplingProfiler(sample_every=10, seed=0)
+    queue = CommandQueue(profiler=profiler)
+    for i in range(2000):
+        queue.submit(AddOneCommand(AddOneArgs(number=i)))
+    queue.process_all(max_total_iterations=10_000)
+    estimate = profiler.estimates()[AddOneCommand]
+    assert 100 < estimate.samples < 300
+    assert estimate.estimated_executions == estimate.samples * 10
+    assert estimate.estimated_executions == pytest.approx(2000, rel=0.25)
+    assert estimate.estimated_total_ms == pytest.approx(
+        estimate.avg_elapsed_ms * estimate.estimated_executions
+    )
+
+    profiler.clear()
+    assert profiler.estimates() == {}
+
+
+def test_captures_slowest_profiles():
+    profiler = SamplingProfiler(sample_every=1, capture_slowest=2)
+    queue = CommandQueue(profiler=profiler)
+    for seconds in (0.001, 0.02, 0.0, 0.01):
+        queue.submit(SleepCommand(SleepArgs(seconds=seconds)))
+    queue.process_all()
+    slowest = profiler.slowest()
+    assert len(slowest) == 2
+    assert slowest[0].elapsed_ms >= slowest[1].elapsed_ms >= 10
+    assert slowest[0].args == repr(SleepArgs(seconds=0.02))
+    assert slowest[0].command_type is SleepCommand
+    assert "sleep" in slowest[0].stats()
+
+
+def test_shared_between_shards():
+    profiler = SamplingProfiler(sample_every=1)
+    queue = ShardedCommandQueue(num_shards=2, profiler=profiler)
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(20)))
+    assert queue.process_all().num_successes == 20
+    assert profiler.estimates()[AddOneCommand].samples == 20
+
+
+def test_sampling_gaps_are_thread_safe():
+    calls_per_thread = 20_000
+    sequential = SamplingProfiler(sample_every=7, seed=3)
+    expected = sum(sequential._should_sample() for _ in range(8 * calls_per_thread))
+    shared = SamplingProfiler(sample_every=7, seed=3)
+    sampled: list[int] = []
+
+    def sample() -> None:
+        sampled.append(sum(shared._should_sample() for _ in range(calls_per_thread)))
+
+    threads = [threading.Thread(target=sample) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every call consumes exactly one step of the seeded gap sequence, whatever the interleaving
+    assert sum(sampled) == expected
+
+
+def test_rejects_invalid_arguments():
+    with pytest.raises(ValueError):
+        SamplingProfiler(sample_every=0)
+    with pytest.raises(ValueError):
+        SamplingProfiler(capture_slowest=-1)
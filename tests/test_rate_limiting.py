@@ -0,0 +1,193 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import pytest
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandQueue,
+    CancelResponse,
+    CommandResponse,
+    DeferResponse,
+    ExecutionResponse,
+    RateLimit,
+    RateLimiter,
+    RemoteCommandQueue,
+    ResponseStatus,
+    ShardedCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_profiling import SleepArgs, SleepCommand
+
+
+@dataclass
+class CallApiArgs(CommandArgs):
+    host: str
+
+
+class CallApiCommand(Command[CallApiArgs, CommandResponse]):
+    ARGS = CallApiArgs
+    _response_type = CommandResponse
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, args: CallApiArgs):
+        super().__init__(args)
+        self.should_defer_calls = 0
+
+    def should_defer(self) -> DeferResponse:
+        self.should_defer_calls += 1
+        return DeferResponse(should_proceed=True)
+
+    def execute(self) -> ExecutionResponse:
+        cls = CallApiCommand
+        with cls.lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        time.sleep(0.02)
+        with cls.lock:
+            cls.running -= 1
+        return ExecutionResponse.success()
+
+
+@dataclass
+class DeadlineArgs(CommandArgs):
+    deadline: float
+    executed: list[float]
+
+
+class DeadlineCommand(Command[DeadlineArgs, CommandResponse]):
+    ARGS = DeadlineArgs
+    _response_type = CommandResponse
+
+    def should_cancel(self) -> CancelResponse:
+        if time.perf_counter() > self.args.deadline:
+            return CancelResponse.cancel("Missed its deadline")
+        return CancelResponse.proceed()
+
+    def execute(self) -> ExecutionResponse:
+        self.args.executed.append(self.args.deadline)
+        return ExecutionResponse.success()
+
+
+def test_rate_limit_parks_commands():
+    limiter = RateLimiter({AddOneCommand: RateLimit(rate_per_s=50, burst=2)})
+    queue = CommandQueue(rate_limiter=limiter)
+    commands = [AddOneCommand(AddOneArgs(number=i)) for i in range(6)]
+    finished: list[int] = []
+    for command in commands:
+        command.add_on_execute_callback(lambda response, command=command: finished.append(command.args.number))
+        queue.submit(command)
+    start = time.perf_counter()
+    queue_response = queue.process_all()
+    assert time.perf_counter() - start >= 4 / 50 * 0.9
+    assert queue_response.num_successes == 6
+    assert queue_response.num_parked == 4
+    assert queue_response.num_deferrals == 0
+    assert finished == list(range(6))  # parked commands keep their order
+    assert all(command.deferral_count == 0 for command in commands)
+
+
+def test_len_counts_parked_commands():
+    limiter = RateLimiter({AddOneCommand: RateLimit(rate_per_s=50, burst=2)})
+    queue = CommandQueue(rate_limiter=limiter)
+    queue.submit_many(*(AddOneCommand(AddOneArgs(number=i)) for i in range(6)))
+    queue.process_once()
+    assert len(queue) == 4
+    queue.process_all()
+    assert len(queue) == 0
+
+
+def test_parked_commands_are_not_polled():
+    limiter = RateLimiter({CallApiCommand: RateLimit(rate_per_s=20)})
+    queue = CommandQueue(rate_limiter=limiter)
+    commands = [CallApiCommand(CallApiArgs(host="a")) for _ in range(3)]
+    queue.submit_many(*commands)
+    assert queue.process_all().num_successes == 3
+    assert [command.should_defer_calls for command in commands] == [1, 1, 1]
+
+
+def test_custom_key_and_default_limit():
+    limiter = RateLimiter(
+        {"slow-api": RateLimit(rate_per_s=1)},
+        key=lambda command: command.args.host if isinstance(command, CallApiCommand) else None,
+        default=RateLimit(rate_per_s=1000, burst=10),
+    )
+    assert limiter.key_for(CallApiCommand(CallApiArgs(host="slow-api"))) == "slow-api"
+    assert limiter.key_for(AddOneCommand(AddOneArgs(number=0))) is None
+    queue = CommandQueue(rate_limiter=limiter)
+    slow = [queue.submit(CallApiCommand(CallApiArgs(host="slow-api"))) for _ in range(2)]
+    fast = [queue.submit(CallApiCommand(CallApiArgs(host="fast-api"))) for _ in range(5)]
+    unlimited = queue.submit(AddOneCommand(AddOneArgs(number=0)))
+    queue.process_once()
+    assert [response.status for response in slow] == [ResponseStatus.COMPLETED, ResponseStatus.PENDING]
+    assert all(response.status == ResponseStatus.COMPLETED for response in fast)
+    assert unlimited.status == ResponseStatus.COMPLETED
+    assert len(queue) == 1
+    assert limiter.available_tokens("slow-api") < 1
+
+
+def test_max_in_flight_across_shards():
+    CallApiCommand.max_running = 0
+    limiter = RateLimiter({CallApiCommand: RateLimit(max_in_flight=2)})
+    queue = ShardedCommandQueue(num_shards=4, ingest_batch_size=2, rate_limiter=limiter)
+    queue.submit_many(*(CallApiCommand(CallApiArgs(host="a")) for _ in range(12)))
+    assert queue.process_all().num_successes == 12
+    assert CallApiCommand.max_running == 2
+    assert limiter.in_flight(CallApiCommand) == 0
+
+
+def test_cancel_parked_command():
+    limiter = RateLimiter({AddOneCommand: RateLimit(rate_per_s=0.1)})
+    queue = CommandQueue(rate_limiter=limiter)
+    first = queue.submit(AddOneCommand(AddOneArgs(number=0)))
+    parked_command = AddOneCommand(AddOneArgs(number=1))
+    parked = queue.submit(parked_command)
+    queue.process_once()
+    assert first.status == ResponseStatus.COMPLETED
+    assert parked.status == ResponseStatus.PENDING
+    assert queue.cancel(parked_command)
+    queue.process_all()
+    assert parked.status == ResponseStatus.CANCELED
+    assert len(queue) == 0
+
+
+def test_parked_command_misses_its_deadline():
+    limiter = RateLimiter({DeadlineCommand: RateLimit(rate_per_s=20)})
+    queue = CommandQueue(rate_limiter=limiter)
+    executed: list[float] = []
+    first = queue.submit(DeadlineCommand(DeadlineArgs(deadline=float("inf"), executed=executed)))
+    # passes `should_cancel()` before it is parked, but the next token comes after its deadline
+    late = queue.submit(DeadlineCommand(DeadlineArgs(deadline=time.perf_counter() + 0.01, executed=executed)))
+    queue_response = queue.process_all()
+    assert first.status == ResponseStatus.COMPLETED
+    assert late.status == ResponseStatus.CANCELED
+    assert executed == [float("inf")]
+    assert queue_response.num_parked == 1
+    assert queue_response.num_cancellations == 1
+    assert limiter.in_flight(DeadlineCommand) == 0
+    assert len(queue) == 0
+
+
+def test_remote_in_flight_until_result():
+    limiter = RateLimiter({SleepCommand: RateLimit(max_in_flight=1)})
+    with RemoteCommandQueue.with_local_workers(num_workers=2, rate_limiter=limiter) as queue:
+        responses = [queue.submit(SleepCommand(SleepArgs(seconds=0.05))) for _ in range(4)]
+        start = time.perf_counter()
+        queue.process_all()
+        assert time.perf_counter() - start >= 4 * 0.05
+    assert all(response.status == ResponseStatus.COMPLETED for response in responses)
+    assert limiter.in_flight(SleepCommand) == 0
+
+
+def test_rejects_invalid_limits():
+    with pytest.raises(ValueError):
+        RateLimit(rate_per_s=0)
+    with pytest.raises(ValueError):
+        RateLimit(burst=0)
+    with pytest.raises(ValueError):
+        RateLimit(max_in_flight=0)
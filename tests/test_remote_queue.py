@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+import os
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandChainBuilder,
+    CommandResponse,
+    DependencyEntry,
+    ExecutionResponse,
+    InMemoryTracer,
+    QueueMetrics,
+    ReasonByCommandMethod,
+    RemoteCommandQueue,
+    ResponseStatus,
+)
+
+from test_profiling import SleepArgs, SleepCommand
+
+
+@dataclass
+class SquareArgs(CommandArgs):
+    number: int
+
+
+@dataclass
+class SquareResponse(CommandResponse):
+    result: int = 0
+    worker_pid: int = 0
+
+
+class SquareCommand(Command[SquareArgs, SquareResponse]):
+    ARGS = SquareArgs
+    _response_type = SquareResponse
+
+    def execute(self) -> ExecutionResponse:
+        if self.args.number < 0:
+            raise ValueError("Negative numbers are not allowed.")
+        self.response.result = self.args.number**2
+        self.response.worker_pid = os.getpid()
+        return ExecutionResponse.success()
+
+
+def test_remote_execution():
+    with RemoteCommandQueue.with_local_workers(num_workers=2, batch_size=8) as queue:
+        responses = [queue.submit(SquareCommand(SquareArgs(i))) for i in range(100)]
+        queue_response = queue.process_all(max_total_iterations=10_000)
+        assert queue_response.num_successes == 100
+        assert len(queue) == 0
+    assert [response.result for response in responses] == [i**2 for i in range(100)]
+    assert all(response.status == ResponseStatus.COMPLETED for response in responses)
+    assert os.getpid() not in {response.worker_pid for response in responses}
+
+
+def test_remote_failure_and_callbacks():
+    callback_results: list[bool] = []
+    with RemoteCommandQueue.with_local_workers(num_workers=1) as queue:
+        command = SquareCommand(SquareArgs(-1))
+        command.add_on_execute_callback(lambda response: callback_results.append(response.should_proceed))
+        response = queue.submit(command)
+        queue_response = queue.process_all()
+    assert response.status == ResponseStatus.FAILED
+    assert callback_results == [False]
+    assert queue_response.num_failures == 1
+    assert queue_response.command_log[-1].responses[-1].reason == ReasonByCommandMethod(
+        "Negative numbers are not allowed."
+    )
+
+
+def test_remote_dependencies_and_chains():
+    with RemoteCommandQueue.with_local_workers(num_workers=2) as queue:
+        first = SquareCommand(SquareArgs(2))
+        second = SquareCommand(SquareArgs(3), dependencies=[DependencyEntry(first)])
+        queue.submit_many(second, first)
+        chain = (
+            CommandChainBuilder[int, int]
+            .start(2, lambda x: SquareArgs(x), SquareCommand, lambda response: response.result)
+            .then(lambda x: SquareArgs(x), SquareCommand, lambda response: response.result)
+            .build(queue)
+        )
+        queue.submit(chain)
+        queue.process_all()
+    assert first.response.status == ResponseStatus.COMPLETED
+    assert second.response.result == 9
+    assert chain.response.status == ResponseStatus.COMPLETED
+    assert chain.response.output_data == 16
+
+
+def test_local_workers_forward_queue_options():
+    tracer = InMemoryTracer()
+    metrics = QueueMetrics()
+    with RemoteCommandQueue.with_local_workers(
+        num_workers=1, batch_size=4, tracer=tracer, metrics=metrics
+    ) as queue:
+        queue.submit_many(*(SquareCommand(SquareArgs(i)) for i in range(3)))
+        queue.process_all()
+    assert len([span for span in tracer.finished_spans if span.name.startswith("command ")]) == 3
+    assert "command_queue_successes_total 3" in metrics.render().splitlines()
+
+
+def test_dependant_waits_for_a_slow_remote_command():
+    with RemoteCommandQueue.with_local_workers(num_workers=1) as queue:
+        slow = SleepCommand(SleepArgs(seconds=0.3))
+        dependant = SquareCommand(SquareArgs(3), dependencies=[slow])
+        queue.submit_many(slow, dependant)
+        queue_response = queue.process_all()
+    assert not queue_response.reached_max_iterations
+    assert slow.response.status == ResponseStatus.COMPLETED
+    assert dependant.response.result == 9
+    # the dependant is only re-checked when a worker reports back, instead of on every poll
+    assert queue_response.num_deferrals <= 3
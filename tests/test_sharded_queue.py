@@ -0,0 +1,146 @@
+import threading
+import time
+from dataclasses import dataclass, field
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandResponse,
+    ExecutionResponse,
+    InMemoryTracer,
+    ResponseStatus,
+    ShardedCommandQueue,
+)
+
+
+@dataclass
+class RecordArgs(CommandArgs):
+    name: int
+    log: list[tuple[int, int]]
+    sleep_ms: float = 0
+    key: str = "default"
+
+
+@dataclass
+class RecordResponse(CommandResponse):
+    thread_id: int = field(default=0)
+
+
+class RecordCommand(Command[RecordArgs, RecordResponse]):
+    ARGS = RecordArgs
+    _response_type = RecordResponse
+
+    def execute(self) -> ExecutionResponse:
+        if self.args.sleep_ms:
+            time.sleep(self.args.sleep_ms / 1000)
+        self.response.thread_id = threading.get_ident()
+        self.args.log.append((self.args.name, threading.get_ident()))
+        return ExecutionResponse.success()
+
+
+def test_sharded_queue_processes_everything():
+    queue = ShardedCommandQueue(num_shards=4)
+    log: list[tuple[int, int]] = []
+    responses = queue.submit_many(*(RecordCommand(RecordArgs(i, log)) for i in range(1000)))
+    assert len(queue) == 1000
+    queue_response = queue.process_all(max_total_iterations=10_000)
+    assert all(response.status == ResponseStatus.COMPLETED for response in responses)
+    assert queue_response.num_successes == 1000
+    assert queue_response.num_ingested == 1000
+    assert queue_response.reached_max_iterations is False
+    assert len(queue) == 0
+    assert sorted(name for name, _ in log) == list(range(1000))
+
+
+def test_cross_shard_dependencies():
+    # round-robin puts every consecutive command on a different shard
+    queue = ShardedCommandQueue(num_shards=3)
+    log: list[tuple[int, int]] = []
+    previous = None
+    for i in range(30):
+        command = RecordCommand(
+            RecordArgs(i, log), dependencies=[previous] if previous is not None else None
+        )
+        queue.submit(command)
+        previous = command
+    queue.process_all(max_total_iterations=100_000)
+    assert [name for name, _ in log] == list(range(30))
+
+
+def test_work_stealing():
+    # every command hashes to the same shard, idle workers have to steal to help out
+    queue = ShardedCommandQueue(
+        num_shards=4, shard_key=lambda command: command.args.key, ingest_batch_size=4
+    )
+    log: list[tuple[int, int]] = []
+    responses = queue.submit_many(
+        *(RecordCommand(RecordArgs(i, log, sleep_ms=1)) for i in range(200))
+    )
+    assert sum(1 for shard in queue.shards if len(shard) > 0) == 1
+    queue.process_all(max_total_iterations=10_000)
+    assert all(response.status == ResponseStatus.COMPLETED for response in responses)
+    assert len({thread_id for _, thread_id in log}) > 1
+
+
+def test_max_iterations():
+    queue = ShardedCommandQueue(num_shards=2)
+    log: list[tuple[int, int]] = []
+    blocker = RecordCommand(RecordArgs(-1, log))
+    # never submitted, so the dependants defer forever
+    queue.submit_many(*(RecordCommand(RecordArgs(i, log), dependencies=[blocker]) for i in range(4)))
+    queue_response = queue.process_all(max_total_iterations=50)
+    assert queue_response.reached_max_iterations is True
+    # the budget is shared by the workers
+    assert queue_response.num_commands_processed == 50
+    assert queue_response.num_deferrals == 50
+    assert len(queue) == 4
+
+
+def test_steal_queued_commands():
+    queue = ShardedCommandQueue(num_shards=2, shard_key=lambda command: command.args.key)
+    log: list[tuple[int, int]] = []
+    blocker = RecordCommand(RecordArgs(-1, log))
+    commands = [RecordCommand(RecordArgs(i, log), dependencies=[blocker]) for i in range(6)]
+    queue.submit_many(*commands)
+    victim = next(shard for shard in queue.shards if len(shard) > 0)
+    victim.process_once()
+    assert victim.inbox_size() == 0
+    # ingested commands can only be stolen between passes
+    with victim._process_lock:
+        assert victim.steal_queued(3) == []
+    assert victim.steal_queued(4) == commands[2:]
+    assert len(victim) == 2
+    thief = next(shard for shard in queue.shards if shard is not victim)
+    assert queue._steal_into(thief) is False
+    assert queue._steal_into(thief, from_queues=True) is True
+    assert len(thief) == 1 and len(victim) == 1
+    assert queue._steal_into(thief, from_queues=True) is False
+    # nobody else would process the last command of a shard whose worker has exited
+    queue._exited_shards.add(victim)
+    assert queue._steal_into(thief, from_queues=True) is True
+    assert len(thief) == 2 and len(victim) == 0
+
+
+def test_stealing_keeps_submission_time_and_span():
+    tracer = InMemoryTracer()
+    queue = ShardedCommandQueue(num_shards=2, shard_key=lambda command: command.args.key, tracer=tracer)
+    log: list[tuple[int, int]] = []
+    blocker = RecordCommand(RecordArgs(-1, log))
+    ingested = [RecordCommand(RecordArgs(i, log), dependencies=[blocker]) for i in range(4)]
+    queue.submit_many(*ingested)
+    victim = next(shard for shard in queue.shards if len(shard) > 0)
+    thief = next(shard for shard in queue.shards if shard is not victim)
+    victim.process_once()
+    waiting = [RecordCommand(RecordArgs(i, log)) for i in range(4, 8)]
+    queue.submit_many(*waiting)
+    submitted_at = {command: command.submitted_at for command in ingested + waiting}
+    assert queue._steal_into(thief) is True
+    victim.process_once()
+    assert queue._steal_into(thief, from_queues=True) is True
+    assert all(command.submitted_at == submitted_at[command] for command in ingested + waiting)
+
+    queue.submit(blocker)
+    queue.process_all()
+    spans = [span for span in tracer.finished_spans if span.name == "command RecordCommand"]
+    # one span per command, ended by whichever shard finished it
+    assert len(spans) == 9
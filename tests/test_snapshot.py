@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from test_journal import JournaledArgs, JournaledCommand
+
+from command_system import (
+    CommandJournal,
+    CommandQueue,
+    DependencyEntry,
+    ResponseStatus,
+)
+
+
+def test_snapshot_and_restore(tmp_path):
+    path = tmp_path / "queue.snapshot"
+    queue = CommandQueue()
+    done = JournaledCommand(JournaledArgs("done"))
+    waiting = JournaledCommand(JournaledArgs("waiting", defer=True))
+    dependant = JournaledCommand(
+        JournaledArgs("dependant"),
+        dependencies=[done, DependencyEntry(waiting, on_canceled="proceed")],
+    )
+    queue.submit_many(done, waiting, dependant)
+    queue.process_once()
+    assert len(queue) == 2
+    queue.snapshot(path)
+
+    restored = CommandQueue.restore(path, [JournaledCommand])
+    restored_waiting, restored_dependant = restored._queue
+    assert restored_waiting.args == JournaledArgs("waiting", defer=True)
+    assert restored_waiting.response.status == ResponseStatus.PENDING
+    assert restored_waiting.deferral_count == 1
+    assert restored_dependant.response.status == ResponseStatus.PENDING
+    assert restored_dependant.deferral_count == 1
+    restored_done, restored_dependency = (
+        dependency.command for dependency in restored_dependant._dependencies
+    )
+    assert restored_done.response.status == ResponseStatus.COMPLETED
+    assert restored_dependency is restored_waiting
+    assert restored_dependant._dependencies[1].on_canceled == "proceed"
+
+    restored_waiting.args.defer = False
+    restored.process_all()
+    assert restored_dependant.response.status == ResponseStatus.COMPLETED
+
+
+def test_compaction(tmp_path):
+    journal_path = tmp_path / "queue.journal"
+    snapshot_path = tmp_path / "queue.snapshot"
+    queue = CommandQueue(journal=CommandJournal(journal_path))
+    finished = [JournaledCommand(JournaledArgs(f"finished {i}")) for i in range(100)]
+    waiting = JournaledCommand(JournaledArgs("waiting", defer=True))
+    queue.submit_many(*finished, waiting)
+    queue.process_once()
+    size_before = journal_path.stat().st_size
+
+    queue.compact(snapshot_path, background=True)
+    # records written while the snapshot is being written land in the new segment
+    dependant = JournaledCommand(JournaledArgs("dependant"), dependencies=[waiting, finished[0]])
+    queue.submit(dependant)
+    queue.process_once()
+    queue._journal.wait_for_compaction()
+
+    assert journal_path.stat().st_size < size_before
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("queue.journal.")]
+
+    recovered = CommandQueue.recover(journal_path, [JournaledCommand], snapshot_path=snapshot_path)
+    assert [command.args.name for command in recovered._queue] == ["waiting", "dependant"]
+    recovered_waiting, recovered_dependant = recovered._queue
+    recovered_dependencies = [dependency.command for dependency in recovered_dependant._dependencies]
+    assert recovered_dependencies[0] is recovered_waiting
+    assert recovered_dependencies[1].response.status == ResponseStatus.COMPLETED
+
+    # compacting again, and recovering afterwards, keeps the same state
+    recovered.compact(snapshot_path, background=False)
+    recovered_waiting.args.defer = False
+    recovered.process_all()
+    recovered._journal.close()
+    assert len(CommandQueue.recover(journal_path, [JournaledCommand], snapshot_path=snapshot_path)) == 0
+
+
+def test_recover_with_unfinished_compaction(tmp_path):
+    journal_path = tmp_path / "queue.journal"
+    snapshot_path = tmp_path / "queue.snapshot"
+    journal = CommandJournal(journal_path)
+    queue = CommandQueue(journal=journal)
+    queue.submit_many(*(JournaledCommand(JournaledArgs(str(i))) for i in range(3)))
+    journal.commit()
+    # simulate a crash after the journal was rotated, but before the snapshot was written
+    journal.close()
+    os.replace(journal_path, f"{journal_path}.1")
+    recovered = CommandQueue.recover(journal_path, [JournaledCommand], snapshot_path=snapshot_path)
+    assert [command.args.name for command in recovered._queue] == ["0", "1", "2"]
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc to list memory mappings")
+def test_replay_unmaps_files(tmp_path):
+    journal_path = tmp_path / "queue.journal"
+    snapshot_path = tmp_path / "queue.snapshot"
+    queue = CommandQueue(journal=CommandJournal(journal_path))
+    queue.submit_many(*(JournaledCommand(JournaledArgs(str(i))) for i in range(3)))
+    queue._journal.compact(snapshot_path, background=False)
+    queue.submit(JournaledCommand(JournaledArgs("after compaction")))
+    queue._journal.close()
+    recovered = CommandQueue.recover(journal_path, [JournaledCommand], snapshot_path=snapshot_path)
+    assert len(recovered) == 4
+    with open("/proc/self/maps") as maps:
+        assert str(tmp_path) not in maps.read()
+    recovered._journal.close()
@@ -0,0 +1,75 @@
+import threading
+from dataclasses import dataclass
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandResponse,
+    ExecutionResponse,
+    ResponseStatus,
+    ThreadSafeCommandQueue,
+)
+
+
+@dataclass
+class CountArgs(CommandArgs):
+    counter: list[int]
+
+
+class CountCommand(Command[CountArgs, CommandResponse]):
+    ARGS = CountArgs
+    _response_type = CommandResponse
+
+    def execute(self) -> ExecutionResponse:
+        self.args.counter.append(1)
+        return ExecutionResponse.success()
+
+
+def test_submit_is_deferred_to_next_pass():
+    queue = ThreadSafeCommandQueue()
+    counter: list[int] = []
+    response = queue.submit(CountCommand(CountArgs(counter)))
+    assert len(queue) == 1
+    assert response.status == ResponseStatus.CREATED
+    queue.process_once()
+    assert response.status == ResponseStatus.COMPLETED
+    assert len(queue) == 0
+
+
+def test_concurrent_producers():
+    queue = ThreadSafeCommandQueue()
+    counter: list[int] = []
+    NUM_PRODUCERS = 8
+    PER_PRODUCER = 500
+    responses: list[CommandResponse] = []
+    responses_lock = threading.Lock()
+    producers_done = threading.Event()
+
+    def produce():
+        local: list[CommandResponse] = []
+        for i in range(PER_PRODUCER):
+            if i % 2:
+                local.append(queue.submit(CountCommand(CountArgs(counter))))
+            else:
+                local.extend(queue.submit_many(CountCommand(CountArgs(counter))))
+        with responses_lock:
+            responses.extend(local)
+
+    def consume():
+        while not producers_done.is_set() or len(queue) > 0:
+            queue.process_once()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    producers = [threading.Thread(target=produce) for _ in range(NUM_PRODUCERS)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    producers_done.set()
+    consumer.join()
+
+    assert len(responses) == NUM_PRODUCERS * PER_PRODUCER
+    assert all(response.status == ResponseStatus.COMPLETED for response in responses)
+    assert len(counter) == NUM_PRODUCERS * PER_PRODUCER
+    assert len(queue) == 0
@@ -0,0 +1,126 @@
+import importlib
+import time
+from dataclasses import dataclass
+
+import pytest
+
+from command_system import (
+    Command,
+    CommandArgs,
+    CommandQueue,
+    CommandResponse,
+    DeferResponse,
+    ExecutionResponse,
+    ReasonByCommandMethod,
+    ResponseStatus,
+    ShardedCommandQueue,
+    ThreadSafeCommandQueue,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_profiling import SleepArgs, SleepCommand
+
+
+class FakeClock:
+    """Stands in for `perf_counter()` in `CommandQueue`, time only passes when a command sleeps on it."""
+
+    def __init__(self) -> None:
+        self.now_ms = 0
+
+    def __call__(self) -> float:
+        return self.now_ms / 1000
+
+    def sleep(self, seconds: float) -> None:
+        self.now_ms += round(seconds * 1000)
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(importlib.import_module("command_system.CommandQueue"), "perf_counter", clock)
+    return clock
+
+
+@dataclass
+class ClockSleepArgs(CommandArgs):
+    clock: FakeClock
+    seconds: float
+
+
+class ClockSleepCommand(Command[ClockSleepArgs, CommandResponse]):
+    ARGS = ClockSleepArgs
+    _response_type = CommandResponse
+
+    def execute(self) -> ExecutionResponse:
+        self.args.clock.sleep(self.args.seconds)
+        return ExecutionResponse.success()
+
+
+class BlockedClockSleepCommand(ClockSleepCommand):
+    """Takes a while to decide it is deferred, on every pass."""
+
+    def should_defer(self) -> DeferResponse:
+        self.args.clock.sleep(self.args.seconds)
+        return DeferResponse(should_proceed=False, reason=ReasonByCommandMethod("blocked"))
+
+
+def test_stops_when_the_budget_is_used_up(clock):
+    queue = CommandQueue()
+    responses = queue.submit_many(*(ClockSleepCommand(ClockSleepArgs(clock, 0.01)) for _ in range(10)))
+    queue_response = queue.process_once(time_budget_ms=25)
+    # the third command starts with 5ms left, the fourth would start after the deadline
+    assert clock.now_ms == 30
+    assert queue_response.reached_time_budget
+    assert not queue_response.reached_max_iterations
+    assert queue_response.num_successes == 3
+    assert [response.status for response in responses].count(ResponseStatus.COMPLETED) == 3
+    assert queue.process_all().num_successes == 7
+
+
+def test_resumes_where_the_previous_pass_stopped(clock):
+    queue = CommandQueue()
+    # deferred forever, so a pass that restarted from the front would never reach the back of the queue
+    queue.submit_many(*(BlockedClockSleepCommand(ClockSleepArgs(clock, 0.01)) for _ in range(3)))
+    last = queue.submit(AddOneCommand(AddOneArgs(number=0)))
+    for _ in range(4):
+        if last.status == ResponseStatus.COMPLETED:
+            break
+        queue.process_once(time_budget_ms=5)
+    assert last.status == ResponseStatus.COMPLETED
+
+
+def test_estimates_skip_commands_that_would_exceed_the_budget(clock):
+    queue = CommandQueue(timing_queue_length=10)
+    queue.submit(ClockSleepCommand(ClockSleepArgs(clock, 0.03)))
+    queue.process_once()  # measure it
+    queue.submit(AddOneCommand(AddOneArgs(number=0)))
+    slow = queue.submit(ClockSleepCommand(ClockSleepArgs(clock, 0.03)))
+    start_ms = clock.now_ms
+    queue_response = queue.process_once(time_budget_ms=20)
+    assert clock.now_ms == start_ms
+    assert queue_response.reached_time_budget
+    assert queue_response.num_successes == 1
+    # the next call starts with it, and always processes its first command
+    queue.process_once(time_budget_ms=20)
+    assert slow.status == ResponseStatus.COMPLETED
+
+
+def test_process_all_budget(clock):
+    queue = ThreadSafeCommandQueue()
+    queue.submit_many(*(ClockSleepCommand(ClockSleepArgs(clock, 0.01)) for _ in range(20)))
+    queue_response = queue.process_all(time_budget_ms=50)
+    assert clock.now_ms == 50
+    assert queue_response.reached_time_budget
+    assert len(queue) == 15
+
+
+def test_sharded_budget():
+    queue = ShardedCommandQueue(num_shards=2)
+    queue.submit_many(*(SleepCommand(SleepArgs(seconds=0.01)) for _ in range(40)))
+    start = time.perf_counter()
+    queue_response = queue.process_all(time_budget_ms=50)
+    # the workers run on real time, only check the order of magnitude
+    assert time.perf_counter() - start < 0.5
+    assert queue_response.reached_time_budget
+    assert len(queue) > 0
+    assert queue.process_all().num_successes + queue_response.num_successes == 40
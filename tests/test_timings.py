@@ -13,6 +13,8 @@ from command_system import (
     ResponseStatus,
 )
 
+from test_defer_cancel import ExternalSystem, WaitToHelloArgs, WaitToHelloCommand
+
 
 @dataclass
 class SleepArgs(CommandArgs):
@@ -128,3 +130,43 @@ def test_sleep_command_timing_many():
     assert 0 < sleep_data.should_defer_timing.std_dev_elapsed_ms < 10
     assert 0 < sleep_data.should_cancel_timing.std_dev_elapsed_ms < 10
     assert 0 < sleep_data.execute_timing.std_dev_elapsed_ms < 10
+
+
+def test_queue_wait_and_end_to_end_latency():
+    queue = CommandQueue(timing_queue_length=10)
+    WAIT_MS = 50
+    EXECUTE_TIME_MS = 30
+    first = SleepCommand(SleepArgs(execute_sleep_ms=EXECUTE_TIME_MS))
+    second = SleepCommand(SleepArgs(execute_sleep_ms=EXECUTE_TIME_MS))
+    queue.submit_many(first, second)
+    time.sleep(WAIT_MS / 1000)
+    queue.process_once()
+    assert first.submitted_at is not None and first.first_processed_at is not None
+    assert first.finished_at is not None
+    assert first.submitted_at < first.first_processed_at < first.finished_at
+
+    sleep_data = queue.get_timing_data()[SleepCommand]
+    assert sleep_data.queue_wait.count == 2
+    # sleeps never end early but can overrun on a busy machine, so only check the order of magnitude
+    assert WAIT_MS <= sleep_data.queue_wait.p50_elapsed_ms < 10 * WAIT_MS
+    # the second command also waited for the first one to execute
+    assert WAIT_MS + EXECUTE_TIME_MS <= sleep_data.queue_wait.p99_elapsed_ms < 10 * (WAIT_MS + EXECUTE_TIME_MS)
+    assert (
+        WAIT_MS + 2 * EXECUTE_TIME_MS
+        <= sleep_data.end_to_end.p99_elapsed_ms
+        < 10 * (WAIT_MS + 2 * EXECUTE_TIME_MS)
+    )
+    assert sleep_data.avg_deferral_count == 0
+
+
+def test_deferral_count():
+    queue = CommandQueue(timing_queue_length=10)
+    external_system = ExternalSystem()
+    command = WaitToHelloCommand(WaitToHelloArgs(external_system))
+    queue.submit(command)
+    for _ in range(3):
+        queue.process_once()
+    external_system.name = "World"
+    queue.process_once()
+    assert command.deferral_count == 3
+    assert queue.get_timing_data()[WaitToHelloCommand].avg_deferral_count == 3
@@ -0,0 +1,104 @@
+from command_system import (
+    CommandChainBuilder,
+    CommandQueue,
+    DependencyEntry,
+    InMemoryTracer,
+    ResponseStatus,
+)
+
+from test_command_chain import AddOneArgs, AddOneCommand
+from test_defer_cancel import ExternalSystem, WaitToHelloArgs, WaitToHelloCommand
+
+
+def command_spans(tracer: InMemoryTracer):
+    return [span for span in tracer.finished_spans if span.name.startswith("command ")]
+
+
+def test_span_per_command_with_lifecycle_children():
+    tracer = InMemoryTracer()
+    queue = CommandQueue(tracer=tracer)
+    external_system = ExternalSystem()
+    command = WaitToHelloCommand(WaitToHelloArgs(external_system))
+    queue.submit(command)
+    queue.process_once()
+    queue.process_once()
+    assert command_spans(tracer) == []  # still pending
+    external_system.name = "World"
+    queue.process_once()
+
+    [span] = command_spans(tracer)
+    assert span.name == "command WaitToHelloCommand"
+    assert span.attributes["command.type"].endswith("WaitToHelloCommand")
+    assert span.attributes["command.deferrals"] == 2
+    assert span.attributes["command.status"] == ResponseStatus.COMPLETED.value
+    children = [child.name for child in tracer.children(span)]
+    assert children.count("should_defer") == 3
+    assert children.count("on_defer_callbacks") == 2
+    assert children[-4:] == ["should_defer", "should_cancel", "execute", "on_execute_callbacks"]
+    for child in tracer.children(span):
+        assert child.end_time_ns is not None and child.start_time_ns <= child.end_time_ns
+
+
+def test_dependency_reasons_and_cancellation():
+    tracer = InMemoryTracer()
+    queue = CommandQueue(tracer=tracer)
+    failing = AddOneCommand(AddOneArgs(number=0, should_fail=True))
+    dependent = AddOneCommand(AddOneArgs(number=0), dependencies=[DependencyEntry(failing)])
+    queue.submit_many(dependent, failing)
+    queue.process_all()
+    spans = {span.attributes["command.status"]: span for span in command_spans(tracer)}
+    assert set(spans) == {ResponseStatus.FAILED.value, ResponseStatus.CANCELED.value}
+    canceled = spans[ResponseStatus.CANCELED.value]
+    assert canceled.attributes["command.deferrals"] == 1
+    assert "command.dependency_reasons" in canceled.attributes
+    assert [child.name for child in tracer.children(canceled)][-1] == "on_cancel_callbacks"
+
+
+def test_chain_links_are_parented_to_chain():
+    tracer = InMemoryTracer()
+    queue = CommandQueue(tracer=tracer)
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .then(lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .build(queue)
+    )
+    queue.submit(chain)
+    queue.process_all()
+    spans = command_spans(tracer)
+    [chain_span] = [span for span in spans if span.name == "command CommandChain"]
+    links = [span for span in spans if span.name == "command AddOneCommand"]
+    assert len(links) == 2
+    assert all(link.parent_id == chain_span.span_id for link in links)
+    # the chain's span lasts until its last link finished
+    assert chain_span.attributes["command.status"] == ResponseStatus.COMPLETED.value
+    assert chain_span.end_time_ns is not None
+    assert all(
+        link.end_time_ns is not None
+        and chain_span.start_time_ns <= link.start_time_ns
+        and link.end_time_ns <= chain_span.end_time_ns
+        for link in links
+    )
+
+
+def test_chain_span_fails_with_its_link():
+    tracer = InMemoryTracer()
+    queue = CommandQueue(tracer=tracer)
+    chain = (
+        CommandChainBuilder[int, int]
+        .start(0, lambda x: AddOneArgs(number=x), AddOneCommand, lambda response: response.result)
+        .then(lambda x: AddOneArgs(number=x, should_fail=True), AddOneCommand, lambda response: response.result)
+        .build(queue)
+    )
+    queue.submit(chain)
+    queue.process_all()
+    [chain_span] = [span for span in command_spans(tracer) if span.name == "command CommandChain"]
+    assert chain.response.status == ResponseStatus.FAILED
+    assert chain_span.attributes["command.status"] == ResponseStatus.FAILED.value
+
+
+def test_no_tracer_records_nothing():
+    queue = CommandQueue()
+    queue.submit(AddOneCommand(AddOneArgs(number=0)))
+    queue.process_all()
+    assert len(queue._traces) == 0
@@ -0,0 +1,78 @@
+import logging
+import time
+
+import pytest
+
+from command_system import (
+    CommandQueue,
+    CommandWatchdog,
+    QueueMetrics,
+    ReasonByTimeout,
+    RemoteCommandQueue,
+    ResponseStatus,
+)
+
+from test_profiling import SleepArgs, SleepCommand
+from test_remote_queue import SquareArgs, SquareCommand
+
+
+def test_reports_slow_execution(caplog):
+    metrics = QueueMetrics()
+    with CommandWatchdog(threshold_s=0.05) as watchdog:
+        queue = CommandQueue(metrics=metrics, watchdog=watchdog)
+        response = queue.submit(SleepCommand(SleepArgs(seconds=0.3)))
+        queue.submit(SleepCommand(SleepArgs(seconds=0)))
+        with caplog.at_level(logging.WARNING, logger="command_system.Watchdog"):
+            queue.process_all()
+    assert response.status == ResponseStatus.COMPLETED  # a local execution is only reported
+    [slow] = watchdog.slow_executions
+    assert slow.command_type is SleepCommand
+    assert slow.args == repr(SleepArgs(seconds=0.3))
+    assert slow.threshold_s == pytest.approx(0.05)
+    assert slow.elapsed_s >= 0.05
+    assert slow.stack is not None and "time.sleep" in slow.stack
+    assert not slow.timed_out
+    assert "SleepCommand has been executing for" in caplog.text
+    labels = 'command_type="test_profiling.SleepCommand"'
+    assert f"command_queue_slow_commands_total{{{labels}}} 1" in metrics.render()
+
+
+def test_per_type_thresholds():
+    class FastSleepCommand(SleepCommand):
+        pass
+
+    watchdog = CommandWatchdog(threshold_s=0.05, thresholds={SleepCommand: 10.0})
+    assert watchdog.threshold_for(FastSleepCommand) == 10.0
+    assert watchdog.threshold_for(SquareCommand) == 0.05
+    queue = CommandQueue(watchdog=watchdog)
+    queue.submit(FastSleepCommand(SleepArgs(seconds=0.15)))
+    queue.process_all()
+    watchdog.stop()
+    assert watchdog.slow_executions == []
+
+
+def test_remote_timeout_frees_the_command():
+    watchdog = CommandWatchdog(threshold_s=0.05, fail_on_timeout=True)
+    with RemoteCommandQueue.with_local_workers(num_workers=1, watchdog=watchdog) as queue:
+        slow = queue.submit(SleepCommand(SleepArgs(seconds=0.5)))
+        start = time.perf_counter()
+        queue_response = queue.process_all()
+        assert time.perf_counter() - start < 0.4
+        assert slow.status == ResponseStatus.FAILED
+        assert isinstance(queue_response.command_log[-1].responses[-1].reason, ReasonByTimeout)
+        assert len(queue) == 0
+        # the late result of the slow command is ignored
+        square = queue.submit(SquareCommand(SquareArgs(4)))
+        queue.process_all()
+        assert square.result == 16
+        assert slow.status == ResponseStatus.FAILED
+    watchdog.stop()
+    assert watchdog.slow_executions[0].timed_out
+    assert watchdog.slow_executions[0].stack is None
+
+
+def test_rejects_invalid_thresholds():
+    with pytest.raises(ValueError):
+        CommandWatchdog(threshold_s=0)
+    with pytest.raises(ValueError):
+        CommandWatchdog(thresholds={SleepCommand: -1.0})